@@ -1,680 +1,683 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash
+from flask import Flask, render_template, request, redirect, url_for, send_file, flash, jsonify, g, Response
 import os
+import re
+import hashlib
+import secrets
+import time
+import cProfile
+import logging
+import threading
 import uuid
+from contextlib import contextmanager
 from werkzeug.utils import secure_filename
-import PyPDF2
-import pdfplumber
-import pandas as pd
+from werkzeug.exceptions import RequestEntityTooLarge
 import pytesseract
-from PIL import Image
-import io
 import tempfile
 import shutil
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; set outputs are then only locked within a process
+    fcntl = None
+
+import pipeline
+from pipeline import create_excel_file
+from jobs import JobQueue
+from cache import ExtractionCache
+from layouts import LayoutIndex
+from invoices import InvoiceIndex
+from export import open_consolidated_writer, available_formats, APPENDABLE_FORMATS
+from ocr import shutdown_pool, DEFAULT_RESOLUTIONS, DEFAULT_MIN_CONFIDENCE, DEFAULT_ENGINE
+from metrics import registry, stage
+from uploads import stream_upload, format_limit, UploadError
+from storage import FileStore, Sweeper
+from cache import file_sha256
+from rollups import batch_rollups
+
+# Default install location of the Windows Tesseract installer
+WINDOWS_TESSERACT_CMD = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+def default_tesseract_cmd():
+    if os.name == 'nt' and os.path.exists(WINDOWS_TESSERACT_CMD):
+        return WINDOWS_TESSERACT_CMD
+    return None
+
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-here'
+# Random per start unless BILL_SECRET_KEY is set; set it so sessions survive restarts
+app.config['SECRET_KEY'] = secrets.token_hex(32)
 app.config['UPLOAD_FOLDER'] = os.path.abspath('uploads')
 app.config['PROCESSED_FOLDER'] = os.path.abspath('processed')
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
+# Uploads are streamed to disk, so a batch can be large; each file has its own limit
+app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB max per upload batch
+app.config['MAX_FILE_SIZE'] = 200 * 1024 * 1024  # 200MB max per file
+
+# OCR settings: process pool size, pages rendered at once (default: one per OCR worker), and the
+# resolutions tried per page
+app.config['OCR_WORKERS'] = os.cpu_count() or 1
+app.config['OCR_MAX_PAGES_IN_MEMORY'] = None
+app.config['OCR_RESOLUTIONS'] = DEFAULT_RESOLUTIONS
+app.config['OCR_MIN_CONFIDENCE'] = DEFAULT_MIN_CONFIDENCE
+# 'tesserocr' keeps Tesseract loaded in each worker, 'pytesseract' runs it per page; 'auto' prefers tesserocr
+app.config['OCR_ENGINE'] = DEFAULT_ENGINE
+# tesseract executable for the pytesseract engine; None uses the one on PATH
+app.config['TESSERACT_CMD'] = os.environ.get('TESSERACT_CMD') or default_tesseract_cmd()
+
+# Background job queue: local SQLite job store (default: data/jobs.db) and number of files
+# processed concurrently in each server process
+app.config['DATA_FOLDER'] = os.path.abspath('data')
+app.config['JOB_DATABASE'] = None
+app.config['JOB_WORKERS'] = 2
+# Extractions run at once per server process, including workbook rebuilds for downloads
+# (default: JOB_WORKERS)
+app.config['EXTRACTION_CONCURRENCY'] = None
+
+# Extraction cache keyed by file content hash (default: data/cache), evicted least-recently-used
+# past the size limit
+app.config['CACHE_FOLDER'] = None
+app.config['CACHE_MAX_BYTES'] = 500 * 1024 * 1024
+
+# Table detection: pdfplumber table settings (None for its defaults) and whether detection is
+# cropped to the line-item band of each page (off: it was not faster and drops tables outside the band)
+app.config['TABLE_SETTINGS'] = None
+app.config['TABLE_CROP'] = False
+
+# Memory: pages' parsed PDF objects are released once their tables are read; above
+# MEMORY_CEILING bytes of process memory (None for no limit) files are OCRed at the lowest
+# resolution only and their workbooks leave out the Raw_Text sheet
+app.config['RELEASE_PAGES'] = True
+app.config['MEMORY_CEILING'] = None
+
+# Vendor layout templates (default: data/layouts.db): known layouts skip table detection and
+# unknown ones are learned
+app.config['LAYOUT_TEMPLATES'] = True
+app.config['LAYOUT_DATABASE'] = None
+
+# Cross-batch invoice index in the job store: every finished file is indexed as an invoice and
+# flagged if it duplicates an earlier one (same file, or same invoice number and receiver GSTIN)
+app.config['INVOICE_INDEX'] = True
+
+# Instrumentation: structured per-job log (JSON lines, default: data/jobs.log) and opt-in cProfile
+# of single requests (?profile=1, saved to data/profiles)
+app.config['JOB_LOG'] = None
+app.config['PROFILING_ENABLED'] = False
+app.config['PROFILE_FOLDER'] = None
+
+# Retention of uploads/ and processed/: files older than STORAGE_MAX_AGE are deleted, then the
+# oldest while a directory is over its size limit; the sweeper runs every STORAGE_SWEEP_INTERVAL
+app.config['STORAGE_MAX_AGE'] = 7 * 24 * 60 * 60
+app.config['UPLOADS_MAX_BYTES'] = 10 * 1024 * 1024 * 1024
+app.config['PROCESSED_MAX_BYTES'] = 10 * 1024 * 1024 * 1024
+app.config['STORAGE_SWEEP_INTERVAL'] = 10 * 60
+# Per-file workbooks are built on first download from the extraction cache; set True to write
+# them while processing instead
+app.config['WRITE_FILE_WORKBOOKS'] = False
+
+# Any setting above can be overridden with a BILL_-prefixed environment variable, e.g.
+# BILL_SECRET_KEY=... or BILL_JOB_WORKERS=4 (values are parsed as JSON where possible)
+app.config.from_prefixed_env('BILL')
+app.config['JOB_DATABASE'] = app.config['JOB_DATABASE'] or os.path.join(app.config['DATA_FOLDER'], 'jobs.db')
+app.config['CACHE_FOLDER'] = app.config['CACHE_FOLDER'] or os.path.join(app.config['DATA_FOLDER'], 'cache')
+app.config['LAYOUT_DATABASE'] = app.config['LAYOUT_DATABASE'] or os.path.join(app.config['DATA_FOLDER'], 'layouts.db')
+app.config['JOB_LOG'] = app.config['JOB_LOG'] or os.path.join(app.config['DATA_FOLDER'], 'jobs.log')
+app.config['PROFILE_FOLDER'] = app.config['PROFILE_FOLDER'] or os.path.join(app.config['DATA_FOLDER'], 'profiles')
+app.config['OCR_MAX_PAGES_IN_MEMORY'] = app.config['OCR_MAX_PAGES_IN_MEMORY'] or app.config['OCR_WORKERS']
+app.config['EXTRACTION_CONCURRENCY'] = app.config['EXTRACTION_CONCURRENCY'] or app.config['JOB_WORKERS']
 
 # Ensure upload directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
+os.makedirs(app.config['DATA_FOLDER'], exist_ok=True)
+# Lock files serializing work on shared outputs across server processes
+LOCK_FOLDER = os.path.join(app.config['DATA_FOLDER'], 'locks')
+os.makedirs(LOCK_FOLDER, exist_ok=True)
 
-# Configure Tesseract path (adjust for your system)
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+if app.config['TESSERACT_CMD']:
+    pytesseract.pytesseract.tesseract_cmd = app.config['TESSERACT_CMD']
 
 ALLOWED_EXTENSIONS = {'pdf'}
+# Names of consolidation sets that uploads can be added to
+SET_NAME_RE = re.compile(r'^[\w][\w .-]{0,63}$')
+
+extraction_cache = ExtractionCache(app.config['CACHE_FOLDER'], app.config['CACHE_MAX_BYTES'])
+layout_index = LayoutIndex(app.config['LAYOUT_DATABASE']) if app.config['LAYOUT_TEMPLATES'] else None
+invoice_index = InvoiceIndex(app.config['JOB_DATABASE']) if app.config['INVOICE_INDEX'] else None
+
+upload_store = FileStore(app.config['UPLOAD_FOLDER'], app.config['STORAGE_MAX_AGE'], app.config['UPLOADS_MAX_BYTES'])
+processed_store = FileStore(app.config['PROCESSED_FOLDER'], app.config['STORAGE_MAX_AGE'],
+                            app.config['PROCESSED_MAX_BYTES'])
+storage_sweeper = Sweeper({'uploads': upload_store, 'processed': processed_store},
+                          interval=app.config['STORAGE_SWEEP_INTERVAL'])
+
+registry.add_gauge('bill_cache_hits', 'Extraction cache hits', lambda: extraction_cache.stats()['hits'])
+registry.add_gauge('bill_cache_misses', 'Extraction cache misses', lambda: extraction_cache.stats()['misses'])
+registry.add_gauge('bill_cache_bytes', 'Extraction cache size on disk', lambda: extraction_cache.stats()['bytes'])
+registry.add_gauge('bill_uploads_bytes', 'Size of uploads/ at the last sweep', lambda: upload_store.last_sweep['bytes'])
+registry.add_gauge('bill_processed_bytes', 'Size of processed/ at the last sweep',
+                   lambda: processed_store.last_sweep['bytes'])
+
+job_log_handler = logging.FileHandler(app.config['JOB_LOG'], encoding='utf-8')
+job_log_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.getLogger('bill.jobs').addHandler(job_log_handler)
+logging.getLogger('bill.jobs').setLevel(logging.INFO)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF using PyPDF2"""
-    text = ""
+@app.route('/')
+def index():
+    return render_template('index.html', export_formats=available_formats(),
+                           max_file_size=format_limit(app.config['MAX_FILE_SIZE']))
+
+@app.route('/upload', methods=['POST'])
+def upload_files():
+    # The body is streamed rather than parsed into request.files: each PDF is written to
+    # disk in chunks and queued for extraction as soon as it has arrived. The job is
+    # started at the first file, so the output format and consolidation set must come
+    # before the files in the form (or be given as ?format= and ?set=).
+    job = {}
+
+    def queue_file(fields, file_path, filename, unique_id, sha256, error):
+        if 'id' not in job:
+            output_format = request.args.get('format') or fields.get('format', 'xlsx')
+            if output_format not in available_formats():
+                raise UploadError(f'Unsupported output format: {output_format}')
+            set_name = (request.args.get('set') or fields.get('set') or '').strip() or None
+            if set_name and not SET_NAME_RE.match(set_name):
+                raise UploadError(f'Invalid consolidation set name: {set_name}')
+            job['id'] = job_queue.create(profile=profiling_requested(), set_name=set_name,
+                                         output_format=output_format)
+        job_queue.add_file(job['id'], file_path, filename, unique_id, sha256=sha256, error=error)
+
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() or ""
+        stream_upload(request.stream, request.content_type, upload_store, queue_file,
+                      allowed_file, max_file_bytes=app.config['MAX_FILE_SIZE'])
+        upload_error = None
+    except UploadError as e:
+        upload_error = str(e)
+    except RequestEntityTooLarge:
+        upload_error = f"Upload is larger than the {format_limit(app.config['MAX_CONTENT_LENGTH'])} batch limit"
     except Exception as e:
-        print(f"Error extracting text with PyPDF2: {e}")
-        # Fallback to pdfplumber
+        print(f"Error receiving upload: {e}")
+        upload_error = 'Upload was interrupted'
+
+    if 'id' not in job:
+        flash(upload_error or 'No selected files')
+        return redirect(url_for('index'))
+    # Files that did arrive are still processed when the rest of the upload failed
+    job_queue.seal(job['id'], error=upload_error)
+    job_id = job['id']
+
+    if wants_json():
+        return jsonify({
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id),
+            'results_url': url_for('job_results', job_id=job_id)
+        }), 202
+    return redirect(url_for('job_page', job_id=job_id))
+
+def wants_json():
+    """True when the client prefers a JSON response over HTML"""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+def open_job_output(job_id, output_format='xlsx'):
+    """Consolidated output file for a job; rows are streamed in as each file finishes"""
+    return open_consolidated_writer(output_format, processed_store.path(f"consolidated_{job_id}.{output_format}"))
+
+# Outputs being built on request, so concurrent downloads of the same file build it once
+output_locks = {}
+output_locks_guard = threading.Lock()
+
+@contextmanager
+def output_lock(filename):
+    """This process's lock for building an output file; check for the file again once it is held"""
+    with output_locks_guard:
+        lock = output_locks.setdefault(filename, threading.Lock())
+    with lock:
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    text += page.extract_text() or ""
-        except Exception as e2:
-            print(f"Error extracting text with pdfplumber: {e2}")
-            return ""
-
-    return text
-
-def extract_tables_from_pdf(pdf_path):
-    """Extract tables from PDF using pdfplumber"""
-    tables_data = []
+            yield
+        finally:
+            with output_locks_guard:
+                output_locks.pop(filename, None)
+
+def write_atomically(output_path, write):
+    """Call write(path) with a temporary file next to output_path, then move it into place
+
+    A download never sees a partial file, and a failed write leaves nothing behind
+    under the final name.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(output_path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(output_path))
+    os.close(fd)
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                tables = page.extract_tables()
-                for table_idx, table in enumerate(tables):
-                    if table:
-                        # Convert to DataFrame for easier handling
-                        df = pd.DataFrame(table)
-                        tables_data.append({
-                            'page': page_num + 1,
-                            'table_index': table_idx + 1,
-                            'data': df
-                        })
-    except Exception as e:
-        print(f"Error extracting tables: {e}")
-
-    return tables_data
+        write(tmp_path)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_consolidated(output_format, output_path, rows):
+    """Write rows to a consolidated output file atomically (see write_atomically)"""
+    def write(path):
+        with open_consolidated_writer(output_format, path) as writer:
+            writer.write_rows(rows)
+    write_atomically(output_path, write)
+
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    job = job_queue.status(job_id)
+    if job is None:
+        flash('Job not found')
+        return redirect(url_for('index'))
+    return render_template('job.html', job=job)
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    job = job_queue.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/results')
+def job_results(job_id):
+    job = job_queue.status(job_id)
+    if job is None:
+        flash('Job not found')
+        return redirect(url_for('index'))
+    if job['status'] not in ('done', 'error'):
+        return redirect(url_for('job_page', job_id=job_id))
 
-def perform_ocr_on_image(image):
-    """Perform OCR on PIL Image"""
-    try:
-        text = pytesseract.image_to_string(image)
-        return text
-    except Exception as e:
-        print(f"OCR error: {e}")
-        return ""
+    # Only the summary is rendered; rows and files are loaded page by page from the JSON API
+    return render_template('results.html',
+                         excel_download=job['excel_filename'],
+                         consolidated=True,
+                         row_count=job_queue.row_count(job_id),
+                         file_count=job['total_files'],
+                         job_id=job_id,
+                         set_name=job['set_name'],
+                         export_formats=available_formats())
 
-def extract_text_with_ocr(pdf_path):
-    """Extract text from scanned PDF using OCR"""
-    text = ""
+def page_size(default):
     try:
-        # Use pdfplumber to convert pages to images for OCR
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                # Convert page to image
-                img = page.to_image(resolution=300).original
-                page_text = perform_ocr_on_image(img)
-                text += f"\n--- Page {page_num + 1} ---\n{page_text}"
-    except Exception as e:
-        print(f"OCR extraction error: {e}")
-
-    return text
-
-def parse_invoice_data(text, pdf_path=None):
-    """Parse common invoice fields from extracted text and tables"""
-    import re
-
-    # First extract common fields that apply to the entire invoice
-    common_data = {}
-
-    # Common patterns for invoice header data
-    header_patterns = {
-        'invoice_no': r'(?:#\s*:?\s*|Invoice\s*#?\s*:?\s*|INVOICE\s*NO\.?\s*:?\s*)([A-Z0-9\-/]+)',
-        'date': r'(?:Invoice\s*Date\s*:?\s*|DATE\s*:?\s*|Date\s*:?\s*)([\d/.\-]+)',
-        # 'receiver_name': r'(?:Bill\s*To|Receiver|Billed\s*to)\s*[:.-]\s*([A-Za-z0-9\s.,]+)', # Commented out
-        # 'receiver_gst': r'(?:GSTIN\s*:?\s*|GST\s*#?\s*:?\s*)([A-Z0-9]{15})', # Commented out - too generic, picks up sender GST
-        'taxrate': r'(?:CGST|SGST)\s*(\d+(?:\.\d+)?)\s*%',
-        'cgst': r'CGST\d*\s*\(\d+%\)\s*([\d,]+\.?\d*)',
-        'sgst': r'SGST\d*\s*\(\d+%\)\s*([\d,]+\.?\d*)',
-        'invoice_value': r'(?:Total\s*:?\s*|TOTAL\s*:?\s*)(?:Rs\.?|INR|₹)?\s*([\d,]+\.?\d*)',
-        'total_invoice_value': r'(?:Balance\s*Due\s*:?\s*|GRAND\s*TOTAL\s*:?\s*|FINAL\s*TOTAL\s*:?\s*)(?:Rs\.?|INR|₹)?\s*([\d,]+\.?\d*)'
+        return int(request.args.get('limit', default))
+    except ValueError:
+        return default
+
+@app.route('/jobs/<job_id>/rows')
+def job_rows(job_id):
+    """Parsed rows of a job, a page at a time: ?cursor=&limit=&file=&invoice_no=&hsn="""
+    filters = {
+        'unique_id': request.args.get('file'),
+        'invoice_no': request.args.get('invoice_no'),
+        'hsn': request.args.get('hsn')
     }
+    cursor = request.args.get('cursor')
+    try:
+        rows, next_cursor = job_queue.rows(job_id, cursor, page_size(100), **filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    page = {'rows': rows, 'next_cursor': next_cursor}
+    if not cursor:
+        page['total'] = job_queue.row_count(job_id, **filters)
+    return jsonify(page)
+
+@app.route('/jobs/<job_id>/files')
+def job_files(job_id):
+    """Per-file summaries of a job, a page at a time: ?cursor=&limit="""
+    try:
+        files, next_cursor = job_queue.files(job_id, request.args.get('cursor'), page_size(20))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({'files': files, 'next_cursor': next_cursor})
+
+@app.route('/jobs/<job_id>/rollups')
+def job_rollups(job_id):
+    """Totals across the whole batch per receiver GST, HSN or tax rate: ?by=receiver_gst|hsn|taxrate"""
+    by = request.args.get('by', 'receiver_gst')
+    try:
+        return jsonify({'by': by, 'groups': batch_rollups(job_queue.iter_rows(job_id), by)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/jobs/<job_id>/files/<int:position>')
+def job_file(job_id, position):
+    result = job_queue.file_result(job_id, position)
+    if result is None:
+        return jsonify({'error': 'File not found'}), 404
+    return jsonify(result)
+
+@app.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    job = job_queue.status(job_id)
+    if job is None or not job['excel_filename']:
+        flash('File not found')
+        return redirect(url_for('index'))
 
-    # Extract header data using regex patterns
-    for field, pattern in header_patterns.items():
-        match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
-        if match:
-            value = match.group(1).strip()
-            # Clean up the value
-            value = re.sub(r'[^\w\s.,/-]', '', value)  # Remove special characters except common ones
-            common_data[field] = value
-
-    # Specialized extraction for Receiver Name
-    # Matches "Bill To" followed optionally by : or . and surrounding whitespace/newlines, then captures the next meaningful lines (up to 3)
-    # This handles cases where the next line is "Ship To" (interleaved headers) or empty
-    rec_name_pattern = r'(?:Bill\s*To|Receiver|Billed\s*to)\s*[:\.]?\s*((?:[^\r\n]+[\r\n]*){1,4})'
-    rec_name_match = re.search(rec_name_pattern, text, re.IGNORECASE)
-    if rec_name_match:
-        # Get the block of text following "Bill To"
-        candidate_lines = rec_name_match.group(1).splitlines()
-        for line in candidate_lines:
-            clean_name = line.strip()
-            # Skip if it's too short, or is a known header keyword like "Ship To", "GSTIN", "Date"
-            # converting to lower for checks
-            check = clean_name.lower()
-            if (len(clean_name) > 2 and 
-                not any(x in check for x in ['gstin', 'invoice', 'date', 'ship to', 'shipment', 'place of supply', 'terms'])):
-                 # Further cleanup: sometimes "Receiver: Name" is captured, we want just "Name"
-                 clean_name = re.sub(r'^(?:M/s|Mr\.|Mrs\.|Dr\.)\s*', '', clean_name, flags=re.IGNORECASE)
-                 common_data['receiver_name'] = clean_name
-                 break # Found a valid name line, stop looking
-
-    # Specialized extraction for Receiver GST (prioritize Bill To section)
-    # Strategy: Look for "Bill To" followed by "GSTIN" within reasonable distance
-    receiver_gst_match = re.search(r'(?:Bill\s*To|Receiver|Billed\s*to)[\s\S]{0,500}?(?:GSTIN|GST\s*#?)[\s.:]*([A-Z0-9]{15})', text, re.IGNORECASE | re.MULTILINE)
-    if receiver_gst_match:
-         common_data['receiver_gst'] = receiver_gst_match.group(1).strip()
-    else:
-        # Fallback: Find ALL GSTs and if there are multiple, assume the second one is receiver
-        # If there's only one, it might be the only one present.
-        all_gsts = re.findall(r'(?:GSTIN\s*:?\s*|GST\s*#?\s*:?\s*)([A-Z0-9]{15})', text, re.IGNORECASE)
-        # 09BBDPY4789B1Z5 is the sender's GST (hardcoded check only if strictly necessary, strictly context is better)
-        if all_gsts:
-             if len(all_gsts) > 1:
-                 # Usually first is sender, second is receiver
-                 common_data['receiver_gst'] = all_gsts[1]
-             else:
-                 common_data['receiver_gst'] = all_gsts[0]
-
-    # Extract table data to get all line items
-    all_items = []
-    if pdf_path:
+    # Other formats, and an output the sweeper removed, are written from the job's stored rows
+    output_format = request.args.get('format')
+    if output_format and output_format not in available_formats():
+        flash(f'Unsupported output format: {output_format}')
+        return redirect(url_for('job_results', job_id=job_id))
+    output_filename = job['excel_filename']
+    if output_format and not output_filename.endswith(f'.{output_format}'):
+        output_filename = f"consolidated_{job_id}.{output_format}"
+    if processed_store.find(output_filename) is None and build_output(output_filename) is None:
+        flash('Could not write the file, please try again')
+        return redirect(url_for('job_results', job_id=job_id))
+    return download_file(output_filename)
+
+# Consolidated output of a job: consolidated_<job id>.<format>
+CONSOLIDATED_RE = re.compile(r'^consolidated_([\w-]+)\.(\w+)$')
+
+def build_output(filename):
+    """Write a finished job's consolidated output from its stored rows; returns its path or None
+
+    Used for formats other than the job's own, and for outputs the sweeper removed.
+    """
+    match = CONSOLIDATED_RE.match(filename)
+    if match is None or match.group(2) not in available_formats():
+        return None
+    job_id, output_format = match.groups()
+    job = job_queue.status(job_id)
+    if job is None or not job['excel_filename']:
+        return None
+    with output_lock(filename):
+        existing = processed_store.find(filename)
+        if existing:
+            return existing  # Built by a concurrent request
+        output_path = processed_store.path(filename)
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    tables = page.extract_tables()
-                    for table in tables:
-                        if not table:
-                            continue
-
-                        # Try to identify column indices from a header row
-                        # Scan first few rows to find a likely header row
-                        header_row = None
-                        header_row_idx = -1
-                        
-                        for idx, row in enumerate(table[:10]): # Look at first 10 rows
-                            row_str = str(row).lower()
-                            # Check for key columns that signify a header
-                            if 'description' in row_str or 'qty' in row_str or ('hsn' in row_str and 'sac' in row_str):
-                                header_row = row
-                                header_row_idx = idx
-                                break
-                        
-                        if header_row is None:
-                             header_row = table[0]
-                             header_row_idx = 0
-
-                        col_map = {}
-                        
-                        # Helper to find column index from keywords
-                        def find_col_idx(headers, keywords):
-                            for idx, h in enumerate(headers):
-                                if h and any(k in str(h).lower() for k in keywords):
-                                    return idx
-                            return None
-
-                        # Map columns dynamically based on headers
-                        col_map['sno'] = find_col_idx(header_row, ['s.no', 'serial', 'sr.', 'no.'])
-                        col_map['hsn'] = find_col_idx(header_row, ['hsn', 'sac', 'code'])
-                        col_map['qty'] = find_col_idx(header_row, ['qty', 'quantity', 'unit'])
-                        col_map['rate'] = find_col_idx(header_row, ['rate', 'taxable', 'price'])
-                        col_map['discount'] = find_col_idx(header_row, ['disc', 'less'])
-                        
-                        # Special handling for Tax columns: prefer "Amount" or "Amt" specific columns if available
-                        # But often they are just labeled "CGST", "SGST" and split into Rate/Amt
-                        col_map['cgst'] = find_col_idx(header_row, ['cgst'])
-                        col_map['sgst'] = find_col_idx(header_row, ['sgst'])
-                        col_map['amount'] = find_col_idx(header_row, ['amount', 'total', 'value'])
-
-                        # Check if sub-headers exist (row after header) for Tax Amount
-                        if header_row_idx + 1 < len(table):
-                             sub_header = table[header_row_idx + 1]
-                             # If we found a CGST column, check if 'Amt' is near it in sub-header
-                             if col_map['cgst'] is not None:
-                                 # Look at columns starting from cgst idx
-                                 for offset in range(3): # Check current and next 2 cols
-                                     chk_idx = col_map['cgst'] + offset
-                                     if chk_idx < len(sub_header):
-                                         val = str(sub_header[chk_idx]).lower()
-                                         if 'amt' in val or 'amount' in val:
-                                             col_map['cgst_amt_idx'] = chk_idx
-                                             break
-                             
-                             if col_map['sgst'] is not None:
-                                 for offset in range(3):
-                                     chk_idx = col_map['sgst'] + offset
-                                     if chk_idx < len(sub_header):
-                                         val = str(sub_header[chk_idx]).lower()
-                                         if 'amt' in val or 'amount' in val:
-                                             col_map['sgst_amt_idx'] = chk_idx
-                                             break
-                        
-                        # If we didn't find clear headers (especially HSN), likely the specific original format
-                        # or a format with complex headers. Fallback to original hardcoded indices for backward compatibility
-                        # but check length effectively.
-                        if col_map.get('hsn') is None:
-                            col_map = {
-                                'sno': 1, 'hsn': 3, 'qty': 4, 'rate': 5, 
-                                'discount': 6, 'cgst': 10, 'sgst': 12, 'amount': 13
-                            }
-
-                        for row_idx, row in enumerate(table):
-                            # Skip header rows
-                            if row_idx <= header_row_idx:
-                                continue
-                            # Skip sub-header row if it looks like one (contains 'Amt', '%')
-                            if row_idx == header_row_idx + 1 and any(x in str(row).lower() for x in ['amt', '%']):
-                                continue
-
-                            # Safe extraction helper
-                            def get_val(idx):
-                                if idx is not None and isinstance(idx, int) and 0 <= idx < len(row):
-                                    return row[idx]
-                                return ''
-
-                            hsn_val = get_val(col_map.get('hsn'))
-                            qty_val = get_val(col_map.get('qty'))
-                            rate_val = get_val(col_map.get('rate'))
-                            discount_val = get_val(col_map.get('discount'))
-                            
-                            # Use found amount indices if available, else fallback to standard
-                            cgst_val = get_val(col_map.get('cgst_amt_idx', col_map.get('cgst')))
-                            sgst_val = get_val(col_map.get('sgst_amt_idx', col_map.get('sgst')))
-                            
-                            # Heuristic fix: If extracted GST value looks like a Rate (e.g. "9", "9%") and not an Amount,
-                            # and we didn't find an explicit 'Amt' column, try to look ahead for the amount.
-                            if not col_map.get('cgst_amt_idx') and cgst_val and re.match(r'^\d+(\.\d+)?\s*%?$', str(cgst_val).strip()):
-                                # Current value is likely a rate. Check next 2 columns for an amount.
-                                base_idx = col_map.get('cgst')
-                                if base_idx is not None:
-                                    for offset in [1, 2]:
-                                        next_val = get_val(base_idx + offset)
-                                        if next_val and re.match(r'[\d,]+\.\d{2}', str(next_val).strip()):
-                                            cgst_val = next_val
-                                            break
-
-                            if not col_map.get('sgst_amt_idx') and sgst_val and re.match(r'^\d+(\.\d+)?\s*%?$', str(sgst_val).strip()):
-                                base_idx = col_map.get('sgst')
-                                if base_idx is not None:
-                                    for offset in [1, 2]:
-                                        next_val = get_val(base_idx + offset)
-                                        if next_val and re.match(r'[\d,]+\.\d{2}', str(next_val).strip()):
-                                            sgst_val = next_val
-                                            break
-                            
-                            invoice_val = get_val(col_map.get('amount'))
-                            sno_val = get_val(col_map.get('sno'))
-
-                            # Check if this row contains valid item data
-                            hsn_clean = str(hsn_val).strip().replace('\n', '').replace(' ', '')
-                            
-                            # Valid item row: has serial number (digits) and HSN (digits)
-                            # Relaxed check: if we have HSN and (SNO or some value), consider it valid
-                            if (hsn_clean and re.search(r'\d{2,8}', hsn_clean)):
-                                item_data = {
-                                    'sno': str(sno_val).strip() if sno_val else str(len(all_items) + 1),
-                                    'hsn': str(hsn_val).strip(),
-                                    'quantity': '',
-                                    'taxable_amount': '',
-                                    'discount': '',
-                                    'taxrate': '18%',  # Default GST rate
-                                    'cgst': '',
-                                    'sgst': '',
-                                    'invoice_value': ''
-                                }
-
-                                # Extract quantity
-                                if qty_val:
-                                    qty_match = re.search(r'([\d,]+\.?\d*)', str(qty_val).strip())
-                                    if qty_match:
-                                        item_data['quantity'] = qty_match.group(1)
-
-                                # Extract taxable amount (rate)
-                                if rate_val:
-                                    rate_match = re.search(r'([\d,]+\.?\d*)', str(rate_val).strip())
-                                    if rate_match:
-                                        item_data['taxable_amount'] = rate_match.group(1)
-
-                                # Extract discount
-                                if discount_val:
-                                    item_data['discount'] = str(discount_val).strip()
-
-                                # Extract CGST
-                                if cgst_val:
-                                    cgst_match = re.search(r'([\d,]+\.?\d*)', str(cgst_val).strip())
-                                    if cgst_match:
-                                        item_data['cgst'] = cgst_match.group(1)
-
-                                # Extract SGST
-                                if sgst_val:
-                                    sgst_match = re.search(r'([\d,]+\.?\d*)', str(sgst_val).strip())
-                                    if sgst_match:
-                                        item_data['sgst'] = sgst_match.group(1)
-
-                                # Extract invoice value (amount for this line)
-                                if invoice_val:
-                                    invoice_match = re.search(r'([\d,]+\.?\d*)', str(invoice_val).strip())
-                                    if invoice_match:
-                                        item_data['invoice_value'] = invoice_match.group(1)
-
-                                all_items.append(item_data)
+            write_consolidated(output_format, output_path, job_queue.iter_rows(job_id))
         except Exception as e:
-            print(f"Error extracting table data: {e}")
-
-    # Aggregation Logic
-    if all_items:
-        aggregated_items = {}
-        for item in all_items:
-            hsn = item['hsn']
-            if not hsn: # Skip if no HSN
-                continue
-
-            if hsn not in aggregated_items:
-                aggregated_items[hsn] = {
-                    'sno': item['sno'], # Keep first SNO
-                    'hsn': hsn,
-                    'quantity': 0.0,
-                    'taxable_amount': 0.0,
-                    'taxrate': item['taxrate'], # Assume same for same HSN
-                    'cgst': 0.0,
-                    'sgst': 0.0,
-                    'invoice_value': 0.0,
-                    'count': 0
-                }
-            
-            # Helper to safely parse float
-            def parse_float(val):
-                try:
-                    return float(str(val).replace(',', ''))
-                except (ValueError, TypeError):
-                    return 0.0
-
-            # Aggregate values
-            agg = aggregated_items[hsn]
-            agg['quantity'] += parse_float(item['quantity'])
-            
-            # For taxable_amount aggregation, use the Amount column (invoice_value) instead of Rate
-            agg['taxable_amount'] += parse_float(item['invoice_value'])
-            
-            agg['cgst'] += parse_float(item['cgst'])
-            agg['sgst'] += parse_float(item['sgst'])
-            agg['invoice_value'] += parse_float(item['invoice_value'])
-            agg['count'] += 1
-
-
-        # Replace all_items with aggregated list
-        if aggregated_items:
-             new_all_items = []
-             calculated_total_value = 0.0
-             for idx, (hsn, agg) in enumerate(aggregated_items.items(), 1):
-                 
-                 # Calculate Invoice Value = Taxable + CGST + SGST (per user request)
-                 # Note: taxable_amount here is already summing the 'Amount' column from original data
-                 # If original Amount column included tax, adding tax again would double count.
-                 # Assuming 'Amount' column was Taxable Value.
-                 # User specific request: "in the invoice value cell write the sum of taxable amount cgst sgst"
-                 
-                 # Since we updated taxable_amount aggregation to sum 'invoice_value' (Amount column),
-                 # we should assume that was the Taxable Value. 
-                 
-                 item_invoice_value = agg['taxable_amount'] + agg['cgst'] + agg['sgst']
-                 calculated_total_value += item_invoice_value
-                 
-                 new_all_items.append({
-                     'sno': str(idx),
-                     'hsn': hsn,
-                     'quantity': f"{agg['quantity']:.2f}",
-                     'taxable_amount': f"{agg['taxable_amount']:.2f}",
-                     # 'discount': '', # Discount removed
-                     'taxrate': agg['taxrate'],
-                     'cgst': f"{agg['cgst']:.2f}",
-                     'sgst': f"{agg['sgst']:.2f}",
-                     'invoice_value': f"{item_invoice_value:.2f}"
-                 })
-             all_items = new_all_items
-             
-             # Store the calculated total
-             common_data['calculated_total_invoice_value'] = f"{calculated_total_value:.2f}"
-
-    # If no table items found, create a single item with empty values
-    if not all_items:
-        all_items = [{
-            'sno': '1',
-            'hsn': '',
-            'quantity': '',
-            'taxable_amount': '',
-            'discount': '', # Kept for structure but unused
-            'taxrate': '',
-            'cgst': '',
-            'sgst': '',
-            'invoice_value': ''
-        }]
-
-    # Create final data list - one entry per item with merged cells logic
-    final_data = []
-    for i, item in enumerate(all_items):
-        if i == 0:
-            # First item: include all invoice-level fields
-            row_data = {
-                'sno': item['sno'],  # Use actual SNO from table
-                'invoice_no': common_data.get('invoice_no', ''),
-                'date': common_data.get('date', ''),
-                'receiver_name': common_data.get('receiver_name', ''),
-                'receiver_gst': common_data.get('receiver_gst', ''),
-                'hsn': item['hsn'],
-                'quantity': item['quantity'],
-                'taxable_amount': item['taxable_amount'],
-                # 'discount': item.get('discount', ''), # Removed
-                'taxrate': item['taxrate'],
-                'cgst': item['cgst'],
-                'sgst': item['sgst'],
-                'invoice_value': item['invoice_value'],
-                'total_invoice_value': ''  # Empty for all item rows
-            }
-        else:
-            # Subsequent items: empty invoice fields, filled item fields
-            row_data = {
-                'sno': item['sno'],  # Use actual SNO from table
-                'invoice_no': '',  # Empty
-                'date': '',  # Empty
-                'receiver_name': '',  # Empty
-                'receiver_gst': '',  # Empty
-                'hsn': item['hsn'],
-                'quantity': item['quantity'],
-                'taxable_amount': item['taxable_amount'],
-                # 'discount': item.get('discount', ''), # Removed
-                'taxrate': item['taxrate'],
-                'cgst': item['cgst'],
-                'sgst': item['sgst'],
-                'invoice_value': item['invoice_value'],
-                'total_invoice_value': ''  # Empty for all item rows
-            }
-        final_data.append(row_data)
-
-    # Add final row with total invoice value
-    final_data.append({
-        'sno': '',  # Empty
-        'invoice_no': '',  # Empty
-        'date': '',  # Empty
-        'receiver_name': '',  # Empty
-        'receiver_gst': '',  # Empty
-        'hsn': '',  # Empty
-        'quantity': '',  # Empty
-        'taxable_amount': '',  # Empty
-        # 'discount': '',  # Removed
-        'taxrate': '',  # Empty
-        'cgst': '',  # Empty
-        'sgst': '',  # Empty
-        'invoice_value': '',  # Empty
-        'total_invoice_value': common_data.get('calculated_total_invoice_value', common_data.get('total_invoice_value', ''))  # Use calculated total if available
-    })
-
-
-    return final_data
+            print(f"Error writing {filename}: {e}")
+            return None
+        return output_path
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+def invoice_filters():
+    """Invoice index filters from the query string: ?invoice_no=&receiver_gst=&hsn=&from=&to=&duplicates="""
+    return {
+        'invoice_no': request.args.get('invoice_no'),
+        'receiver_gst': request.args.get('receiver_gst'),
+        'hsn': request.args.get('hsn'),
+        'date_from': request.args.get('from'),
+        'date_to': request.args.get('to'),
+        'duplicates': request.args.get('duplicates', 'include')
+    }
 
-@app.route('/upload', methods=['POST'])
-def upload_files():
-    if 'files' not in request.files:
-        flash('No file part')
-        return redirect(url_for('index'))
+@app.route('/invoices')
+def invoices():
+    """Invoices from all batches, newest first, a page at a time: ?cursor=&limit= and invoice_filters"""
+    if invoice_index is None:
+        return jsonify({'error': 'Invoice index is disabled'}), 404
+    cursor = request.args.get('cursor')
+    try:
+        found, next_cursor = invoice_index.search(cursor, page_size(100), **invoice_filters())
+        page = {'invoices': found, 'next_cursor': next_cursor}
+        if not cursor:
+            page['total'] = invoice_index.count(**invoice_filters())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+@app.route('/invoices/export')
+def invoices_export():
+    """Consolidated rows of the matching invoices in date order: ?format= and invoice_filters
+
+    Duplicates are left out unless asked for (duplicates=include).
+    """
+    if invoice_index is None:
+        return jsonify({'error': 'Invoice index is disabled'}), 404
+    output_format = request.args.get('format', 'xlsx')
+    if output_format not in available_formats():
+        return jsonify({'error': f'Unsupported output format: {output_format}'}), 400
+    filters = dict(invoice_filters(), duplicates=request.args.get('duplicates', 'exclude'))
+    try:
+        rows = invoice_index.iter_rows(**filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    output_filename = f"invoices_{uuid.uuid4()}.{output_format}"
+    with open_consolidated_writer(output_format, processed_store.path(output_filename)) as writer:
+        writer.write_rows(rows)
+    return download_file(output_filename)
+
+@app.route('/sets')
+def consolidation_sets():
+    """Consolidation sets with their number of jobs, files and rows"""
+    return jsonify({'sets': job_queue.sets()})
+
+@app.route('/sets/<set_name>')
+def consolidation_set(set_name):
+    """Finished jobs of a consolidation set, in the order their rows appear in its output"""
+    jobs = job_queue.set_jobs(set_name)
+    if not jobs:
+        return jsonify({'error': 'Consolidation set not found'}), 404
+    return jsonify({'set_name': set_name, 'jobs': jobs,
+                    'download_url': url_for('consolidation_set_download', set_name=set_name)})
+
+@contextmanager
+def shared_output_lock(filename):
+    """Lock on an output file held across all server processes (flock on a file in LOCK_FOLDER)"""
+    if fcntl is None:
+        with output_lock(filename):
+            yield
+        return
+    with open(os.path.join(LOCK_FOLDER, filename + '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def build_set_output(set_name, output_format):
+    """Bring a set's consolidated output up to date from the stored rows; returns its path or None
+
+    Only the rows of jobs finished since the output was last written are added:
+    appended to a copy of the file for CSV, and for the other formats (which cannot
+    be extended) by rewriting the file from the stored rows. No PDF is extracted
+    again. The new file replaces the old one whole, and the rows it holds are
+    recorded only after that, so a failed update leaves the previous output in use.
+    """
+    jobs = job_queue.set_jobs(set_name)
+    if not jobs:
+        return None
+    through_seq = jobs[-1]['set_seq']
+    filename = f"{hashlib.sha1(set_name.encode('utf-8')).hexdigest()}_set.{output_format}"
+
+    # Downloads in every server process update the output one at a time
+    with shared_output_lock(filename):
+        saved = job_queue.set_output(set_name, output_format)
+        existing = processed_store.find(filename)
+        if saved is None or existing is None:
+            after_seq = 0
+        else:
+            after_seq = saved[1]
+            if after_seq == through_seq:
+                return existing
+        output_path = existing or processed_store.path(filename)
+
+        def write(path):
+            if after_seq and output_format in APPENDABLE_FORMATS:
+                shutil.copyfile(output_path, path)
+                with open_consolidated_writer(output_format, path, append=True) as writer:
+                    writer.write_rows(job_queue.iter_set_rows(set_name, after_seq, through_seq))
+            else:
+                with open_consolidated_writer(output_format, path) as writer:
+                    writer.write_rows(job_queue.iter_set_rows(set_name, 0, through_seq))
 
-    files = request.files.getlist('files')
-    if not files or files[0].filename == '':
-        flash('No selected files')
+        try:
+            with stage('set_output'):
+                write_atomically(output_path, write)
+        except Exception as e:
+            print(f"Error writing consolidation set {set_name}: {e}")
+            return None
+        try:
+            job_queue.save_set_output(set_name, output_format, filename, through_seq)
+        except Exception as e:
+            print(f"Error saving consolidation set {set_name}: {e}")
+            # Without its watermark the file would be appended to twice; it is rewritten next time
+            os.remove(output_path)
+            return None
+        return output_path
+
+@app.route('/sets/<set_name>/download')
+def consolidation_set_download(set_name):
+    """Consolidated output of all of a set's uploads: ?format="""
+    output_format = request.args.get('format', 'xlsx')
+    if output_format not in available_formats():
+        flash(f'Unsupported output format: {output_format}')
         return redirect(url_for('index'))
+    output_path = build_set_output(set_name, output_format)
+    if output_path is None:
+        flash('Consolidation set not found')
+        return redirect(url_for('index'))
+    return send_file(output_path, as_attachment=True,
+                     download_name=f"{secure_filename(set_name) or 'set'}.{output_format}")
 
-    processed_files = []
-    all_data = []
-
-    for file in files:
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            unique_id = str(uuid.uuid4())
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{unique_id}_{filename}")
-            file.save(file_path)
-
-            # Process the PDF
-            extracted_data = process_pdf(file_path, filename, unique_id)
-            processed_files.append(extracted_data)
-            all_data.extend(extracted_data.get('parsed_data', []))
-
-    # Always create consolidated Excel file
-    excel_filename = f"consolidated_{uuid.uuid4()}.xlsx"
-    excel_path = os.path.join(app.config['PROCESSED_FOLDER'], excel_filename)
-    create_consolidated_excel(all_data, excel_path)
-
-    return render_template('results.html',
-                         processed_files=processed_files,
-                         excel_download=excel_filename,
-                         consolidated=True,
-                         all_data=all_data)
-
-def process_pdf(file_path, original_filename, unique_id):
-    """Process a single PDF file"""
-    # Extract text
-    text = extract_text_from_pdf(file_path)
-
-    # If little text found, try OCR
-    if len(text.strip()) < 100:
-        print("Little text found, attempting OCR...")
-        text = extract_text_with_ocr(file_path)
-
-    # Extract tables
-    tables = extract_tables_from_pdf(file_path)
-
-    # Parse structured data
-    parsed_data_list = parse_invoice_data(text, file_path)
+# Extraction is CPU-bound; this caps how many run at once in this server process
+extraction_slots = threading.BoundedSemaphore(app.config['EXTRACTION_CONCURRENCY'])
 
-    # Create individual Excel file
+def process_pdf(file_path, original_filename, unique_id, sha256=None):
+    """Process a single PDF file with the app's cache, OCR and output settings"""
     excel_filename = f"{unique_id}_extracted.xlsx"
-    excel_path = os.path.join(app.config['PROCESSED_FOLDER'], excel_filename)
-
-    create_excel_file(parsed_data_list, tables, text, excel_path)
+    with extraction_slots:
+        result = pipeline.process_pdf(file_path, original_filename, unique_id,
+                                      output_folder=processed_store.directory(excel_filename),
+                                      cache=extraction_cache,
+                                      ocr_options=ocr_options(),
+                                      write_workbook=app.config['WRITE_FILE_WORKBOOKS'],
+                                      sha256=sha256, layouts=layout_index,
+                                      table_options=table_options(), memory_options=memory_options())
+    # Without a workbook the download link builds it on first request
+    result['excel_path'] = excel_filename
+    return result
+
+def build_file_workbook(filename):
+    """Build a per-file workbook on first download and keep it in processed/; returns its path or None
+
+    The workbook is written from the cached extraction. If that has been evicted,
+    the stored upload is extracted again (which refills the cache).
+    """
+    if not filename.endswith('_extracted.xlsx'):
+        return None
+    unique_id = filename[:-len('_extracted.xlsx')]
+    stored = job_queue.find_file(unique_id)
+    if stored is None or stored['status'] != 'done':
+        return None
+
+    with output_lock(filename):
+        try:
+            existing = processed_store.find(filename)
+            if existing:
+                return existing  # Built by a concurrent request
+
+            upload_exists = os.path.exists(stored['file_path'])
+            sha256 = stored['sha256'] or (file_sha256(stored['file_path']) if upload_exists else None)
+            options_digest = pipeline.extraction_options_digest(table_options(), ocr_options())
+            key = extraction_cache.key(sha256, options_digest) if sha256 else None
+            cached = extraction_cache.get(key) if key else None
+            if cached is None and upload_exists:
+                with extraction_slots:
+                    pipeline.process_pdf(stored['file_path'], stored['filename'], unique_id,
+                                         output_folder=processed_store.directory(filename),
+                                         cache=extraction_cache, ocr_options=ocr_options(),
+                                         write_workbook=False, sha256=sha256, layouts=layout_index,
+                                         table_options=table_options(), memory_options=memory_options())
+                cached = extraction_cache.get(key or extraction_cache.key_for_file(stored['file_path'], options_digest))
+            if cached is None:
+                return None
+
+            output_path = processed_store.path(filename)
+            raw_text = None if pipeline.over_memory_ceiling(app.config['MEMORY_CEILING']) else cached['text']
+            with stage('workbook'):
+                write_atomically(output_path, lambda path: create_excel_file(
+                    cached['parsed_data'], cached['tables'], raw_text, path))
+            return output_path
+        except Exception as e:
+            print(f"Error building workbook {filename}: {e}")
+            return None
 
+def ocr_options():
     return {
-        'filename': original_filename,
-        'unique_id': unique_id,
-        'text': text[:1000] + "..." if len(text) > 1000 else text,
-        'tables_count': len(tables),
-        'parsed_data': parsed_data_list,
-        'excel_path': excel_filename
+        'workers': app.config['OCR_WORKERS'],
+        'max_pages_in_memory': app.config['OCR_MAX_PAGES_IN_MEMORY'],
+        'resolutions': app.config['OCR_RESOLUTIONS'],
+        'min_confidence': app.config['OCR_MIN_CONFIDENCE'],
+        'engine': app.config['OCR_ENGINE']
     }
 
-def create_excel_file(parsed_data, tables, raw_text, output_path):
-    """Create Excel file with extracted data"""
-    with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-        sheets_created = 0
-
-        # Parsed data sheet
-        if parsed_data and len(parsed_data) > 0:
-            try:
-                # parsed_data is now a list of dictionaries (one per item)
-                df_parsed = pd.DataFrame(parsed_data)
-                df_parsed.to_excel(writer, sheet_name='Parsed_Data', index=False)
-                sheets_created += 1
-            except Exception as e:
-                print(f"Error creating parsed data sheet: {e}")
-                # If DataFrame creation fails, try with original data
-                try:
-                    if parsed_data:
-                        df_parsed = pd.DataFrame(parsed_data)
-                        df_parsed.to_excel(writer, sheet_name='Parsed_Data', index=False)
-                        sheets_created += 1
-                except Exception as e2:
-                    print(f"Error creating parsed data sheet with original data: {e2}")
-
-        # Tables sheet
-        if tables:
-            for i, table_info in enumerate(tables):
-                try:
-                    sheet_name = f'Table_{table_info["page"]}_{i+1}'
-                    table_info['data'].to_excel(writer, sheet_name=sheet_name, index=False)
-                    sheets_created += 1
-                except Exception as e:
-                    print(f"Error creating table sheet: {e}")
-
-        # Raw text sheet
-        if raw_text and raw_text.strip():
-            try:
-                df_text = pd.DataFrame({'Raw_Text': [raw_text]})
-                df_text.to_excel(writer, sheet_name='Raw_Text', index=False)
-                sheets_created += 1
-            except Exception as e:
-                print(f"Error creating raw text sheet: {e}")
-
-        # If no sheets were created, create a default sheet
-        if sheets_created == 0:
-            try:
-                df_empty = pd.DataFrame({'Message': ['No data could be extracted from this PDF']})
-                df_empty.to_excel(writer, sheet_name='No_Data', index=False)
-            except Exception as e:
-                print(f"Error creating default sheet: {e}")
-
-def create_consolidated_excel(all_data, output_path):
-    """Create consolidated Excel for multiple files with all invoice data"""
-    # Define the column order as requested
-    columns = ['sno', 'invoice_no', 'date', 'receiver_name', 'receiver_gst', 'hsn',
-               'quantity', 'taxable_amount', 'taxrate', 'cgst', 'sgst',
-               'invoice_value', 'total_invoice_value']
-
-    # Create DataFrame with specified columns
-    if all_data:
-        df = pd.DataFrame(all_data)
-
-        # Ensure all required columns exist
-        for col in columns:
-            if col not in df.columns:
-                df[col] = ''
-
-        # Reorder columns as specified
-        df = df[columns]
-    else:
-        # Create empty DataFrame with proper columns
-        df = pd.DataFrame(columns=columns)
-
-    # Rename columns to match user's requirements
-    column_mapping = {
-        'sno': 'SNO',
-        'invoice_no': 'INVOICE NO',
-        'date': 'DATE',
-        'receiver_name': 'RECEIVER NAME',
-        'receiver_gst': 'RECEIVER GST',
-        'hsn': 'HSN',
-        'quantity': 'QUANTITY',
-        'taxable_amount': 'TAXABLE AMOUNT',
-        # 'discount': 'DISCOUNT', # Removed
-        'taxrate': 'TAXRATE',
-        'cgst': 'CGST',
-        'sgst': 'SGST',
-        'invoice_value': 'INVOICE VALUE',
-        'total_invoice_value': 'TOTAL INVOICE VALUE'
+def memory_options():
+    return {
+        'release_pages': app.config['RELEASE_PAGES'],
+        'ceiling': app.config['MEMORY_CEILING']
     }
 
-    df = df.rename(columns=column_mapping)
-
-    # Save to Excel
-    df.to_excel(output_path, index=False)
+def table_options():
+    return {
+        'settings': app.config['TABLE_SETTINGS'],
+        'crop': app.config['TABLE_CROP']
+    }
 
-    return output_path
+# Background threads are started by the first request in each process rather than at import,
+# so a server that loads the app and then forks workers starts them in every worker
+background_pid = None
+background_lock = threading.Lock()
+
+@app.before_request
+def start_background_tasks():
+    global background_pid
+    if background_pid != os.getpid():
+        with background_lock:
+            if background_pid != os.getpid():
+                storage_sweeper.start()
+                background_pid = os.getpid()
+
+def shutdown(wait=True):
+    """Stop background work in this process; with wait, queued and running jobs finish first"""
+    storage_sweeper.stop()
+    job_queue.shutdown(wait=wait)
+    shutdown_pool()
+
+def profiling_requested():
+    return app.config['PROFILING_ENABLED'] and request.args.get('profile') == '1'
+
+@app.before_request
+def start_request_profile():
+    # Uploads are profiled per file in the job workers instead
+    if profiling_requested() and request.endpoint != 'upload_files':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def stop_request_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(app.config['PROFILE_FOLDER'], exist_ok=True)
+        profile_name = f"{int(time.time() * 1000)}_{request.endpoint}.prof"
+        profiler.dump_stats(os.path.join(app.config['PROFILE_FOLDER'], profile_name))
+        response.headers['X-Profile-File'] = profile_name
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/download/<filename>')
 def download_file(filename):
-    file_path = os.path.join(app.config['PROCESSED_FOLDER'], filename)
-    if os.path.exists(file_path):
+    file_path = None
+    if secure_filename(filename) == filename:
+        file_path = processed_store.find(filename) or build_file_workbook(filename) or build_output(filename)
+    if file_path:
         return send_file(file_path, as_attachment=True)
     else:
         flash('File not found')
         return redirect(url_for('index'))
 
+job_queue = JobQueue(app.config['JOB_DATABASE'], process_pdf, open_job_output,
+                     workers=app.config['JOB_WORKERS'],
+                     profile_dir=app.config['PROFILE_FOLDER'],
+                     invoice_index=invoice_index)
+
 if __name__ == '__main__':
+    job_queue.fail_interrupted()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""Persistent content-hash cache of extraction results with LRU eviction"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Bump whenever text, table or invoice parsing changes so stale results are not served
+EXTRACTION_VERSION = '5'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """On-disk cache of extraction results keyed by file content, EXTRACTION_VERSION and options
+
+    Entries are JSON files sharded by key prefix. Each hit refreshes the entry's
+    mtime, and the least recently used entries are evicted once the cache grows
+    beyond max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=500 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> [size in bytes, last used timestamp]
+        self._entries = {}
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json'):
+                    stat = os.stat(os.path.join(root, name))
+                    self._entries[name[:-5]] = [stat.st_size, stat.st_mtime]
+
+    def key(self, sha256_hex, options_digest=None):
+        """Cache key for a file digest under the current extraction version
+
+        options_digest identifies the extraction options the result depends on (see
+        pipeline.extraction_options_digest), so changing them misses the cache.
+        """
+        key = f"{sha256_hex}-v{EXTRACTION_VERSION}"
+        return f"{key}-{options_digest}" if options_digest else key
+
+    def key_for_file(self, file_path, options_digest=None):
+        return self.key(file_sha256(file_path), options_digest)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Cached value for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                value = json.load(file)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+                self._entries.pop(key, None)
+            return None
+
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._entries:
+                self._entries[key][1] = now
+        return value
+
+    def put(self, key, value):
+        """Store a JSON-serializable value and evict old entries if over the size limit"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(value, file)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing cache entry: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._entries[key] = [os.path.getsize(path), time.time()]
+            self._evict()
+
+    def _evict(self):
+        total = sum(size for size, _ in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            del self._entries[key]
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': sum(size for size, _ in self._entries.values()),
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,210 @@
+"""Headless batch extraction of a directory (or glob) of PDFs across all cores
+
+Usage:
+    python app/cli.py INPUT [INPUT ...] -o OUTPUT_DIR [--format xlsx|csv|parquet]
+                      [--per-file] [--workers N] [--resume] [--no-cache] [--no-layouts]
+                      [--table-settings JSON] [--table-crop] [--memory-ceiling MB]
+
+INPUT is a directory (its *.pdf files) or a glob such as "drop/**/*.pdf". One
+consolidated output is written to OUTPUT_DIR, plus per-file workbooks with
+--per-file. Progress is recorded in OUTPUT_DIR/.manifest.jsonl so an interrupted
+run can be continued with --resume. Does not import Flask.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pytesseract
+
+import pipeline
+from cache import ExtractionCache
+from layouts import LayoutIndex
+from export import available_formats, open_consolidated_writer
+from ocr import ENGINES, DEFAULT_ENGINE
+
+MANIFEST_NAME = '.manifest.jsonl'
+
+# Per-process state set up by _init_worker
+_worker_cache = None
+_worker_layouts = None
+
+
+def find_pdfs(inputs):
+    """Sorted, de-duplicated absolute paths of the PDFs named by directories or globs"""
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, '*.pdf')) + glob.glob(os.path.join(pattern, '*.PDF'))
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        paths.update(os.path.abspath(path) for path in matches
+                     if os.path.isfile(path) and path.lower().endswith('.pdf'))
+    return sorted(paths)
+
+
+def unique_ids(paths):
+    """Readable per-file IDs (file stem), disambiguated by a path hash when stems repeat"""
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    seen = {}
+    for stem in stems:
+        seen[stem] = seen.get(stem, 0) + 1
+    return {
+        path: stem if seen[stem] == 1 else f"{stem}_{hashlib.sha1(path.encode()).hexdigest()[:8]}"
+        for path, stem in zip(paths, stems)
+    }
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def load_manifest(manifest_path):
+    """Completed files from a previous run: path -> manifest entry"""
+    done = {}
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Partial line from an interrupted write
+            if entry.get('result') is not None:
+                done[entry['path']] = entry
+    return done
+
+
+def _init_worker(cache_dir, cache_max_bytes, tesseract_cmd, layout_db):
+    global _worker_cache, _worker_layouts
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    if cache_dir:
+        _worker_cache = ExtractionCache(cache_dir, cache_max_bytes)
+    if layout_db:
+        _worker_layouts = LayoutIndex(layout_db)
+
+
+def _process_file(path, unique_id, output_folder, per_file, ocr_engine, table_options, memory_options):
+    """Process pool entry point: extract one PDF, returning (path, result, error)"""
+    try:
+        # Files are already spread across cores, so each worker OCRs in-process
+        result = pipeline.process_pdf(path, os.path.basename(path), unique_id, output_folder,
+                                      cache=_worker_cache, ocr_options={'workers': 1, 'engine': ocr_engine},
+                                      write_workbook=per_file, layouts=_worker_layouts,
+                                      table_options=table_options, memory_options=memory_options)
+        result.pop('text', None)
+        return path, result, None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def run(args):
+    pdfs = find_pdfs(args.inputs)
+    if not pdfs:
+        print("No PDF files found")
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest_path = os.path.join(args.output, MANIFEST_NAME)
+    done = load_manifest(manifest_path) if args.resume else {}
+    # Only reuse results for files that have not changed since they were processed
+    done = {path: entry for path, entry in done.items()
+            if os.path.exists(path) and entry.get('signature') == file_signature(path)}
+    todo = [path for path in pdfs if path not in done]
+    ids = unique_ids(pdfs)
+
+    print(f"{len(pdfs)} PDF(s) found, {len(pdfs) - len(todo)} already done, {len(todo)} to process "
+          f"with {args.workers} worker(s)")
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    layout_db = None if args.no_layouts else args.layout_db
+    if layout_db:
+        os.makedirs(os.path.dirname(layout_db) or '.', exist_ok=True)
+        # Created here once, so the workers do not race to create the schema
+        LayoutIndex(layout_db)
+    start = time.perf_counter()
+    files_done = pages_done = failures = 0
+
+    with open(manifest_path, 'a' if args.resume else 'w', encoding='utf-8') as manifest, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                initargs=(cache_dir, args.cache_max_bytes, args.tesseract_cmd, layout_db)) as pool:
+        table_options = {'settings': args.table_settings, 'crop': args.table_crop}
+        memory_options = {'ceiling': args.memory_ceiling * 1024 * 1024 if args.memory_ceiling else None}
+        futures = [pool.submit(_process_file, path, ids[path], args.output, args.per_file,
+                               args.ocr_engine, table_options, memory_options) for path in todo]
+        for future in as_completed(futures):
+            path, result, error = future.result()
+            files_done += 1
+            if error:
+                failures += 1
+                print(f"[{files_done}/{len(todo)}] FAILED {path}: {error}")
+                continue
+
+            entry = {'path': path, 'signature': file_signature(path), 'result': result}
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            done[path] = entry
+
+            pages_done += result.get('page_count', 0)
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            print(f"[{files_done}/{len(todo)}] {os.path.basename(path)}  "
+                  f"{files_done / elapsed:.2f} files/s  {pages_done / elapsed:.2f} pages/s")
+
+    # Consolidated output in input order, from this run's and any resumed results
+    output_path = os.path.join(args.output, f"consolidated.{args.format}")
+    with open_consolidated_writer(args.format, output_path) as writer:
+        for path in pdfs:
+            if path in done:
+                writer.write_rows(done[path]['result'].get('parsed_data', []))
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {files_done - failures} file(s), {pages_done} page(s) in {elapsed:.1f}s "
+          f"({files_done / elapsed if elapsed else 0:.2f} files/s, {pages_done / elapsed if elapsed else 0:.2f} pages/s)")
+    if failures:
+        print(f"{failures} file(s) failed; run again with --resume to retry them")
+    print(f"Consolidated output: {output_path}")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract invoice data from a batch of PDFs without the web server")
+    parser.add_argument('inputs', nargs='+', help='input directories or glob patterns')
+    parser.add_argument('-o', '--output', required=True, help='output directory')
+    parser.add_argument('--format', default='xlsx', choices=available_formats(),
+                        help='consolidated output format (default: xlsx)')
+    parser.add_argument('--per-file', action='store_true', help='also write one workbook per PDF')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip files already completed in a previous run into the same output directory')
+    parser.add_argument('--cache-dir', default=os.path.abspath(os.path.join('data', 'cache')),
+                        help='extraction cache directory shared with the web app (default: data/cache)')
+    parser.add_argument('--cache-max-bytes', type=int, default=500 * 1024 * 1024)
+    parser.add_argument('--no-cache', action='store_true', help='do not read or write the extraction cache')
+    parser.add_argument('--layout-db', default=os.path.abspath(os.path.join('data', 'layouts.db')),
+                        help='vendor layout template index shared with the web app (default: data/layouts.db)')
+    parser.add_argument('--no-layouts', action='store_true',
+                        help='always detect tables on the full page and do not learn layout templates')
+    parser.add_argument('--table-settings', type=json.loads, default=None,
+                        help='pdfplumber table settings as JSON, e.g. \'{"snap_tolerance": 2}\' (default: pdfplumber\'s)')
+    parser.add_argument('--table-crop', action='store_true',
+                        help='detect tables only in the line-item band instead of on the whole page')
+    parser.add_argument('--memory-ceiling', type=int, default=None, metavar='MB',
+                        help='worker memory above which files are OCRed at the lowest resolution only and '
+                             'per-file workbooks leave out the raw text (default: no limit)')
+    parser.add_argument('--tesseract-cmd', default=os.environ.get('TESSERACT_CMD'),
+                        help='path to the tesseract executable (default: $TESSERACT_CMD or PATH)')
+    parser.add_argument('--ocr-engine', default=DEFAULT_ENGINE, choices=ENGINES,
+                        help='tesserocr keeps Tesseract loaded per worker, pytesseract starts it per page '
+                             '(default: auto, tesserocr when installed)')
+    return run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
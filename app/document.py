@@ -0,0 +1,344 @@
+"""Single-pass PDF document model shared by the text, table and parsing stages"""
+import re
+import unicodedata
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import PyPDF2
+import pdfplumber
+from pdfplumber.table import TableSettings
+from pdfplumber.utils import extract_text
+
+from layouts import template_tables
+from metrics import stage
+
+# Text-layer quality checks deciding which pages are sent to OCR
+OCR_MIN_PAGE_CHARS = 10          # fewer characters than this: no usable text layer
+OCR_MAX_BAD_GLYPH_RATIO = 0.3    # share of unmapped/garbage glyphs above which the text is unusable
+OCR_IMAGE_COVERAGE = 0.5         # page area covered by images for it to count as scanned...
+OCR_SPARSE_TEXT_CHARS = 200      # ...when its text layer is also shorter than this
+
+# Table detection can be cropped to the line-item band: from the table rule above the line-item
+# header row (as ColumnMap recognizes it) to the rule below the first row starting with a total
+BAND_LINE_TOLERANCE = 3          # characters whose tops are this close (points) are on one line
+BAND_MAX_SHARE = 0.5             # only bands shorter than this share of the page are cropped (see find_tables)
+TOTAL_ROW_RE = re.compile(r'^(?:sub|grand)?total')
+
+
+def _text_lines(chars):
+    """(top, bottom, lower-cased text without spaces) of each line of characters, top to bottom"""
+    lines = []
+    for char in sorted(chars, key=lambda c: c['top']):
+        if lines and char['top'] - lines[-1][0] <= BAND_LINE_TOLERANCE:
+            lines[-1][1] = max(lines[-1][1], char['bottom'])
+            lines[-1][2].append(char)
+        else:
+            lines.append([char['top'], char['bottom'], [char]])
+    return [(top, bottom, ''.join(c['text'] for c in sorted(line, key=lambda c: c['x0'])).replace(' ', '').lower())
+            for top, bottom, line in lines]
+
+
+def _char_in_bbox(char, bbox):
+    """pdfplumber's rule for a character belonging to a cell: its center is inside"""
+    v_mid = (char['top'] + char['bottom']) / 2
+    h_mid = (char['x0'] + char['x1']) / 2
+    x0, top, x1, bottom = bbox
+    return x0 <= h_mid < x1 and top <= v_mid < bottom
+
+
+def extract_table(table, chars, text_settings):
+    """Rows of a pdfplumber Table, the same as table.extract(**text_settings)
+
+    pdfplumber filters every character on the page for each row; here each row's
+    characters are found by bisecting the characters sorted by their vertical
+    center, so large tables cost O(characters x log characters).
+    """
+    order = sorted(range(len(chars)), key=lambda i: (chars[i]['top'] + chars[i]['bottom']) / 2)
+    v_mids = [(chars[i]['top'] + chars[i]['bottom']) / 2 for i in order]
+    rows = []
+    for row in table.rows:
+        _, top, _, bottom = row.bbox
+        row_chars = [i for i in order[bisect_left(v_mids, top):bisect_left(v_mids, bottom)]
+                     if _char_in_bbox(chars[i], row.bbox)]
+        row_chars.sort(key=lambda i: (chars[i]['x0'] + chars[i]['x1']) / 2)
+        h_mids = [(chars[i]['x0'] + chars[i]['x1']) / 2 for i in row_chars]
+        cells = []
+        for cell in row.cells:
+            if cell is None:
+                cells.append(None)
+                continue
+            # Characters in page order, as pdfplumber passes them on
+            cell_chars = [chars[i] for i in sorted(row_chars[bisect_left(h_mids, cell[0]):bisect_left(h_mids, cell[2])])
+                          if _char_in_bbox(chars[i], cell)]
+            cells.append(extract_text(cell_chars, **text_settings) if cell_chars else '')
+        rows.append(cells)
+    return rows
+
+
+def item_band(page):
+    """(top, bottom) of the line-item band of a pdfplumber page, or None if it has no line-item header"""
+    lines = _text_lines(page.chars)
+    header = next((idx for idx, (_, _, text) in enumerate(lines)
+                   if 'description' in text or 'qty' in text or ('hsn' in text and 'sac' in text)), None)
+    if header is None:
+        return None
+    rules = [edge['top'] for edge in page.horizontal_edges]
+    header_top = lines[header][0]
+    top = max((y for y in rules if y <= header_top), default=header_top) - BAND_LINE_TOLERANCE
+    bottom = page.bbox[3]
+    total = next((line for line in lines[header + 1:] if TOTAL_ROW_RE.match(line[2])), None)
+    if total is not None:
+        bottom = min((y for y in rules if y >= total[1]), default=total[1]) + BAND_LINE_TOLERANCE
+    return max(top, page.bbox[1]), min(bottom, page.bbox[3])
+
+
+def bad_glyph_ratio(text):
+    """Share of non-space characters that are unmapped glyphs, (cid:N) codes or control/private-use"""
+    cid_chars = 0
+    start = text.find('(cid:')
+    while start != -1:
+        end = text.find(')', start)
+        if end == -1:
+            break
+        cid_chars += end - start + 1
+        start = text.find('(cid:', end)
+
+    total = bad = 0
+    for char in text:
+        if char.isspace():
+            continue
+        total += 1
+        if char == '\ufffd' or unicodedata.category(char) in ('Cc', 'Co', 'Cs'):
+            bad += 1
+    if not total:
+        return 0.0
+    return min(1.0, (bad + cid_chars) / total)
+
+
+class PdfPage:
+    """One page of an uploaded PDF with its text, tables and rendered image cached"""
+
+    def __init__(self, document, index, text=None):
+        self.document = document
+        self.index = index
+        self.number = index + 1
+        self._text = text
+        self._tables = None
+        # Cell bboxes of the detected tables behind each entry of tables, kept for learning a
+        # layout template (pdfplumber's Table objects would keep the released page's objects alive)
+        self.table_cells = None
+        self._images = {}
+
+    @property
+    def plumber_page(self):
+        """The underlying pdfplumber page, or None if pdfplumber could not open the file"""
+        pdf = self.document.plumber_pdf
+        if pdf is None:
+            return None
+        return pdf.pages[self.index]
+
+    @property
+    def text(self):
+        """Text layer of the page (PyPDF2, falling back to pdfplumber)"""
+        if self._text is None:
+            self._text = ""
+            page = self.plumber_page
+            if page is not None:
+                try:
+                    self._text = page.extract_text() or ""
+                except Exception as e:
+                    print(f"Error extracting text with pdfplumber: {e}")
+        return self._text
+
+    def find_tables(self):
+        """(pdfplumber tables, the page or crop they were found on) with the document's table settings
+
+        With crop_tables, only the line-item band is searched when the page has one
+        and it is shorter than BAND_MAX_SHARE of the page. Tables outside the band
+        are then not found, and on the benchmark corpus cropping was never faster
+        than searching the whole page, so it is off by default.
+        """
+        page = self.plumber_page
+        if page is None:
+            return []
+        if self.document.crop_tables:
+            band = item_band(page)
+            if band is not None and band[1] - band[0] < BAND_MAX_SHARE * (page.bbox[3] - page.bbox[1]):
+                page = page.crop((page.bbox[0], band[0], page.bbox[2], band[1]))
+        return page.find_tables(self.document.table_settings), page
+
+    @property
+    def tables(self):
+        """Tables detected on the page as lists of rows; detection runs once per page
+
+        With a layout template set on the document, only its line-item table is read.
+        """
+        if self._tables is None:
+            self._tables = []
+            page = self.plumber_page
+            if page is not None:
+                try:
+                    with stage('tables'):
+                        if self.document.layout is not None:
+                            self._tables = template_tables(page, self.document.layout)
+                        else:
+                            found, area = self.find_tables()
+                            text_settings = self.document.table_settings.text_settings or {}
+                            extracted = [(table, extract_table(table, area.chars, text_settings))
+                                         for table in found]
+                            self._tables = [rows for _, rows in extracted if rows]
+                            self.table_cells = [table.cells for table, rows in extracted if rows]
+                except Exception as e:
+                    print(f"Error extracting tables: {e}")
+                if self.document.release_pages:
+                    self.release()
+        return self._tables
+
+    def use_ocr_tables(self, tables):
+        """Replace the detected tables with ones rebuilt from OCR, if any were found"""
+        if tables:
+            self._tables = tables
+            self.table_cells = None
+
+    def image_coverage(self):
+        """Fraction of the page area covered by embedded images"""
+        page = self.plumber_page
+        if page is None or not page.width or not page.height:
+            return 0.0
+        covered = 0.0
+        for img in page.images:
+            width = max(0.0, min(img['x1'], page.width) - max(img['x0'], 0))
+            height = max(0.0, min(img['bottom'], page.height) - max(img['top'], 0))
+            covered += width * height
+        return min(1.0, covered / (page.width * page.height))
+
+    def ocr_reason(self):
+        """Why this page's text layer needs OCR, or None if it can be used as is"""
+        stripped = self.text.strip()
+        if len(stripped) < OCR_MIN_PAGE_CHARS:
+            return 'no text layer'
+        if bad_glyph_ratio(stripped) > OCR_MAX_BAD_GLYPH_RATIO:
+            return 'unreadable glyphs'
+        if len(stripped) < OCR_SPARSE_TEXT_CHARS:
+            try:
+                if self.image_coverage() >= OCR_IMAGE_COVERAGE:
+                    return 'scanned image with sparse text'
+            except Exception as e:
+                print(f"Error measuring image coverage: {e}")
+        return None
+
+    def image(self, resolution=300):
+        """Render the page to a PIL image, cached per resolution until released"""
+        if resolution not in self._images:
+            page = self.plumber_page
+            if page is None:
+                return None
+            self._images[resolution] = page.to_image(resolution=resolution).original
+        return self._images[resolution]
+
+    def release_image(self):
+        """Drop any rendered images held for this page"""
+        self._images.clear()
+
+    def release(self):
+        """Drop rendered images and pdfplumber's parsed objects for this page; they are re-read if needed"""
+        self.release_image()
+        if self.document.plumber_pdf is not None:
+            self.plumber_page.close()
+
+
+class PdfDocument:
+    """A PDF opened once per upload; every extraction stage reads from this object
+
+    table_settings are pdfplumber table settings (a dict or TableSettings, default
+    pdfplumber's); crop_tables restricts detection to each page's line-item band (off by default).
+    With release_pages, pdfplumber's parsed objects for a page (most of the memory a
+    long document takes) are dropped as soon as its tables have been read.
+    """
+
+    def __init__(self, path, table_settings=None, crop_tables=False, release_pages=True):
+        self.path = path
+        # Resolved once for all pages
+        self.table_settings = TableSettings.resolve(table_settings)
+        self.crop_tables = crop_tables
+        self.release_pages = release_pages
+        self.plumber_pdf = None
+        self.pages = []
+        # Layout template (see layouts.py) tables are read through, or None for full detection
+        self.layout = None
+        # Indices of pages whose OCR failed or read no text (see extract_text_with_ocr)
+        self.ocr_failed_pages = []
+
+    def open(self):
+        # Text layer via PyPDF2, as before; None means fall back to pdfplumber per page
+        texts = None
+        try:
+            with stage('text_layer'), open(self.path, 'rb') as file:
+                pdf_reader = PyPDF2.PdfReader(file)
+                texts = [page.extract_text() or "" for page in pdf_reader.pages]
+        except Exception as e:
+            print(f"Error extracting text with PyPDF2: {e}")
+
+        # Layout analysis (tables, rendering) via a single pdfplumber handle
+        try:
+            with stage('pdf_open'):
+                self.plumber_pdf = pdfplumber.open(self.path)
+            page_count = len(self.plumber_pdf.pages)
+        except Exception as e:
+            print(f"Error opening PDF with pdfplumber: {e}")
+            self.plumber_pdf = None
+            page_count = len(texts) if texts else 0
+
+        self.pages = [
+            PdfPage(self, idx, texts[idx] if texts is not None and idx < len(texts) else None)
+            for idx in range(page_count)
+        ]
+        return self
+
+    def use_layout(self, template):
+        """Read tables through a layout template from now on (None for full detection)"""
+        self.layout = template
+        for page in self.pages:
+            page._tables = None
+            page.table_cells = None
+
+    def close(self):
+        for page in self.pages:
+            page.release_image()
+        if self.plumber_pdf is not None:
+            self.plumber_pdf.close()
+            self.plumber_pdf = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def text(self):
+        """Text of all pages joined in page order"""
+        return "".join(page.text for page in self.pages)
+
+    @property
+    def tables(self):
+        """All tables in the document as (page number, table index, rows) dicts"""
+        tables = []
+        for page in self.pages:
+            for table_idx, rows in enumerate(page.tables):
+                tables.append({
+                    'page': page.number,
+                    'table_index': table_idx + 1,
+                    'rows': rows
+                })
+        return tables
+
+
+@contextmanager
+def open_document(source):
+    """Yield a PdfDocument for a path, or the document itself if one is passed in"""
+    if isinstance(source, PdfDocument):
+        yield source
+    else:
+        with PdfDocument(source) as document:
+            yield document
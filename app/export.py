@@ -0,0 +1,318 @@
+"""Streaming writers for consolidated (Excel, CSV, Parquet) and per-file Excel output"""
+import csv
+from decimal import Decimal, InvalidOperation
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+from extractor import OUTPUT_FIELDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+# Consolidated column headers, in OUTPUT_FIELDS order
+COLUMN_HEADERS = {
+    'sno': 'SNO',
+    'invoice_no': 'INVOICE NO',
+    'date': 'DATE',
+    'receiver_name': 'RECEIVER NAME',
+    'receiver_gst': 'RECEIVER GST',
+    'hsn': 'HSN',
+    'quantity': 'QUANTITY',
+    'taxable_amount': 'TAXABLE AMOUNT',
+    'taxrate': 'TAXRATE',
+    'cgst': 'CGST',
+    'sgst': 'SGST',
+    'invoice_value': 'INVOICE VALUE',
+    'total_invoice_value': 'TOTAL INVOICE VALUE'
+}
+# Columns written as numbers rather than the formatted strings produced by parsing
+AMOUNT_FIELDS = {'quantity', 'taxable_amount', 'cgst', 'sgst', 'invoice_value', 'total_invoice_value'}
+AMOUNT_FORMAT = '#,##0.00'
+PERCENT_FORMAT = '0%'
+CENTS = Decimal('0.01')
+
+
+def to_number(value):
+    """Parse a formatted amount ('1,234.50') to float; None for blanks, the value itself if not numeric"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).replace(',', '').strip())
+    except ValueError:
+        return value
+
+
+def to_percent(value):
+    """Parse a tax rate ('18%') to a fraction (0.18); the value itself if not a percentage"""
+    text = str(value).strip() if value is not None else ''
+    if not text:
+        return None
+    try:
+        return float(text.rstrip('%').strip()) / 100
+    except ValueError:
+        return value
+
+
+def to_serial(value):
+    """Serial numbers as integers where they are plain digits"""
+    text = str(value).strip() if value is not None else ''
+    if text.isdigit():
+        return int(text)
+    return text or None
+
+
+def to_decimal(value):
+    """Parse a formatted amount or rate ('1,234.50', '18%') to a Decimal with two places, or None"""
+    text = str(value).replace(',', '').rstrip('%').strip() if value is not None else ''
+    if not text:
+        return None
+    try:
+        return Decimal(text).quantize(CENTS)
+    except InvalidOperation:
+        return None
+
+
+def typed_cell(sheet, field, value):
+    """Write-only cell for a parsed value, typed as a number or percentage where possible"""
+    if field in AMOUNT_FIELDS:
+        number = to_number(value)
+        if isinstance(number, float):
+            cell = WriteOnlyCell(sheet, value=number)
+            cell.number_format = AMOUNT_FORMAT
+            return cell
+        return number
+    if field == 'taxrate':
+        rate = to_percent(value)
+        if isinstance(rate, float):
+            cell = WriteOnlyCell(sheet, value=rate)
+            cell.number_format = PERCENT_FORMAT
+            return cell
+        return rate
+    if field == 'sno':
+        return to_serial(value)
+    return value if value != '' else None
+
+
+def typed_row(sheet, row, fields):
+    return [typed_cell(sheet, field, row.get(field, '')) for field in fields]
+
+
+class ConsolidatedExcelWriter:
+    """Write-only consolidated workbook that rows are appended to as each PDF finishes
+
+    openpyxl's write-only mode streams rows to disk, so memory stays flat however
+    many line items the batch has.
+    """
+
+    def __init__(self, output_path, sheet_name='Sheet1'):
+        self.output_path = output_path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(sheet_name)
+        self.sheet.append([COLUMN_HEADERS[field] for field in OUTPUT_FIELDS])
+        self.rows_written = 0
+
+    def write_rows(self, rows):
+        """Append parsed rows (dicts keyed by OUTPUT_FIELDS)"""
+        for row in rows:
+            self.sheet.append(typed_row(self.sheet, row, OUTPUT_FIELDS))
+            self.rows_written += 1
+
+    def close(self):
+        self.workbook.save(self.output_path)
+        return self.output_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_file_workbook(parsed_data, tables, raw_text, output_path):
+    """Per-file workbook (Parsed_Data, one sheet per table, Raw_Text) in write-only mode
+
+    tables is a list of dicts with 'page' and 'rows' as produced by PdfDocument.tables.
+    """
+    workbook = Workbook(write_only=True)
+    sheets_created = 0
+
+    # Parsed data sheet
+    if parsed_data:
+        try:
+            sheet = workbook.create_sheet('Parsed_Data')
+            fields = list(parsed_data[0].keys())
+            sheet.append(fields)
+            for row in parsed_data:
+                sheet.append(typed_row(sheet, row, fields))
+            sheets_created += 1
+        except Exception as e:
+            print(f"Error creating parsed data sheet: {e}")
+
+    # Tables sheets
+    for i, table_info in enumerate(tables or []):
+        try:
+            rows = table_info['rows']
+            sheet = workbook.create_sheet(f'Table_{table_info["page"]}_{i+1}')
+            width = max((len(row) for row in rows), default=0)
+            sheet.append(list(range(width)))
+            for row in rows:
+                sheet.append(list(row))
+            sheets_created += 1
+        except Exception as e:
+            print(f"Error creating table sheet: {e}")
+
+    # Raw text sheet
+    if raw_text and raw_text.strip():
+        try:
+            sheet = workbook.create_sheet('Raw_Text')
+            sheet.append(['Raw_Text'])
+            sheet.append([raw_text])
+            sheets_created += 1
+        except Exception as e:
+            print(f"Error creating raw text sheet: {e}")
+
+    # If no sheets were created, create a default sheet
+    if sheets_created == 0:
+        sheet = workbook.create_sheet('No_Data')
+        sheet.append(['Message'])
+        sheet.append(['No data could be extracted from this PDF'])
+
+    workbook.save(output_path)
+    return output_path
+
+
+def decimal_row(row):
+    """Parsed row with amounts and tax rate (in percent) as Decimals and SNO as an integer"""
+    values = {}
+    for field in OUTPUT_FIELDS:
+        value = row.get(field, '')
+        if field in AMOUNT_FIELDS or field == 'taxrate':
+            values[field] = to_decimal(value)
+        elif field == 'sno':
+            serial = to_serial(value)
+            values[field] = serial if isinstance(serial, int) else None
+        else:
+            values[field] = value if value not in ('', None) else None
+    return values
+
+
+class ConsolidatedCsvWriter:
+    """Streaming CSV with the consolidated column schema and plain decimal amounts
+
+    With append, rows are added to the end of an existing file written by this class.
+    """
+
+    def __init__(self, output_path, append=False):
+        self.output_path = output_path
+        self.file = open(output_path, 'a' if append else 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        if not append:
+            self.writer.writerow([COLUMN_HEADERS[field] for field in OUTPUT_FIELDS])
+        self.rows_written = 0
+
+    def write_rows(self, rows):
+        for row in rows:
+            values = decimal_row(row)
+            self.writer.writerow(['' if values[field] is None else values[field] for field in OUTPUT_FIELDS])
+            self.rows_written += 1
+
+    def close(self):
+        self.file.close()
+        return self.output_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConsolidatedParquetWriter:
+    """Columnar Parquet with decimal amounts, written one row group per batch of rows"""
+
+    def __init__(self, output_path, row_group_size=10000):
+        if pa is None:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+        self.output_path = output_path
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([
+            pa.field(COLUMN_HEADERS[field], parquet_type(field)) for field in OUTPUT_FIELDS
+        ])
+        self.writer = pq.ParquetWriter(output_path, self.schema)
+        self.buffer = []
+        self.rows_written = 0
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.buffer.append(decimal_row(row))
+            self.rows_written += 1
+            if len(self.buffer) >= self.row_group_size:
+                self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        columns = {
+            COLUMN_HEADERS[field]: [values[field] for values in self.buffer] for field in OUTPUT_FIELDS
+        }
+        self.writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+        self.buffer = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+        return self.output_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def parquet_type(field):
+    if field in AMOUNT_FIELDS:
+        return pa.decimal128(18, 2)
+    if field == 'taxrate':
+        return pa.decimal128(5, 2)
+    if field == 'sno':
+        return pa.int32()
+    return pa.string()
+
+
+# Consolidated output formats: file extension -> writer class
+EXPORT_FORMATS = {
+    'xlsx': ConsolidatedExcelWriter,
+    'csv': ConsolidatedCsvWriter,
+    'parquet': ConsolidatedParquetWriter,
+}
+
+
+# Formats whose files can be extended in place; the others are rewritten to add rows
+APPENDABLE_FORMATS = {'csv'}
+
+
+def available_formats():
+    """Consolidated output formats usable in this environment"""
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or pa is not None]
+
+
+def open_consolidated_writer(output_format, output_path, append=False):
+    """Writer for a consolidated output format ('xlsx', 'csv' or 'parquet')
+
+    With append, rows go to the end of an existing output (APPENDABLE_FORMATS only).
+    """
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {output_format}")
+    if append:
+        if output_format not in APPENDABLE_FORMATS:
+            raise ValueError(f"Cannot append to a {output_format} file")
+        return EXPORT_FORMATS[output_format](output_path, append=True)
+    return EXPORT_FORMATS[output_format](output_path)
@@ -0,0 +1,462 @@
+"""Table-driven invoice field extractor with all patterns compiled once at import"""
+import re
+
+import numpy as np
+
+# Invoice header fields; each takes the first match in the text
+HEADER_PATTERNS = [
+    ('invoice_no', re.compile(r'(?:#\s*:?\s*|Invoice\s*#?\s*:?\s*|INVOICE\s*NO\.?\s*:?\s*)([A-Z0-9\-/]+)', re.IGNORECASE | re.MULTILINE)),
+    ('date', re.compile(r'(?:Invoice\s*Date\s*:?\s*|DATE\s*:?\s*|Date\s*:?\s*)([\d/.\-]+)', re.IGNORECASE | re.MULTILINE)),
+    ('taxrate', re.compile(r'(?:CGST|SGST)\s*(\d+(?:\.\d+)?)\s*%', re.IGNORECASE | re.MULTILINE)),
+    ('cgst', re.compile(r'CGST\d*\s*\(\d+%\)\s*([\d,]+\.?\d*)', re.IGNORECASE | re.MULTILINE)),
+    ('sgst', re.compile(r'SGST\d*\s*\(\d+%\)\s*([\d,]+\.?\d*)', re.IGNORECASE | re.MULTILINE)),
+    ('invoice_value', re.compile(r'(?:Total\s*:?\s*|TOTAL\s*:?\s*)(?:Rs\.?|INR|₹)?\s*([\d,]+\.?\d*)', re.IGNORECASE | re.MULTILINE)),
+    ('total_invoice_value', re.compile(r'(?:Balance\s*Due\s*:?\s*|GRAND\s*TOTAL\s*:?\s*|FINAL\s*TOTAL\s*:?\s*)(?:Rs\.?|INR|₹)?\s*([\d,]+\.?\d*)', re.IGNORECASE | re.MULTILINE)),
+]
+# Remove special characters except common ones from header values
+HEADER_VALUE_CLEAN_RE = re.compile(r'[^\w\s.,/-]')
+
+# "Bill To" followed by the next few lines, which hold the receiver name. The whitespace runs
+# around the separator cannot overlap, so a failed match does not backtrack over them
+RECEIVER_NAME_RE = re.compile(r'(?:Bill\s*To|Receiver|Billed\s*to)\s*(?:[:\.]\s*)?((?:[^\r\n]+[\r\n]*){1,4})', re.IGNORECASE)
+RECEIVER_NAME_SKIP = ('gstin', 'invoice', 'date', 'ship to', 'shipment', 'place of supply', 'terms')
+HONORIFIC_RE = re.compile(r'^(?:M/s|Mr\.|Mrs\.|Dr\.)\s*', re.IGNORECASE)
+
+# Receiver GSTIN within 500 characters of the "Bill To" block, else any GSTIN in the document.
+# Separator runs are bounded and do not overlap, so a failed attempt costs at most 500 x 20 steps
+RECEIVER_GST_RE = re.compile(r'(?:Bill\s*To|Receiver|Billed\s*to)[\s\S]{0,500}?(?:GSTIN|GST(?:\s*#)?)[\s.:]{0,20}([A-Z0-9]{15})', re.IGNORECASE | re.MULTILINE)
+ANY_GST_RE = re.compile(r'(?:GSTIN|GST(?:\s*#)?)(?:\s*:)?\s*([A-Z0-9]{15})', re.IGNORECASE)
+
+# Header fields are scanned in windows of this many characters, stopping once every field is
+# found; the last HEADER_OVERLAP characters of a window are scanned again with the next one so
+# matches across a window boundary are not missed (no header match is longer than this)
+HEADER_CHUNK_CHARS = 4096
+HEADER_OVERLAP = 2048
+
+# Cell patterns used for every line-item row
+RATE_LIKE_RE = re.compile(r'^\d+(\.\d+)?\s*%?$')
+AMOUNT_LIKE_RE = re.compile(r'[\d,]+\.\d{2}')
+NUMBER_RE = re.compile(r'([\d,]+\.?\d*)')
+HSN_DIGITS_RE = re.compile(r'\d{2,8}')
+
+# Header keywords per column, in the order the columns are looked up
+COLUMN_KEYWORDS = [
+    ('sno', ('s.no', 'serial', 'sr.', 'no.')),
+    ('hsn', ('hsn', 'sac', 'code')),
+    ('qty', ('qty', 'quantity', 'unit')),
+    ('rate', ('rate', 'taxable', 'price')),
+    ('discount', ('disc', 'less')),
+    # Tax columns are often just labeled "CGST"/"SGST" and split into Rate/Amt sub-columns
+    ('cgst', ('cgst',)),
+    ('sgst', ('sgst',)),
+    ('amount', ('amount', 'total', 'value')),
+]
+# Fallback column positions of the original invoice format, used when no HSN header is found
+FALLBACK_COLUMNS = {
+    'sno': 1, 'hsn': 3, 'qty': 4, 'rate': 5,
+    'discount': 6, 'cgst': 10, 'sgst': 12, 'amount': 13
+}
+# Line-item fields whose value is the first number found in the cell
+NUMERIC_FIELDS = (
+    ('quantity', 'qty'),
+    ('taxable_amount', 'rate'),
+    ('cgst', 'cgst'),
+    ('sgst', 'sgst'),
+    ('invoice_value', 'amount'),
+)
+
+DEFAULT_TAXRATE = '18%'
+
+HEADER_FIELDS = frozenset([field for field, _ in HEADER_PATTERNS] + ['receiver_name', 'receiver_gst'])
+
+OUTPUT_FIELDS = ['sno', 'invoice_no', 'date', 'receiver_name', 'receiver_gst', 'hsn',
+                 'quantity', 'taxable_amount', 'taxrate', 'cgst', 'sgst',
+                 'invoice_value', 'total_invoice_value']
+INVOICE_FIELDS = ('invoice_no', 'date', 'receiver_name', 'receiver_gst')
+
+
+def _row_text(row):
+    """Lower-cased text of a table row for keyword checks"""
+    return '\x1f'.join(str(cell) for cell in row).lower()
+
+
+def _cell(row, idx):
+    """Safe cell lookup returning '' for missing or out-of-range columns"""
+    if idx is not None and isinstance(idx, int) and 0 <= idx < len(row):
+        return row[idx]
+    return ''
+
+
+def parse_float(val):
+    """Parse a comma-formatted number, returning 0.0 if it is not one"""
+    try:
+        return float(str(val).replace(',', ''))
+    except (ValueError, TypeError):
+        return 0.0
+
+
+class LineItems:
+    """Line items of one invoice held column-wise, with numeric cells parsed to floats once
+
+    Text columns (sno, hsn, discount, taxrate) are lists of strings and numeric
+    columns (NUMERIC_FIELDS) lists of floats; column() returns a NumPy array.
+    """
+
+    TEXT_FIELDS = ('sno', 'hsn', 'discount', 'taxrate')
+
+    def __init__(self):
+        self.columns = {field: [] for field in self.TEXT_FIELDS}
+        self.columns.update((field, []) for field, _ in NUMERIC_FIELDS)
+
+    def __len__(self):
+        return len(self.columns['hsn'])
+
+    def append(self, values):
+        for field, column in self.columns.items():
+            column.append(values[field])
+
+    def column(self, field):
+        if field in self.TEXT_FIELDS:
+            return np.array(self.columns[field], dtype=object)
+        return np.array(self.columns[field], dtype=np.float64)
+
+
+class ColumnMap:
+    """Column positions of a line-item table, resolved once per table from its header row
+
+    Without an HSN header, fallback (a column map, e.g. a layout template's) or
+    FALLBACK_COLUMNS is used and the fallback attribute is set.
+    """
+
+    def __init__(self, table, fallback=None):
+        # Scan the first few rows for a likely header row
+        self.header_row_idx = 0
+        header_row = table[0]
+        for idx, row in enumerate(table[:10]):
+            row_str = _row_text(row)
+            if 'description' in row_str or 'qty' in row_str or ('hsn' in row_str and 'sac' in row_str):
+                header_row = row
+                self.header_row_idx = idx
+                break
+
+        headers = [str(h).lower() if h else '' for h in header_row]
+        columns = {}
+        for name, keywords in COLUMN_KEYWORDS:
+            columns[name] = next((idx for idx, h in enumerate(headers)
+                                  if h and any(k in h for k in keywords)), None)
+
+        # Check if a sub-header row (after the header) labels the tax Amount columns
+        if self.header_row_idx + 1 < len(table):
+            sub_header = table[self.header_row_idx + 1]
+            for tax in ('cgst', 'sgst'):
+                if columns[tax] is None:
+                    continue
+                # Check the tax column itself and the next two
+                for chk_idx in range(columns[tax], min(columns[tax] + 3, len(sub_header))):
+                    val = str(sub_header[chk_idx]).lower()
+                    if 'amt' in val or 'amount' in val:
+                        columns[f'{tax}_amt_idx'] = chk_idx
+                        break
+
+        # Without an HSN header this is likely the original format with complex headers;
+        # fall back to its hardcoded indices for backward compatibility
+        self.fallback = columns.get('hsn') is None
+        if self.fallback:
+            columns = dict(fallback or FALLBACK_COLUMNS)
+
+        self.columns = columns
+        self.cgst_amt_idx = columns.get('cgst_amt_idx')
+        self.sgst_amt_idx = columns.get('sgst_amt_idx')
+        self.cgst_idx = columns.get('cgst_amt_idx', columns.get('cgst'))
+        self.sgst_idx = columns.get('sgst_amt_idx', columns.get('sgst'))
+
+    def get(self, name):
+        return self.columns.get(name)
+
+
+def _receiver_name(match):
+    """First meaningful line after "Bill To", skipping headers such as "Ship To" or GSTIN lines"""
+    for line in match.group(1).splitlines():
+        clean_name = line.strip()
+        check = clean_name.lower()
+        if len(clean_name) > 2 and not any(x in check for x in RECEIVER_NAME_SKIP):
+            return HONORIFIC_RE.sub('', clean_name)
+    return None
+
+
+class HeaderScanner:
+    """Invoice header fields filled in incrementally from consecutive pieces of text
+
+    feed() the text in order (pages or fixed-size windows) until done, then
+    finish(). Each field keeps the first match in the whole text: a match is only
+    accepted once no earlier or longer match can still complete with text that
+    has not been fed yet, and the unsettled end of the text is kept for the next
+    piece.
+    """
+
+    def __init__(self, fields=None):
+        fields = set(fields) if fields is not None else HEADER_FIELDS
+        self.patterns = {field: pattern for field, pattern in HEADER_PATTERNS if field in fields}
+        if 'receiver_name' in fields:
+            self.patterns['receiver_name'] = RECEIVER_NAME_RE
+        if 'receiver_gst' in fields:
+            self.patterns['receiver_gst'] = RECEIVER_GST_RE
+        self.matches = {}
+        # First two GSTINs anywhere, the fallback for receiver_gst; _gst_from is where to look next
+        self.any_gsts = []
+        self._gst_from = 0
+        self._window = ''
+        self._window_start = 0  # Offset of _window in the whole text
+
+    @property
+    def done(self):
+        return len(self.matches) == len(self.patterns)
+
+    def feed(self, text):
+        self._window += text
+        self._scan(final=False)
+
+    def finish(self):
+        """Scan what is left and return the fields found"""
+        self._scan(final=True)
+        common_data = {}
+        for field, _ in HEADER_PATTERNS:
+            if field in self.matches:
+                common_data[field] = HEADER_VALUE_CLEAN_RE.sub('', self.matches[field].group(1).strip())
+        if 'receiver_name' in self.matches:
+            name = _receiver_name(self.matches['receiver_name'])
+            if name:
+                common_data['receiver_name'] = name
+        if 'receiver_gst' in self.patterns:
+            if 'receiver_gst' in self.matches:
+                common_data['receiver_gst'] = self.matches['receiver_gst'].group(1).strip()
+            elif self.any_gsts:
+                # Usually the first GSTIN is the sender's and the second the receiver's
+                common_data['receiver_gst'] = self.any_gsts[1] if len(self.any_gsts) > 1 else self.any_gsts[0]
+        return common_data
+
+    def _scan(self, final):
+        window = self._window
+        # Matches starting after this may still change or be preceded by a match with more text
+        settled = len(window) - HEADER_OVERLAP
+        keep_from = max(0, settled)
+
+        def accepted(match):
+            return final or (match.start() <= settled and match.end() < len(window))
+
+        for field, pattern in self.patterns.items():
+            if field in self.matches:
+                continue
+            match = pattern.search(window)
+            if match is None:
+                continue
+            if accepted(match):
+                self.matches[field] = match
+            else:
+                keep_from = min(keep_from, match.start())
+
+        if 'receiver_gst' in self.patterns and 'receiver_gst' not in self.matches:
+            while len(self.any_gsts) < 2:
+                match = ANY_GST_RE.search(window, max(0, self._gst_from - self._window_start))
+                if match is None:
+                    break
+                if not accepted(match):
+                    keep_from = min(keep_from, match.start())
+                    break
+                self.any_gsts.append(match.group(1))
+                self._gst_from = self._window_start + match.end()
+
+        if not final:
+            self._window = window[keep_from:]
+            self._window_start += keep_from
+
+
+class InvoiceExtractor:
+    """Extracts invoice header fields and line items from text and table rows"""
+
+    def extract_header(self, text, fields=None):
+        """Invoice-level fields (invoice number, date, receiver, totals) from the text
+
+        With fields, only those are looked for and scanning stops once all are found.
+        """
+        scanner = HeaderScanner(fields)
+        for start in range(0, len(text), HEADER_CHUNK_CHARS):
+            scanner.feed(text[start:start + HEADER_CHUNK_CHARS])
+            if scanner.done:
+                break
+        return scanner.finish()
+
+    def extract_items(self, tables, items=None, fallback_columns=None):
+        """Line items (LineItems) from a list of tables (lists of rows), appended to items if given
+
+        fallback_columns is the column map for tables without a recognizable header.
+        """
+        if items is None:
+            items = LineItems()
+        for table in tables:
+            if table:
+                self._extract_table_items(table, items, fallback_columns)
+        return items
+
+    def _extract_table_items(self, table, items, fallback_columns=None):
+        col_map = ColumnMap(table, fallback_columns)
+        header_row_idx = col_map.header_row_idx
+        hsn_idx = col_map.get('hsn')
+        sno_idx = col_map.get('sno')
+        discount_idx = col_map.get('discount')
+        field_idx = {
+            'qty': col_map.get('qty'),
+            'rate': col_map.get('rate'),
+            'amount': col_map.get('amount'),
+        }
+
+        for row_idx in range(header_row_idx + 1, len(table)):
+            row = table[row_idx]
+            # Skip sub-header row if it looks like one (contains 'Amt', '%')
+            if row_idx == header_row_idx + 1:
+                row_str = _row_text(row)
+                if 'amt' in row_str or '%' in row_str:
+                    continue
+
+            # Valid item row: HSN cell contains a run of digits
+            hsn_val = _cell(row, hsn_idx)
+            hsn_clean = str(hsn_val).strip().replace('\n', '').replace(' ', '')
+            if not (hsn_clean and HSN_DIGITS_RE.search(hsn_clean)):
+                continue
+
+            sno_val = _cell(row, sno_idx)
+            discount_val = _cell(row, discount_idx)
+            cells = {
+                'qty': _cell(row, field_idx['qty']),
+                'rate': _cell(row, field_idx['rate']),
+                'amount': _cell(row, field_idx['amount']),
+                'cgst': self._tax_cell(row, col_map, 'cgst'),
+                'sgst': self._tax_cell(row, col_map, 'sgst'),
+            }
+
+            item_data = {
+                'sno': str(sno_val).strip() if sno_val else str(len(items) + 1),
+                'hsn': str(hsn_val).strip(),
+                'discount': str(discount_val).strip() if discount_val else '',
+                'taxrate': DEFAULT_TAXRATE,
+            }
+            # Numeric cells in one pass: first number found in each, parsed once
+            for field, column in NUMERIC_FIELDS:
+                value = cells[column]
+                match = NUMBER_RE.search(str(value)) if value else None
+                item_data[field] = parse_float(match.group(1)) if match else 0.0
+
+            items.append(item_data)
+
+    def _tax_cell(self, row, col_map, tax):
+        """CGST/SGST amount cell, looking past a Rate cell when no Amt sub-column is known"""
+        value = _cell(row, col_map.cgst_idx if tax == 'cgst' else col_map.sgst_idx)
+        amt_idx = col_map.cgst_amt_idx if tax == 'cgst' else col_map.sgst_amt_idx
+        if not amt_idx and value and RATE_LIKE_RE.match(str(value).strip()):
+            # Current value is likely a rate; check the next 2 columns for an amount
+            base_idx = col_map.get(tax)
+            if base_idx is not None:
+                for offset in (1, 2):
+                    next_val = _cell(row, base_idx + offset)
+                    if next_val and AMOUNT_LIKE_RE.match(str(next_val).strip()):
+                        return next_val
+        return value
+
+    def aggregate_items(self, items, common_data):
+        """Sum line items (LineItems) per HSN; stores calculated_total_invoice_value in common_data
+
+        Groups keep the order in which each HSN first appears. Sums are accumulated
+        in item order, so results match summing row by row.
+        """
+        hsn = items.column('hsn')
+        keep = hsn != ''
+        if not keep.any():
+            return []
+        hsn = hsn[keep]
+        codes, first_index, group = np.unique(hsn.astype(str), return_index=True, return_inverse=True)
+        # np.unique sorts the codes; renumber groups by first appearance instead
+        order = np.argsort(first_index, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        group = rank[group.ravel()]
+        groups = len(codes)
+
+        def group_sum(field):
+            return np.bincount(group, weights=items.column(field)[keep], minlength=groups)
+
+        quantity = group_sum('quantity')
+        # Taxable amount sums the Amount column (invoice_value), not the Rate column
+        taxable = group_sum('invoice_value')
+        cgst = group_sum('cgst')
+        sgst = group_sum('sgst')
+        # Invoice value = taxable amount + CGST + SGST
+        invoice_value = taxable + cgst + sgst
+        # Assume the same tax rate for the same HSN: take the first item's
+        taxrate = items.column('taxrate')[keep][first_index[order]]
+
+        def formatted(values):
+            return np.char.mod('%.2f', values).tolist()
+
+        common_data['calculated_total_invoice_value'] = f"{np.cumsum(invoice_value)[-1]:.2f}"
+        return [{
+            'sno': str(idx),
+            'hsn': code,
+            'quantity': qty,
+            'taxable_amount': amount,
+            'taxrate': rate,
+            'cgst': cgst_value,
+            'sgst': sgst_value,
+            'invoice_value': value
+        } for idx, (code, qty, amount, rate, cgst_value, sgst_value, value) in enumerate(zip(
+            codes[order].tolist(), formatted(quantity), formatted(taxable), taxrate.tolist(),
+            formatted(cgst), formatted(sgst), formatted(invoice_value)), 1)]
+
+    def build_rows(self, common_data, items):
+        """One output row per item (invoice fields on the first only) plus a total row"""
+        if not items:
+            items = [{
+                'sno': '1', 'hsn': '', 'quantity': '', 'taxable_amount': '',
+                'taxrate': '', 'cgst': '', 'sgst': '', 'invoice_value': ''
+            }]
+
+        final_data = []
+        for i, item in enumerate(items):
+            row_data = {field: '' for field in OUTPUT_FIELDS}
+            row_data.update({
+                'sno': item['sno'],
+                'hsn': item['hsn'],
+                'quantity': item['quantity'],
+                'taxable_amount': item['taxable_amount'],
+                'taxrate': item['taxrate'],
+                'cgst': item['cgst'],
+                'sgst': item['sgst'],
+                'invoice_value': item['invoice_value'],
+            })
+            if i == 0:
+                for field in INVOICE_FIELDS:
+                    row_data[field] = common_data.get(field, '')
+            final_data.append(row_data)
+
+        # Final row with the total invoice value, preferring the calculated total
+        total_row = {field: '' for field in OUTPUT_FIELDS}
+        total_row['total_invoice_value'] = common_data.get('calculated_total_invoice_value',
+                                                           common_data.get('total_invoice_value', ''))
+        final_data.append(total_row)
+        return final_data
+
+    def parse(self, text, tables, fallback_columns=None):
+        """Parse invoice text and table rows into the consolidated output rows"""
+        items = LineItems()
+        try:
+            self.extract_items(tables, items, fallback_columns)
+        except Exception as e:
+            print(f"Error extracting table data: {e}")
+        # The total is calculated from the line items when there are any; only the invoice
+        # fields are then needed, which usually sit on the first page
+        fields = INVOICE_FIELDS if len(items) else INVOICE_FIELDS + ('total_invoice_value',)
+        common_data = self.extract_header(text, fields)
+        rows = self.aggregate_items(items, common_data) if len(items) else []
+        return self.build_rows(common_data, rows)
+
+
+invoice_extractor = InvoiceExtractor()
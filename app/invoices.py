@@ -0,0 +1,235 @@
+"""Cross-batch invoice index in the job store: every parsed invoice and line item, with duplicate flags
+
+Each finished file is indexed as one invoice (its invoice fields, total and
+consolidated rows) with indexes on invoice number, receiver GSTIN, HSN and
+date, so invoices from all batches can be searched and exported without
+reprocessing PDFs. An invoice is flagged as a duplicate when the same file
+(SHA-256) or the same invoice number for the same receiver GSTIN was already
+indexed from an earlier upload.
+"""
+import json
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+
+from jobs import MAX_PAGE_SIZE, _like_prefix
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    unique_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    sha256 TEXT,
+    invoice_no TEXT,
+    date TEXT,
+    invoice_date TEXT,
+    receiver_name TEXT,
+    receiver_gst TEXT,
+    total_invoice_value REAL,
+    items INTEGER NOT NULL,
+    duplicate_of INTEGER,
+    created_at REAL NOT NULL,
+    UNIQUE (job_id, position)
+);
+CREATE TABLE IF NOT EXISTS invoice_rows (
+    invoice_id INTEGER NOT NULL,
+    row_index INTEGER NOT NULL,
+    hsn TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (invoice_id, row_index)
+);
+CREATE INDEX IF NOT EXISTS invoices_invoice_no ON invoices (invoice_no, receiver_gst);
+CREATE INDEX IF NOT EXISTS invoices_receiver_gst ON invoices (receiver_gst, invoice_date);
+CREATE INDEX IF NOT EXISTS invoices_invoice_date ON invoices (invoice_date);
+CREATE INDEX IF NOT EXISTS invoices_sha256 ON invoices (sha256);
+CREATE INDEX IF NOT EXISTS invoice_rows_hsn ON invoice_rows (hsn, invoice_id);
+"""
+
+# Invoice dates as printed on Indian invoices (day first), normalized to ISO for range queries
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y', '%d-%m-%y', '%d.%m.%y', '%Y-%m-%d', '%Y/%m/%d')
+
+# Which invoices a search returns: all, only the first copies, or only the duplicates
+DUPLICATES = ('include', 'exclude', 'only')
+
+
+def iso_date(text):
+    """ISO date (YYYY-MM-DD) of a parsed invoice date, or None if it is not one"""
+    text = (text or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def _amount(value):
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return None
+
+
+class InvoiceIndex:
+    """Invoices indexed in a job store database; JobQueue adds each finished file through add"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            # Rows left behind by re-indexing before invoice ids were kept (see add)
+            conn.execute("DELETE FROM invoice_rows WHERE invoice_id NOT IN (SELECT id FROM invoices)")
+            conn.commit()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def find_duplicate(self, conn, sha256=None, invoice_no=None, receiver_gst=None, job_id=None, position=None):
+        """Earliest indexed invoice with the same file contents or invoice number and receiver, or None
+
+        The invoice of job_id and position itself (when it is being indexed again) is
+        not counted. Returns a dict with 'reason' ('same_file' or 'same_invoice') and
+        the original's id, job_id, filename, unique_id, invoice_no and receiver_gst.
+        """
+        columns = "id, job_id, filename, unique_id, invoice_no, receiver_gst"
+        other = "NOT (job_id IS ? AND position IS ?)"
+        if sha256:
+            row = conn.execute(f"SELECT {columns} FROM invoices WHERE sha256 = ? AND {other} ORDER BY id LIMIT 1",
+                               (sha256, job_id, position)).fetchone()
+            if row is not None:
+                return dict(row, reason='same_file')
+        if invoice_no and receiver_gst:
+            row = conn.execute(f"SELECT {columns} FROM invoices WHERE invoice_no = ? AND receiver_gst = ? "
+                               f"AND {other} ORDER BY id LIMIT 1",
+                               (invoice_no, receiver_gst, job_id, position)).fetchone()
+            if row is not None:
+                return dict(row, reason='same_invoice')
+        return None
+
+    def add(self, conn, job_id, position, unique_id, filename, sha256, parsed_rows):
+        """Index a finished file's parsed rows as one invoice on conn (the caller commits)
+
+        Returns the earlier invoice it duplicates (see find_duplicate) or None.
+        """
+        first = parsed_rows[0] if parsed_rows else {}
+        invoice_no = first.get('invoice_no') or None
+        receiver_gst = first.get('receiver_gst') or None
+        total = parsed_rows[-1].get('total_invoice_value') if parsed_rows else None
+        duplicate = self.find_duplicate(conn, sha256, invoice_no, receiver_gst, job_id, position)
+        # Re-indexing a file keeps its invoice id, so its old rows are replaced rather than orphaned
+        conn.execute(
+            "INSERT INTO invoices (job_id, position, unique_id, filename, sha256, invoice_no, date, "
+            "invoice_date, receiver_name, receiver_gst, total_invoice_value, items, duplicate_of, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (job_id, position) DO UPDATE SET unique_id = excluded.unique_id, "
+            "filename = excluded.filename, sha256 = excluded.sha256, invoice_no = excluded.invoice_no, "
+            "date = excluded.date, invoice_date = excluded.invoice_date, receiver_name = excluded.receiver_name, "
+            "receiver_gst = excluded.receiver_gst, total_invoice_value = excluded.total_invoice_value, "
+            "items = excluded.items, duplicate_of = excluded.duplicate_of, created_at = excluded.created_at",
+            (job_id, position, unique_id, filename, sha256, invoice_no, first.get('date') or None,
+             iso_date(first.get('date')), first.get('receiver_name') or None, receiver_gst,
+             _amount(total) if total else None, sum(1 for row in parsed_rows if row.get('hsn')),
+             duplicate['id'] if duplicate else None, time.time()))
+        invoice_id = conn.execute("SELECT id FROM invoices WHERE job_id = ? AND position = ?",
+                                  (job_id, position)).fetchone()['id']
+        conn.execute("DELETE FROM invoice_rows WHERE invoice_id = ?", (invoice_id,))
+        conn.executemany("INSERT INTO invoice_rows (invoice_id, row_index, hsn, data) VALUES (?, ?, ?, ?)",
+                         [(invoice_id, index, row.get('hsn') or None, json.dumps(row))
+                          for index, row in enumerate(parsed_rows)])
+        return duplicate
+
+    @staticmethod
+    def _filters(invoice_no=None, receiver_gst=None, hsn=None, date_from=None, date_to=None,
+                 duplicates='include'):
+        """WHERE clause and parameters; dates are ISO strings, invoice_no and hsn prefixes"""
+        if duplicates not in DUPLICATES:
+            raise ValueError(f"duplicates must be one of {', '.join(DUPLICATES)}")
+        for name, value in (('from', date_from), ('to', date_to)):
+            if value and iso_date(value) != value:
+                raise ValueError(f"Invalid {name} date: {value} (expected YYYY-MM-DD)")
+        where, params = [], []
+        if invoice_no:
+            where.append("invoice_no LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(invoice_no))
+        if receiver_gst:
+            where.append("receiver_gst = ?")
+            params.append(receiver_gst)
+        if hsn:
+            where.append("id IN (SELECT invoice_id FROM invoice_rows WHERE hsn LIKE ? ESCAPE '\\')")
+            params.append(_like_prefix(hsn))
+        if date_from:
+            where.append("invoice_date >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("invoice_date <= ?")
+            params.append(date_to)
+        if duplicates == 'exclude':
+            where.append("duplicate_of IS NULL")
+        elif duplicates == 'only':
+            where.append("duplicate_of IS NOT NULL")
+        return ' AND '.join(where) or '1 = 1', params
+
+    def search(self, cursor=None, limit=100, **filters):
+        """One page of matching invoices (newest first) and the cursor of the next page (or None)
+
+        Filters: invoice_no and hsn (prefixes), receiver_gst, date_from and date_to
+        (ISO dates, inclusive) and duplicates (one of DUPLICATES).
+        """
+        where, params = self._filters(**filters)
+        if cursor:
+            try:
+                params.append(int(cursor))
+            except ValueError:
+                raise ValueError(f"Invalid cursor: {cursor}")
+            where += " AND id < ?"
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        with closing(self._connect()) as conn:
+            found = conn.execute(f"SELECT * FROM invoices WHERE {where} ORDER BY id DESC LIMIT ?",
+                                 params + [limit + 1]).fetchall()
+        invoices = [dict(row) for row in found[:limit]]
+        next_cursor = str(found[limit - 1]['id']) if len(found) > limit else None
+        return invoices, next_cursor
+
+    def count(self, **filters):
+        where, params = self._filters(**filters)
+        with closing(self._connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM invoices WHERE {where}", params).fetchone()[0]
+
+    def iter_rows(self, page_size=MAX_PAGE_SIZE, **filters):
+        """Consolidated rows of all matching invoices in invoice date order, page_size invoices at a time
+
+        Each page is read with a keyset query on its own short-lived connection, so no
+        read stays open and blocks job commits while a long export is written. Invalid
+        filters raise ValueError here rather than once the rows are read.
+        """
+        where, params = self._filters(**filters)
+
+        def rows():
+            after = None
+            while True:
+                keyset, keyset_params = '', []
+                if after is not None:
+                    keyset, keyset_params = " AND (COALESCE(invoice_date, ''), id) > (?, ?)", list(after)
+                with closing(self._connect()) as conn:
+                    invoices = conn.execute(
+                        f"SELECT id, COALESCE(invoice_date, '') AS date_key FROM invoices WHERE {where}{keyset} "
+                        "ORDER BY date_key, id LIMIT ?", params + keyset_params + [page_size]).fetchall()
+                    if not invoices:
+                        break
+                    ids = [invoice['id'] for invoice in invoices]
+                    found = conn.execute(f"SELECT invoice_id, data FROM invoice_rows WHERE invoice_id IN "
+                                         f"({', '.join('?' * len(ids))}) ORDER BY invoice_id, row_index",
+                                         ids).fetchall()
+                by_invoice = {}
+                for row in found:
+                    by_invoice.setdefault(row['invoice_id'], []).append(row['data'])
+                for invoice_id in ids:
+                    for data in by_invoice.get(invoice_id, []):
+                        yield json.loads(data)
+                after = (invoices[-1]['date_key'], invoices[-1]['id'])
+        return rows()
@@ -0,0 +1,567 @@
+"""Background job queue for uploads, backed by a local SQLite job store"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, nullcontext
+
+from metrics import stage, track_file, log_event, profiled
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    total_files INTEGER NOT NULL,
+    excel_filename TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    unique_id TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    result TEXT,
+    sha256 TEXT,
+    PRIMARY KEY (job_id, position)
+);
+CREATE TABLE IF NOT EXISTS job_rows (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    row_index INTEGER NOT NULL,
+    unique_id TEXT NOT NULL,
+    invoice_no TEXT,
+    hsn TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, position, row_index)
+);
+CREATE TABLE IF NOT EXISTS set_outputs (
+    set_name TEXT NOT NULL,
+    format TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    through_seq INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (set_name, format)
+);
+CREATE INDEX IF NOT EXISTS job_rows_invoice_no ON job_rows (job_id, invoice_no);
+CREATE INDEX IF NOT EXISTS job_rows_hsn ON job_rows (job_id, hsn);
+"""
+
+# Largest page of rows or files the results API returns
+MAX_PAGE_SIZE = 500
+
+# Job and file states; a job is receiving while its upload is still streaming in
+RECEIVING = 'receiving'
+QUEUED = 'queued'
+PROCESSING = 'processing'
+DONE = 'done'
+ERROR = 'error'
+# A file already in the job's consolidation set is not processed again
+SKIPPED = 'skipped'
+FINISHED = (DONE, ERROR, SKIPPED)
+
+
+def _like_prefix(value):
+    """LIKE pattern matching values that start with value"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+class JobQueue:
+    """Runs uploaded files through process_file on a thread pool and records progress
+
+    process_file(file_path, filename, unique_id) returns the per-file result dict.
+    open_output(job_id, **options) returns a writer with write_rows(rows) and close(); each
+    file's parsed rows are appended to it in upload order as soon as the file and
+    all files before it have finished, and close() is called once the job is done.
+
+    Files can be added to a job while its upload is still arriving (create, add_file,
+    then seal); submit does all three for a batch that is already on disk.
+
+    A job can belong to a named consolidation set. Finished jobs are numbered in the
+    order they finish within their set (set_seq), and the set's rows are those of its
+    jobs in that order, so a set only ever grows at the end. A file whose contents
+    are already in the set is skipped rather than extracted again.
+
+    With an invoice_index (an invoices.InvoiceIndex on the same database), every
+    finished file is indexed as an invoice in the same transaction as its rows, and
+    a file duplicating an earlier invoice gets it recorded as its duplicate.
+    """
+
+    def __init__(self, db_path, process_file, open_output, workers=2, profile_dir=None, invoice_index=None):
+        self.db_path = db_path
+        self.process_file = process_file
+        self.open_output = open_output
+        self.invoice_index = invoice_index
+        self.workers = workers
+        self.profile_dir = profile_dir
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        # job_id -> [output writer, next position to append]
+        self._outputs = {}
+        # Jobs whose files are run under cProfile
+        self._profiled = set()
+        # Jobs still receiving files; they cannot finish until sealed
+        self._receiving = set()
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS job_files_unique_id ON job_files (unique_id)")
+            self._backfill_rows(conn)
+            # Rows indexed before invoice numbers were filled down (user_version 0) are re-indexed once
+            if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+                conn.execute("UPDATE job_rows SET invoice_no = (SELECT p.invoice_no FROM job_rows p "
+                             "WHERE p.job_id = job_rows.job_id AND p.position = job_rows.position "
+                             "AND p.row_index < job_rows.row_index AND p.invoice_no IS NOT NULL "
+                             "ORDER BY p.row_index DESC LIMIT 1) WHERE invoice_no IS NULL")
+                conn.execute("PRAGMA user_version = 1")
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(job_files)")]
+            if 'sha256' not in columns:
+                conn.execute("ALTER TABLE job_files ADD COLUMN sha256 TEXT")
+            if 'duplicate' not in columns:
+                conn.execute("ALTER TABLE job_files ADD COLUMN duplicate TEXT")
+            job_columns = [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if 'set_name' not in job_columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN set_name TEXT")
+                conn.execute("ALTER TABLE jobs ADD COLUMN set_seq INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_set ON jobs (set_name, set_seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS job_files_sha256 ON job_files (sha256)")
+            if invoice_index is not None:
+                self._backfill_invoices(conn)
+            conn.commit()
+
+    def fail_interrupted(self):
+        """Report jobs cut short by a restart, which will never finish, as failed
+
+        Called once when the server starts, before any job runs; not when the store is
+        opened, since every process that imports the app (OCR workers included) opens it.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET status = ?, error = ? WHERE status IN (?, ?, ?)",
+                         (ERROR, 'Interrupted by server restart', RECEIVING, QUEUED, PROCESSING))
+            conn.commit()
+
+    def _backfill_rows(self, conn):
+        """Index the parsed rows of files finished before job_rows existed"""
+        files = conn.execute("SELECT job_id, position, unique_id, result FROM job_files f WHERE status = ? "
+                             "AND NOT EXISTS (SELECT 1 FROM job_rows r WHERE r.job_id = f.job_id "
+                             "AND r.position = f.position)", (DONE,)).fetchall()
+        for row in files:
+            self._insert_rows(conn, row['job_id'], row['position'], row['unique_id'],
+                              json.loads(row['result']).get('parsed_data', []))
+        conn.commit()
+
+    def _backfill_invoices(self, conn):
+        """Index the files finished before the invoice index existed, oldest first"""
+        files = conn.execute("SELECT f.job_id, f.position, f.unique_id, f.filename, f.sha256, f.result "
+                             "FROM job_files f JOIN jobs j ON j.id = f.job_id WHERE f.status = ? "
+                             "AND NOT EXISTS (SELECT 1 FROM invoices i WHERE i.job_id = f.job_id "
+                             "AND i.position = f.position) ORDER BY j.created_at, f.position", (DONE,)).fetchall()
+        for row in files:
+            self._index_invoice(conn, row['job_id'], row['position'], row['unique_id'], row['filename'],
+                                row['sha256'], json.loads(row['result']).get('parsed_data', []))
+        conn.commit()
+
+    def _index_invoice(self, conn, job_id, position, unique_id, filename, sha256, parsed_rows):
+        duplicate = self.invoice_index.add(conn, job_id, position, unique_id, filename, sha256, parsed_rows)
+        conn.execute("UPDATE job_files SET duplicate = ? WHERE job_id = ? AND position = ?",
+                     (json.dumps(duplicate) if duplicate else None, job_id, position))
+        if duplicate:
+            log_event('duplicate_invoice', job_id=job_id, filename=filename, reason=duplicate['reason'],
+                      original_job_id=duplicate['job_id'], original_filename=duplicate['filename'])
+
+    @staticmethod
+    def _insert_rows(conn, job_id, position, unique_id, parsed_rows):
+        """Index a file's parsed rows for the row filters
+
+        The parser sets invoice_no on an invoice's first row only, so each row is
+        indexed under the last invoice number above it.
+        """
+        indexed = []
+        invoice_no = None
+        for index, row in enumerate(parsed_rows):
+            invoice_no = row.get('invoice_no') or invoice_no
+            indexed.append((job_id, position, index, unique_id, invoice_no, row.get('hsn') or None, json.dumps(row)))
+        conn.executemany(
+            "INSERT OR REPLACE INTO job_rows (job_id, position, row_index, unique_id, invoice_no, hsn, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", indexed)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @property
+    def executor(self):
+        # Created on first use in each process, so a queue built before a fork (a preloaded
+        # server app) gets fresh worker threads in every child
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def submit(self, files, profile=False, set_name=None, **output_options):
+        """Queue a job for a list of (file_path, filename, unique_id) tuples and return its ID
+
+        output_options are passed through to open_output. With profile (and a
+        profile_dir), each file is processed under cProfile and its stats saved
+        as <job_id>_<position>.prof. With set_name the job is added to that
+        consolidation set.
+        """
+        job_id = self.create(profile=profile, set_name=set_name, **output_options)
+        for file_path, filename, unique_id in files:
+            self.add_file(job_id, file_path, filename, unique_id)
+        self.seal(job_id)
+        return job_id
+
+    def create(self, profile=False, set_name=None, **output_options):
+        """Start a job that files are added to as they arrive and return its ID"""
+        job_id = str(uuid.uuid4())
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT INTO jobs (id, status, created_at, total_files, set_name) VALUES (?, ?, ?, ?, ?)",
+                         (job_id, RECEIVING, time.time(), 0, set_name))
+            conn.commit()
+
+        with self._lock:
+            self._outputs[job_id] = [self.open_output(job_id, **output_options), 0]
+            self._receiving.add(job_id)
+            if profile and self.profile_dir:
+                self._profiled.add(job_id)
+        log_event('job_queued', job_id=job_id, set_name=set_name, **output_options)
+        return job_id
+
+    def add_file(self, job_id, file_path, filename, unique_id, sha256=None, error=None):
+        """Add a received file to a job and start processing it
+
+        A file rejected during upload is recorded with its error and not processed. A
+        file identical to one already indexed is flagged as its duplicate straight away,
+        and one already in the job's consolidation set is skipped.
+        """
+        with self._lock:
+            with closing(self._connect()) as conn:
+                position = conn.execute("SELECT COUNT(*) FROM job_files WHERE job_id = ?", (job_id,)).fetchone()[0]
+                status = ERROR if error else QUEUED
+                duplicate = None
+                if sha256 and not error:
+                    if self.invoice_index is not None:
+                        duplicate = self.invoice_index.find_duplicate(conn, sha256=sha256)
+                    in_set = self._in_set(conn, job_id, sha256)
+                    if in_set is not None:
+                        status = SKIPPED
+                        error = f"Already in consolidation set '{in_set['set_name']}' as {in_set['filename']}"
+                conn.execute(
+                    "INSERT INTO job_files (job_id, position, filename, unique_id, file_path, status, error, sha256, "
+                    "duplicate) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, position, filename, unique_id, file_path, status, error, sha256,
+                     json.dumps(duplicate) if duplicate else None))
+                conn.execute("UPDATE jobs SET total_files = total_files + 1 WHERE id = ?", (job_id,))
+                conn.commit()
+        if status == QUEUED:
+            self.executor.submit(self._run_file, job_id, position, file_path, filename, unique_id, sha256)
+        return position
+
+    @staticmethod
+    def _in_set(conn, job_id, sha256):
+        """(set_name, filename) of a file with these contents already in the job's set, or None
+
+        Jobs cut short by a restart never join their set, so their files do not count.
+        """
+        return conn.execute("SELECT j.set_name, f.filename FROM jobs s JOIN jobs j ON j.set_name = s.set_name "
+                            "JOIN job_files f ON f.job_id = j.id WHERE s.id = ? AND f.sha256 = ? "
+                            "AND f.status IN (?, ?, ?) AND (j.set_seq IS NOT NULL OR j.status != ?) LIMIT 1",
+                            (job_id, sha256, QUEUED, PROCESSING, DONE, ERROR)).fetchone()
+
+    def seal(self, job_id, error=None):
+        """Mark a job's upload as complete; with error the job fails once its files are done"""
+        with self._lock:
+            self._receiving.discard(job_id)
+            with closing(self._connect()) as conn:
+                conn.execute("UPDATE jobs SET status = ? WHERE id = ? AND status = ?", (QUEUED, job_id, RECEIVING))
+                if error:
+                    conn.execute("UPDATE jobs SET error = ? WHERE id = ?", (error, job_id))
+                conn.commit()
+                remaining = self._remaining(conn, job_id)
+        if remaining == 0:
+            self.executor.submit(self._finish_job, job_id)
+
+    def _remaining(self, conn, job_id):
+        return conn.execute("SELECT COUNT(*) FROM job_files WHERE job_id = ? AND status IN (?, ?)",
+                            (job_id, QUEUED, PROCESSING)).fetchone()[0]
+
+    def _run_file(self, job_id, position, file_path, filename, unique_id, sha256=None):
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("UPDATE jobs SET status = ? WHERE id = ? AND status IN (?, ?)",
+                             (PROCESSING, job_id, RECEIVING, QUEUED))
+                conn.execute("UPDATE job_files SET status = ? WHERE job_id = ? AND position = ?",
+                             (PROCESSING, job_id, position))
+                conn.commit()
+        except sqlite3.Error as e:
+            # Only the progress shown is affected; the file is still processed
+            print(f"Error marking {filename} as processing: {e}")
+
+        profile = (profiled(os.path.join(self.profile_dir, f"{job_id}_{position}.prof"))
+                   if job_id in self._profiled else nullcontext())
+        try:
+            with profile, track_file(job_id=job_id, filename=filename, unique_id=unique_id):
+                result = self.process_file(file_path, filename, unique_id, sha256=sha256)
+            status, error = DONE, None
+        except Exception as e:
+            print(f"Error processing {filename}: {e}")
+            result, status, error = None, ERROR, str(e)
+
+        with self._lock:
+            try:
+                with closing(self._connect()) as conn:
+                    try:
+                        self._save_file(conn, job_id, position, unique_id, filename, sha256, status, error, result)
+                    except sqlite3.Error as e:
+                        # The file fails rather than staying in processing; its job still finishes
+                        print(f"Error saving result of {filename}: {e}")
+                        conn.rollback()
+                        self._save_file(conn, job_id, position, unique_id, filename, sha256, ERROR,
+                                        f"Could not save the result: {e}", None)
+                    self._append_finished(conn, job_id)
+                    remaining = self._remaining(conn, job_id)
+            except sqlite3.Error as e:
+                # Without its files' state the job cannot finish; close its output rather than leak it
+                print(f"Error saving result of {filename}, abandoning job {job_id}: {e}")
+                self._abandon(job_id)
+                return
+            receiving = job_id in self._receiving
+        if remaining == 0 and not receiving:
+            self._finish_job(job_id)
+
+    def _save_file(self, conn, job_id, position, unique_id, filename, sha256, status, error, result):
+        conn.execute("UPDATE job_files SET status = ?, error = ?, result = ? WHERE job_id = ? AND position = ?",
+                     (status, error, json.dumps(result) if result is not None else None, job_id, position))
+        if result is not None:
+            self._insert_rows(conn, job_id, position, unique_id, result.get('parsed_data', []))
+            if self.invoice_index is not None:
+                self._index_invoice(conn, job_id, position, unique_id, filename, sha256,
+                                    result.get('parsed_data', []))
+        conn.commit()
+
+    def _abandon(self, job_id):
+        """Close and drop a job's output writer (self._lock held); the job is failed on the next start"""
+        output = self._outputs.pop(job_id, None)
+        self._profiled.discard(job_id)
+        if output is not None:
+            try:
+                output[0].close()
+            except Exception as e:
+                print(f"Error closing output of job {job_id}: {e}")
+
+    def _append_finished(self, conn, job_id):
+        """Append rows of the contiguous run of finished files to the job's output"""
+        output = self._outputs[job_id]
+        writer, position = output
+        while True:
+            row = conn.execute("SELECT status, result FROM job_files WHERE job_id = ? AND position = ?",
+                               (job_id, position)).fetchone()
+            if row is None or row['status'] not in FINISHED:
+                break
+            if row['status'] == DONE:
+                try:
+                    with stage('consolidated_write'):
+                        writer.write_rows(json.loads(row['result']).get('parsed_data', []))
+                except Exception as e:
+                    print(f"Error writing rows for job {job_id}: {e}")
+            position += 1
+        output[1] = position
+
+    def _finish_job(self, job_id):
+        with self._lock:
+            writer, _ = self._outputs.pop(job_id)
+            self._profiled.discard(job_id)
+        try:
+            with stage('consolidated_close'):
+                excel_filename = os.path.basename(writer.close())
+            status, error = DONE, None
+        except Exception as e:
+            print(f"Error finalizing job {job_id}: {e}")
+            excel_filename, status, error = None, ERROR, str(e)
+        with closing(self._connect()) as conn:
+            # An upload that was cut short still gets the output of the files that arrived
+            upload_error = conn.execute("SELECT error FROM jobs WHERE id = ?", (job_id,)).fetchone()['error']
+            if upload_error:
+                status, error = ERROR, upload_error
+            conn.execute("UPDATE jobs SET status = ?, finished_at = ?, excel_filename = ?, error = ? WHERE id = ?",
+                         (status, time.time(), excel_filename, error, job_id))
+            # The job's rows join its consolidation set after those of the jobs finished before it
+            conn.execute("UPDATE jobs SET set_seq = (SELECT COALESCE(MAX(s.set_seq), 0) + 1 FROM jobs s "
+                         "WHERE s.set_name = jobs.set_name) WHERE id = ? AND set_name IS NOT NULL", (job_id,))
+            conn.commit()
+        log_event('job_finished', job_id=job_id, status=status, output=excel_filename, error=error)
+
+    def status(self, job_id):
+        """Job state with per-file progress, or None for an unknown job"""
+        with closing(self._connect()) as conn:
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            files = conn.execute("SELECT position, filename, unique_id, status, error, duplicate FROM job_files "
+                                 "WHERE job_id = ? ORDER BY position", (job_id,)).fetchall()
+        return {
+            'job_id': job['id'],
+            'status': job['status'],
+            'error': job['error'],
+            'set_name': job['set_name'],
+            'created_at': job['created_at'],
+            'finished_at': job['finished_at'],
+            'total_files': job['total_files'],
+            'completed_files': sum(1 for f in files if f['status'] in FINISHED),
+            'excel_filename': job['excel_filename'],
+            'files': [dict(f, duplicate=json.loads(f['duplicate']) if f['duplicate'] else None) for f in files]
+        }
+
+    def find_file(self, unique_id):
+        """Stored row (job_id, filename, file_path, status, sha256) of an uploaded file, or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT job_id, filename, file_path, status, sha256 FROM job_files "
+                               "WHERE unique_id = ?", (unique_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def rows(self, job_id, cursor=None, limit=100, unique_id=None, invoice_no=None, hsn=None):
+        """One page of a job's parsed rows in upload order, and the cursor of the next page (or None)
+
+        Rows can be filtered by file (unique_id) and by invoice number or HSN prefix.
+        The cursor is an opaque "<position>.<row index>" string from a previous page.
+        """
+        where, params = self._row_filters(job_id, unique_id, invoice_no, hsn)
+        if cursor:
+            try:
+                position, row_index = (int(part) for part in cursor.split('.'))
+            except ValueError:
+                raise ValueError(f"Invalid cursor: {cursor}")
+            where.append("(position, row_index) > (?, ?)")
+            params += [position, row_index]
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        with closing(self._connect()) as conn:
+            found = conn.execute(f"SELECT position, row_index, unique_id, data FROM job_rows WHERE {' AND '.join(where)} "
+                                 "ORDER BY position, row_index LIMIT ?", params + [limit + 1]).fetchall()
+        rows = [dict(json.loads(row['data']), unique_id=row['unique_id']) for row in found[:limit]]
+        next_cursor = None
+        if len(found) > limit:
+            last = found[limit - 1]
+            next_cursor = f"{last['position']}.{last['row_index']}"
+        return rows, next_cursor
+
+    def row_count(self, job_id, unique_id=None, invoice_no=None, hsn=None):
+        where, params = self._row_filters(job_id, unique_id, invoice_no, hsn)
+        with closing(self._connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM job_rows WHERE {' AND '.join(where)}", params).fetchone()[0]
+
+    @staticmethod
+    def _row_filters(job_id, unique_id, invoice_no, hsn):
+        where, params = ["job_id = ?"], [job_id]
+        if unique_id:
+            where.append("unique_id = ?")
+            params.append(unique_id)
+        if invoice_no:
+            where.append("invoice_no LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(invoice_no))
+        if hsn:
+            where.append("hsn LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(hsn))
+        return where, params
+
+    def iter_rows(self, job_id, page_size=MAX_PAGE_SIZE):
+        """All of a job's parsed rows in upload order, fetched a page at a time"""
+        cursor = None
+        while True:
+            rows, cursor = self.rows(job_id, cursor, page_size)
+            for row in rows:
+                row.pop('unique_id', None)
+                yield row
+            if cursor is None:
+                break
+
+    def files(self, job_id, cursor=None, limit=20):
+        """One page of per-file summaries (no text) in upload order, and the next cursor (or None)"""
+        after = int(cursor) if cursor else -1
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        with closing(self._connect()) as conn:
+            found = conn.execute("SELECT position, filename, unique_id, status, error, result, duplicate FROM job_files "
+                                 "WHERE job_id = ? AND position > ? ORDER BY position LIMIT ?",
+                                 (job_id, after, limit + 1)).fetchall()
+        files = []
+        for row in found[:limit]:
+            result = json.loads(row['result']) if row['result'] else {}
+            parsed_data = result.get('parsed_data') or []
+            files.append({
+                'position': row['position'],
+                'filename': row['filename'],
+                'unique_id': row['unique_id'],
+                'status': row['status'],
+                'error': row['error'],
+                'duplicate': json.loads(row['duplicate']) if row['duplicate'] else None,
+                'tables_count': result.get('tables_count'),
+                'page_count': result.get('page_count'),
+                'excel_path': result.get('excel_path'),
+                'rows': len(parsed_data),
+                'first_row': parsed_data[0] if parsed_data else None
+            })
+        next_cursor = str(found[limit - 1]['position']) if len(found) > limit else None
+        return files, next_cursor
+
+    def file_result(self, job_id, position):
+        """Stored result dict of one finished file, or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT result FROM job_files WHERE job_id = ? AND position = ? AND status = ?",
+                               (job_id, position, DONE)).fetchone()
+        return json.loads(row['result']) if row is not None else None
+
+    def sets(self):
+        """Consolidation sets with their number of finished jobs, files and rows"""
+        with closing(self._connect()) as conn:
+            found = conn.execute(
+                "SELECT j.set_name, COUNT(*) AS jobs, SUM(j.total_files) AS files, MAX(j.finished_at) AS updated_at, "
+                "(SELECT COUNT(*) FROM job_rows r JOIN jobs k ON k.id = r.job_id WHERE k.set_name = j.set_name "
+                "AND k.set_seq IS NOT NULL) AS rows FROM jobs j WHERE j.set_name IS NOT NULL "
+                "AND j.set_seq IS NOT NULL GROUP BY j.set_name ORDER BY j.set_name").fetchall()
+        return [dict(row) for row in found]
+
+    def set_jobs(self, set_name):
+        """Finished jobs of a consolidation set in set order"""
+        with closing(self._connect()) as conn:
+            found = conn.execute("SELECT id AS job_id, set_seq, status, created_at, finished_at, total_files "
+                                 "FROM jobs WHERE set_name = ? AND set_seq IS NOT NULL ORDER BY set_seq",
+                                 (set_name,)).fetchall()
+        return [dict(row) for row in found]
+
+    def iter_set_rows(self, set_name, after_seq=0, through_seq=None, page_size=MAX_PAGE_SIZE):
+        """Parsed rows of a set's finished jobs after set_seq after_seq (up to through_seq), in set order
+
+        Each job's rows are read a page at a time (see iter_rows), so no read stays open
+        and blocks job commits while a long export is written.
+        """
+        for job in self.set_jobs(set_name):
+            if job['set_seq'] > after_seq and (through_seq is None or job['set_seq'] <= through_seq):
+                yield from self.iter_rows(job['job_id'], page_size)
+
+    def set_output(self, set_name, output_format):
+        """(filename, through_seq) of a set's last written output in a format, or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT filename, through_seq FROM set_outputs WHERE set_name = ? AND format = ?",
+                               (set_name, output_format)).fetchone()
+        return (row['filename'], row['through_seq']) if row is not None else None
+
+    def save_set_output(self, set_name, output_format, filename, through_seq):
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO set_outputs (set_name, format, filename, through_seq, updated_at) "
+                         "VALUES (?, ?, ?, ?, ?)", (set_name, output_format, filename, through_seq, time.time()))
+            conn.commit()
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads; with wait, queued and running files are finished first"""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=wait)
+        self._executor = None
@@ -0,0 +1,242 @@
+"""Vendor layout templates: a fingerprint index of known invoice layouts for fast-path table extraction
+
+A layout is fingerprinted from the first page of a digital invoice: the sender
+GSTIN (the first one in the text), the words of the line-item header and
+the page size. After a document with an unknown layout has been extracted the
+usual way, its line-item table is learned as a template: the table's column
+edges and column map. Documents with a known layout skip pdfplumber's table
+detection; rows are cut between the page's horizontal rules and characters are
+placed straight into the template's cells. A template is checked against the
+page it was learned from before it is used, and dropped if it no longer fits.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from bisect import bisect_right
+from contextlib import closing
+
+from pdfplumber.utils import extract_text
+
+from extractor import ANY_GST_RE, ColumnMap
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS layouts (
+    fingerprint TEXT PRIMARY KEY,
+    sender_gst TEXT,
+    header TEXT NOT NULL,
+    page_size TEXT NOT NULL,
+    template TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL,
+    uses INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS unlearnable (
+    fingerprint TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+"""
+
+# The line-item header starts at the first text line holding one of these and runs up to the
+# first line with a digit (the first item), as text layers often put each cell on its own line
+HEADER_LINE_KEYWORDS = ('description', 'qty', 'hsn')
+HEADER_MAX_LINES = 30
+HEADER_TOKEN_RE = re.compile(r'[a-z]+')
+DIGIT_RE = re.compile(r'\d')
+# Edges closer than this (points) are the same rule, as in pdfplumber's table finder
+SNAP_TOLERANCE = 3
+# Share of the table width a horizontal rule must cover to separate rows
+RULE_COVERAGE = 0.95
+
+
+class Fingerprint:
+    """Layout fingerprint of a document; key is the index key built from the other fields"""
+
+    def __init__(self, sender_gst, header, page_size):
+        self.sender_gst = sender_gst
+        self.header = header
+        self.page_size = page_size
+        self.key = hashlib.sha1(f"{sender_gst}|{header}|{page_size}".encode('utf-8')).hexdigest()
+
+
+def fingerprint(document):
+    """Fingerprint of a document's first page, or None if it has no line-item header in its text layer"""
+    if not document.pages:
+        return None
+    page = document.pages[0]
+    plumber_page = page.plumber_page
+    if plumber_page is None:
+        return None
+    text = page.text
+    lines = text.lower().splitlines()
+    start = next((idx for idx, line in enumerate(lines)
+                  if any(keyword in line for keyword in HEADER_LINE_KEYWORDS)), None)
+    if start is None:
+        return None
+    header = [lines[start]]
+    for line in lines[start + 1:start + HEADER_MAX_LINES]:
+        if DIGIT_RE.search(line):
+            break
+        header.append(line)
+    gst = ANY_GST_RE.search(text)
+    return Fingerprint(gst.group(1) if gst else '', ' '.join(HEADER_TOKEN_RE.findall(' '.join(header))),
+                       f"{round(plumber_page.width)}x{round(plumber_page.height)}")
+
+
+def _row_edges(plumber_page, x0, x1):
+    """y positions of the horizontal rules spanning the table columns, within its left border"""
+    left = [edge for edge in plumber_page.vertical_edges if abs(edge['x0'] - x0) <= SNAP_TOLERANCE]
+    if not left:
+        return []
+    top = min(edge['top'] for edge in left) - SNAP_TOLERANCE
+    bottom = max(edge['bottom'] for edge in left) + SNAP_TOLERANCE
+
+    # Rules drawn in pieces (one per cell) are clustered by position and their lengths summed
+    clusters = []
+    for edge in sorted(plumber_page.horizontal_edges, key=lambda e: e['top']):
+        if not top <= edge['top'] <= bottom:
+            continue
+        covered = max(0.0, min(edge['x1'], x1) - max(edge['x0'], x0))
+        if clusters and edge['top'] - clusters[-1][0][-1] <= SNAP_TOLERANCE:
+            clusters[-1][0].append(edge['top'])
+            clusters[-1][1] += covered
+        else:
+            clusters.append([[edge['top']], covered])
+    width = x1 - x0
+    return [sum(tops) / len(tops) for tops, covered in clusters if covered >= RULE_COVERAGE * width]
+
+
+def template_tables(plumber_page, template):
+    """The page's line-item table (as a list with at most one table) read through a template's cells
+
+    Each character goes to the cell containing its center, the same rule
+    pdfplumber uses, and cell text is extracted with pdfplumber's own function.
+    """
+    x_edges = template['columns']
+    y_edges = _row_edges(plumber_page, x_edges[0], x_edges[-1])
+    if len(y_edges) < 2:
+        return []
+    cells = [[[] for _ in range(len(x_edges) - 1)] for _ in range(len(y_edges) - 1)]
+    for char in plumber_page.chars:
+        h_mid = (char['x0'] + char['x1']) / 2
+        v_mid = (char['top'] + char['bottom']) / 2
+        col = bisect_right(x_edges, h_mid) - 1
+        row = bisect_right(y_edges, v_mid) - 1
+        if 0 <= col < len(x_edges) - 1 and 0 <= row < len(y_edges) - 1:
+            cells[row][col].append(char)
+    return [[[extract_text(chars) if chars else '' for chars in row] for row in cells]]
+
+
+def learn_template(document):
+    """Template from a document's first line-item table, or None if its page cannot be read through one
+
+    The column edges come from the cells table detection found while the document
+    was extracted. The template is only kept if it reproduces that page's detected
+    tables exactly.
+    """
+    for page in document.pages:
+        for table_idx, rows in enumerate(page.tables):
+            col_map = ColumnMap(rows)
+            if col_map.fallback:
+                continue
+            if page.table_cells is None:
+                return None
+            cells = page.table_cells[table_idx]
+            x_edges = sorted({cell[0] for cell in cells} | {cell[2] for cell in cells})
+            template = {'page': page.index, 'columns': x_edges, 'column_map': col_map.columns}
+            if template_tables(page.plumber_page, template) != page.tables:
+                return None
+            return template
+    return None
+
+
+class LayoutIndex:
+    """Local SQLite index of layout templates keyed by fingerprint"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            conn.commit()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def get(self, key):
+        """Template for a fingerprint key, counting the use, or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT template FROM layouts WHERE fingerprint = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE layouts SET uses = uses + 1, last_used = ? WHERE fingerprint = ?",
+                         (time.time(), key))
+            conn.commit()
+        return json.loads(row['template'])
+
+    def put(self, fingerprint, template):
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO layouts (fingerprint, sender_gst, header, page_size, template, "
+                         "created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                         (fingerprint.key, fingerprint.sender_gst, fingerprint.header, fingerprint.page_size,
+                          json.dumps(template), time.time()))
+            conn.commit()
+
+    def remove(self, key):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM layouts WHERE fingerprint = ?", (key,))
+            conn.commit()
+
+    def is_unlearnable(self, key):
+        """Whether learning a template for this fingerprint failed before"""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT 1 FROM unlearnable WHERE fingerprint = ?", (key,)).fetchone() is not None
+
+    def put_unlearnable(self, fingerprint):
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO unlearnable (fingerprint, created_at) VALUES (?, ?)",
+                         (fingerprint.key, time.time()))
+            conn.commit()
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT COUNT(*) AS layouts, COALESCE(SUM(uses), 0) AS uses FROM layouts").fetchone()
+            unlearnable = conn.execute("SELECT COUNT(*) FROM unlearnable").fetchone()[0]
+        return {'layouts': row['layouts'], 'uses': row['uses'], 'unlearnable': unlearnable}
+
+    def apply(self, document):
+        """Switch document to its layout's template if one is known and still fits
+
+        Returns (fingerprint, template); template is None when the document goes
+        through full table detection, and fingerprint None when it has no layout
+        that could be learned (including layouts that failed to be learned before).
+        """
+        layout = fingerprint(document)
+        if layout is None:
+            return None, None
+        template = self.get(layout.key)
+        if template is None:
+            return (None if self.is_unlearnable(layout.key) else layout), None
+        document.use_layout(template)
+        if template['page'] < len(document.pages):
+            tables = document.pages[template['page']].tables
+            if tables and ColumnMap(tables[0]).columns == template['column_map']:
+                return layout, template
+        # The layout changed under the same fingerprint; learn it again
+        document.use_layout(None)
+        self.remove(layout.key)
+        return layout, None
+
+    def learn(self, document, layout):
+        """Learn the layout of a document extracted with full table detection; returns True if learned
+
+        A layout that cannot be learned is recorded so later documents do not try again.
+        """
+        template = learn_template(document)
+        if template is None:
+            self.put_unlearnable(layout)
+            return False
+        self.put(layout, template)
+        return True
@@ -0,0 +1,225 @@
+"""Stage timing, resource instrumentation and Prometheus-style metrics export
+
+Pipeline code wraps each stage in stage(name). While a file is being tracked with
+track_file(), stage timings, page/table counts and peak RSS are recorded on that
+file's FileMetrics and logged as one JSON line when it finishes; every stage is
+also added to the process-wide registry served by /metrics.
+"""
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import psutil
+except ImportError:  # psutil is optional; /proc or resource are used instead
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger('bill.jobs')
+
+# Upper bounds (seconds) of the per-file processing time histogram
+FILE_SECONDS_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+
+_current_file = contextvars.ContextVar('current_file_metrics', default=None)
+
+
+def current_rss():
+    """Resident set size of this process in bytes (0 if it cannot be measured)"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # Peak rather than current RSS; kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return 0
+
+
+class FileMetrics:
+    """Wall time per stage, pages, tables and peak RSS for one processed file"""
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.stages = {}
+        self.pages = 0
+        self.tables = 0
+        self.cache_hit = False
+        # 'template' when read through a known layout, 'learned' when a new layout was learned
+        self.layout = None
+        # Steps reduced or skipped because the memory ceiling was reached
+        self.degraded = []
+        # Pages whose OCR failed or read no text; such results are not cached
+        self.ocr_failed_pages = 0
+        self.error = None
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.peak_rss = current_rss()
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+    def as_dict(self):
+        return dict(self.labels,
+                    seconds=round(self.seconds, 4),
+                    stages={name: round(seconds, 4) for name, seconds in self.stages.items()},
+                    pages=self.pages,
+                    tables=self.tables,
+                    cache_hit=self.cache_hit,
+                    layout=self.layout,
+                    degraded=self.degraded,
+                    ocr_failed_pages=self.ocr_failed_pages,
+                    peak_rss_bytes=self.peak_rss,
+                    error=self.error)
+
+
+class MetricsRegistry:
+    """Process-wide counters and summaries rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_seconds = {}
+        self.stage_count = {}
+        self.files_processed = 0
+        self.files_failed = 0
+        self.pages_processed = 0
+        self.tables_detected = 0
+        self.file_seconds_sum = 0.0
+        self.file_seconds_buckets = [0] * len(FILE_SECONDS_BUCKETS)
+        self.file_peak_rss = 0
+        # name -> (help, callable returning a number), sampled when rendering
+        self.gauges = {}
+
+    def observe_stage(self, name, seconds):
+        with self._lock:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.stage_count[name] = self.stage_count.get(name, 0) + 1
+
+    def observe_file(self, record):
+        with self._lock:
+            if record.error:
+                self.files_failed += 1
+                return
+            self.files_processed += 1
+            self.pages_processed += record.pages
+            self.tables_detected += record.tables
+            self.file_seconds_sum += record.seconds
+            for i, bound in enumerate(FILE_SECONDS_BUCKETS):
+                if record.seconds <= bound:
+                    self.file_seconds_buckets[i] += 1
+            self.file_peak_rss = max(self.file_peak_rss, record.peak_rss)
+
+    def add_gauge(self, name, help_text, func):
+        self.gauges[name] = (help_text, func)
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                '# HELP bill_stage_seconds Wall time spent in each extraction stage',
+                '# TYPE bill_stage_seconds summary',
+            ]
+            for name in sorted(self.stage_seconds):
+                lines.append(f'bill_stage_seconds_sum{{stage="{name}"}} {self.stage_seconds[name]:.6f}')
+                lines.append(f'bill_stage_seconds_count{{stage="{name}"}} {self.stage_count[name]}')
+
+            lines += [
+                '# HELP bill_file_seconds Wall time to process one file',
+                '# TYPE bill_file_seconds histogram',
+            ]
+            for bound, count in zip(FILE_SECONDS_BUCKETS, self.file_seconds_buckets):
+                lines.append(f'bill_file_seconds_bucket{{le="{bound}"}} {count}')
+            lines.append(f'bill_file_seconds_bucket{{le="+Inf"}} {self.files_processed}')
+            lines.append(f'bill_file_seconds_sum {self.file_seconds_sum:.6f}')
+            lines.append(f'bill_file_seconds_count {self.files_processed}')
+
+            for name, help_text, value in (
+                ('bill_files_processed_total', 'Files processed successfully', self.files_processed),
+                ('bill_files_failed_total', 'Files that failed to process', self.files_failed),
+                ('bill_pages_processed_total', 'PDF pages processed', self.pages_processed),
+                ('bill_tables_detected_total', 'Tables detected', self.tables_detected),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter', f'{name} {value}']
+
+            gauges = [
+                ('bill_file_peak_rss_bytes', 'Highest process RSS seen while processing a file', self.file_peak_rss),
+                ('bill_process_resident_memory_bytes', 'Current process RSS', current_rss()),
+            ]
+        for name, (help_text, func) in sorted(self.gauges.items()):
+            try:
+                gauges.append((name, help_text, func()))
+            except Exception as e:
+                print(f"Error sampling metric {name}: {e}")
+        for name, help_text, value in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage for the registry and the file being tracked, if any"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe_stage(name, seconds)
+        record = _current_file.get()
+        if record is not None:
+            record.add_stage(name, seconds)
+
+
+def current_file():
+    """FileMetrics of the file being tracked in this context, or None"""
+    return _current_file.get()
+
+
+@contextmanager
+def track_file(**labels):
+    """Track one file's processing; logs a structured record when it finishes"""
+    record = FileMetrics(**labels)
+    token = _current_file.set(record)
+    try:
+        yield record
+    except Exception as e:
+        record.error = str(e)
+        raise
+    finally:
+        _current_file.reset(token)
+        record.seconds = time.perf_counter() - record.started
+        record.peak_rss = max(record.peak_rss, current_rss())
+        registry.observe_file(record)
+        log_event('file_processed', **record.as_dict())
+
+
+def log_event(event, **fields):
+    """Write one structured JSON log line to the bill.jobs logger"""
+    logger.info(json.dumps(dict(event=event, time=time.time(), **fields), default=str))
+
+
+@contextmanager
+def profiled(output_path):
+    """Run the enclosed block under cProfile and dump the stats to output_path"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        profiler.dump_stats(output_path)
@@ -0,0 +1,363 @@
+"""Per-page OCR engine with a worker pool and adaptive resolution
+
+Pages are recognised by a resident libtesseract engine (tesserocr) when it is
+installed: the model is loaded once per thread and process, and page images are
+passed in memory. Otherwise each page goes through pytesseract, which starts a
+tesseract process per image. Both return the text together with word boxes and
+confidences. On scanned pages only the header and table zones are read, and the
+table's cells are rebuilt from the word boxes.
+"""
+import multiprocessing
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import pdfplumber
+import pytesseract
+
+from regions import find_zones, crop_box, table_rows
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Resolutions tried in order; a page is only re-rendered at the next one when confidence is poor
+DEFAULT_RESOLUTIONS = (150, 300)
+# Mean word confidence (0-100) below which a page is re-rendered at a higher resolution
+DEFAULT_MIN_CONFIDENCE = 70
+# 'auto' uses tesserocr when it is installed and starts, else pytesseract
+ENGINES = ('auto', 'tesserocr', 'pytesseract')
+DEFAULT_ENGINE = 'auto'
+DEFAULT_LANGUAGE = 'eng'
+
+# Pool workers are started by a fork server (spawned where there is none, as on Windows) rather than
+# forked from the caller: the pool is created from a job thread of a threaded server, and a forked
+# child would inherit locks (SQLite, logging) held by its other threads
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# OCR only the header and table zones of scanned pages (see regions.py) instead of the full page
+DEFAULT_REGIONS = True
+
+# Recognised image: text rebuilt line by line, mean word confidence and the word boxes; error is
+# set when the engine failed
+OcrResult = namedtuple('OcrResult', ['text', 'confidence', 'words', 'error'], defaults=[None])
+# Recognised page: text, confidence, tables rebuilt from word boxes and the resolution used; error
+# is set when the page could not be OCRed at any resolution
+OcrPage = namedtuple('OcrPage', ['text', 'confidence', 'tables', 'resolution', 'error'], defaults=[None])
+
+_pool = None
+_pool_workers = 0
+_pool_pid = None
+
+# Per-worker handle on the PDF being OCRed, so each worker opens a file once per job
+_worker_pdf = None
+_worker_pdf_path = None
+
+
+class TesserocrEngine:
+    """Resident libtesseract handle; not thread-safe, so each thread gets its own"""
+    name = 'tesserocr'
+
+    def __init__(self, lang=DEFAULT_LANGUAGE, tessdata=None):
+        options = {'lang': lang}
+        if tessdata:
+            options['path'] = tessdata
+        self.api = tesserocr.PyTessBaseAPI(**options)
+
+    def words(self, image):
+        self.api.SetImage(image)
+        try:
+            self.api.Recognize()
+            iterator = self.api.GetIterator()
+            if iterator is None:
+                return []
+            words = []
+            block = par = line = 0
+            level = tesserocr.RIL.WORD
+            for result in tesserocr.iterate_level(iterator, level):
+                if result.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                    block += 1
+                if result.IsAtBeginningOf(tesserocr.RIL.PARA):
+                    par += 1
+                if result.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line += 1
+                box = result.BoundingBox(level)
+                if box is None:
+                    continue
+                left, top, right, bottom = box
+                words.append(_word(result.GetUTF8Text(level), result.Confidence(level),
+                                   left, top, right - left, bottom - top, block, par, line))
+            return words
+        finally:
+            # Drop the image and recognition results, keep the loaded model
+            self.api.Clear()
+
+
+class PytesseractEngine:
+    """Fallback engine: one tesseract process per image through pytesseract"""
+    name = 'pytesseract'
+
+    def __init__(self, lang=DEFAULT_LANGUAGE):
+        self.lang = lang
+
+    def words(self, image):
+        data = pytesseract.image_to_data(image, lang=self.lang, output_type=pytesseract.Output.DICT)
+        return [_word(data['text'][i], data['conf'][i], data['left'][i], data['top'][i],
+                      data['width'][i], data['height'][i],
+                      data['block_num'][i], data['par_num'][i], data['line_num'][i])
+                for i in range(len(data['text']))]
+
+
+def _word(text, conf, left, top, width, height, block, par, line):
+    return {'text': (text or '').strip(), 'conf': float(conf), 'left': left, 'top': top,
+            'width': width, 'height': height, 'block': block, 'par': par, 'line': line}
+
+
+# Engines are cached per thread and checked against the pid, so forked workers start their own
+_engines = threading.local()
+
+
+def tessdata_path():
+    """tessdata directory next to the configured tesseract executable, if there is one"""
+    tesseract_cmd = pytesseract.pytesseract.tesseract_cmd
+    if os.path.isabs(tesseract_cmd):
+        path = os.path.join(os.path.dirname(tesseract_cmd), 'tessdata')
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+def get_engine(name=DEFAULT_ENGINE):
+    """This thread's OCR engine, started on first use and kept for later pages"""
+    if name not in ENGINES:
+        raise ValueError(f"Unsupported OCR engine: {name}")
+    cached = getattr(_engines, 'engine', None)
+    if cached is not None and _engines.name == name and _engines.pid == os.getpid():
+        return cached
+
+    engine = None
+    if name != 'pytesseract':
+        if tesserocr is None:
+            if name == 'tesserocr':
+                print("Error starting OCR engine: tesserocr is not installed, using pytesseract")
+        else:
+            try:
+                engine = TesserocrEngine(tessdata=tessdata_path())
+            except Exception as e:
+                print(f"Error starting OCR engine: {e}, using pytesseract")
+    if engine is None:
+        engine = PytesseractEngine()
+
+    _engines.engine = engine
+    _engines.name = name
+    _engines.pid = os.getpid()
+    return engine
+
+
+def ocr_image(image, engine=DEFAULT_ENGINE):
+    """OCR a PIL Image, returning an OcrResult with the text, mean word confidence and word boxes"""
+    try:
+        words = [word for word in get_engine(engine).words(image) if word['text']]
+    except Exception as e:
+        print(f"OCR error: {e}")
+        return OcrResult("", 0.0, [], str(e))
+
+    # Rebuild the text line by line from Tesseract's word list
+    lines = []
+    current_key = None
+    confidences = []
+    for word in words:
+        if word['conf'] >= 0:
+            confidences.append(word['conf'])
+        key = (word['block'], word['par'], word['line'])
+        if key != current_key:
+            lines.append([])
+            current_key = key
+        lines[-1].append(word['text'])
+
+    text = "\n".join(" ".join(line) for line in lines)
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return OcrResult(text, confidence, words)
+
+
+def perform_ocr_on_image(image, engine=DEFAULT_ENGINE):
+    """Perform OCR on PIL Image"""
+    return ocr_image(image, engine).text
+
+
+def ocr_image_with_confidence(image, engine=DEFAULT_ENGINE):
+    """OCR a PIL Image, returning (text, mean word confidence)"""
+    result = ocr_image(image, engine)
+    return result.text, result.confidence
+
+
+def ocr_regions(image, resolution, engine=DEFAULT_ENGINE):
+    """OCR only the header and table zones of a page image
+
+    Returns (OcrResult with word boxes in page pixels, table rows rebuilt from the
+    table zone's words or None). Pages without a detectable table are OCRed whole.
+    """
+    zones = find_zones(image, resolution)
+    if zones is None:
+        return OcrResult("", 0.0, []), None
+
+    texts = []
+    words = []
+    rows = None
+    error = None
+    for zone in (zones.header, zones.table):
+        if zone is None:
+            continue
+        left, top, right, bottom = crop_box(zone, image.size)
+        result = ocr_image(image.crop((left, top, right, bottom)), engine)
+        zone_words = [dict(word, left=word['left'] + left, top=word['top'] + top) for word in result.words]
+        if result.text:
+            texts.append(result.text)
+        error = error or result.error
+        words.extend(zone_words)
+        if zone is zones.table:
+            rows = table_rows(zone_words, zones, image.size) or None
+
+    confidences = [word['conf'] for word in words if word['conf'] >= 0]
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return OcrResult("\n".join(texts), confidence, words, error), rows
+
+
+def ocr_rendered_page(render, resolutions=DEFAULT_RESOLUTIONS, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                      engine=DEFAULT_ENGINE, regions=DEFAULT_REGIONS):
+    """OCR one page, starting at the lowest resolution and stepping up while confidence is poor
+
+    render(resolution) must return a PIL image of the page. Only one rendering is
+    held at a time. With regions, only the header and table zones are read and the
+    table is rebuilt from word boxes. Returns an OcrPage, with the engine's error if
+    no resolution could be read.
+    """
+    best = OcrPage("", -1.0, [], resolutions[0])
+    error = None
+    for resolution in resolutions:
+        image = render(resolution)
+        if image is None:
+            break
+        if regions:
+            result, rows = ocr_regions(image, resolution, engine)
+        else:
+            result, rows = ocr_image(image, engine), None
+        del image
+        if result.error:
+            error = result.error
+            continue
+        if result.confidence > best.confidence:
+            best = OcrPage(result.text, result.confidence, [rows] if rows else [], resolution)
+        if result.confidence >= min_confidence:
+            break
+    if best.confidence < 0 and error:
+        return best._replace(confidence=0.0, error=error)
+    return best
+
+
+def _open_worker_pdf(pdf_path):
+    global _worker_pdf, _worker_pdf_path
+    if _worker_pdf_path != pdf_path:
+        if _worker_pdf is not None:
+            _worker_pdf.close()
+        _worker_pdf = pdfplumber.open(pdf_path)
+        _worker_pdf_path = pdf_path
+    return _worker_pdf
+
+
+def _ocr_page_worker(pdf_path, page_index, resolutions, min_confidence, tesseract_cmd, engine, regions):
+    """Process pool entry point: render and OCR a single page of pdf_path with the worker's resident engine"""
+    # Workers started by the fork server or spawned do not inherit the configured Tesseract path
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    try:
+        page = _open_worker_pdf(pdf_path).pages[page_index]
+        result = ocr_rendered_page(lambda res: page.to_image(resolution=res).original,
+                                   resolutions, min_confidence, engine, regions)
+        page.flush_cache()
+        return page_index, result
+    except Exception as e:
+        print(f"OCR error on page {page_index + 1}: {e}")
+        return page_index, OcrPage("", 0.0, [], resolutions[0], str(e))
+
+
+def get_pool(workers):
+    """Shared OCR process pool, recreated if the worker count changes, after a fork or once broken"""
+    global _pool, _pool_workers, _pool_pid
+    # A pool whose worker died (killed, out of memory) refuses all further work
+    broken = _pool is not None and getattr(_pool, '_broken', False)
+    if _pool is None or broken or _pool_workers != workers or _pool_pid != os.getpid():
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False)
+        context = multiprocessing.get_context(POOL_START_METHOD)
+        if POOL_START_METHOD == 'forkserver':
+            # The fork server loads this module (pdfplumber, Tesseract) once, and each worker is
+            # forked from it with them already imported
+            context.set_forkserver_preload([__name__])
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        _pool_workers = workers
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def shutdown_pool(wait=True):
+    """Shut down this process's OCR pool, if it has one"""
+    global _pool
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.shutdown(wait=wait)
+    _pool = None
+
+
+def ocr_document(document, page_indices=None, workers=1, max_pages_in_memory=None,
+                 resolutions=DEFAULT_RESOLUTIONS, min_confidence=DEFAULT_MIN_CONFIDENCE, engine=DEFAULT_ENGINE,
+                 regions=DEFAULT_REGIONS):
+    """OCR pages of a PdfDocument, returning {page index: OcrPage}
+
+    With more than one worker, pages are spread across a process pool; at most
+    max_pages_in_memory pages are rendered or in flight at once (default: one per
+    worker). Each worker keeps its engine loaded across pages and jobs. Results
+    are keyed by page index so callers can keep page order.
+    """
+    if page_indices is None:
+        page_indices = [page.index for page in document.pages]
+    page_indices = list(page_indices)
+    results = {}
+
+    # A child process (a pool worker, or one running a script's code again as it starts) OCRs
+    # in-process; starting a pool of its own there fails
+    if workers <= 1 or len(page_indices) <= 1 or multiprocessing.parent_process() is not None:
+        # In-process: render through the document so images are released page by page
+        for idx in page_indices:
+            page = document.pages[idx]
+
+            def render(resolution, page=page):
+                page.release_image()
+                return page.image(resolution)
+
+            results[idx] = ocr_rendered_page(render, resolutions, min_confidence, engine, regions)
+            page.release_image()
+        return results
+
+    max_in_flight = max_pages_in_memory or workers
+    pool = get_pool(workers)
+    tesseract_cmd = pytesseract.pytesseract.tesseract_cmd
+    pending = set()
+    queue = iter(page_indices)
+
+    def submit_next():
+        idx = next(queue, None)
+        if idx is not None:
+            pending.add(pool.submit(_ocr_page_worker, document.path, idx,
+                                    tuple(resolutions), min_confidence, tesseract_cmd, engine, regions))
+
+    for _ in range(max_in_flight):
+        submit_next()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.discard(future)
+            idx, result = future.result()
+            results[idx] = result
+            submit_next()
+    return results
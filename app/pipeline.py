@@ -0,0 +1,300 @@
+"""Extraction pipeline for a single PDF: text, OCR, tables, invoice parsing and workbooks
+
+Kept free of Flask so the web app and the batch CLI share the same code.
+"""
+import hashlib
+import json
+import os
+from dataclasses import asdict
+
+import pandas as pd
+from pdfplumber.table import TableSettings
+
+from document import PdfDocument, open_document
+from extractor import invoice_extractor
+from export import ConsolidatedExcelWriter, write_file_workbook
+from metrics import stage, current_file, current_rss
+from ocr import ocr_document, DEFAULT_RESOLUTIONS, DEFAULT_MIN_CONFIDENCE, DEFAULT_ENGINE, DEFAULT_REGIONS
+
+# Default OCR settings: process pool size, pages rendered at once, the resolutions tried per page,
+# the engine ('auto', 'tesserocr' or 'pytesseract') and whether only header/table zones are read
+DEFAULT_OCR_OPTIONS = {
+    'workers': os.cpu_count() or 1,
+    'max_pages_in_memory': None,
+    'resolutions': DEFAULT_RESOLUTIONS,
+    'min_confidence': DEFAULT_MIN_CONFIDENCE,
+    'engine': DEFAULT_ENGINE,
+    'regions': DEFAULT_REGIONS
+}
+
+# Default table detection: pdfplumber table settings (None for pdfplumber's defaults, e.g.
+# {'snap_tolerance': 2} or {'horizontal_strategy': 'text'}) and whether detection is cropped
+# to each page's line-item band (off by default; see PdfPage.find_tables)
+DEFAULT_TABLE_OPTIONS = {
+    'settings': None,
+    'crop': False
+}
+
+
+# Memory limits: each page's parsed objects are released once its tables are read, and while
+# the process is over ceiling (RSS in bytes, None for no limit) files are processed in a degraded
+# mode: OCR only at the lowest resolution with one page rendered at a time, and no Raw_Text sheet
+DEFAULT_MEMORY_OPTIONS = {
+    'release_pages': True,
+    'ceiling': None
+}
+
+
+def extraction_options_digest(table_options=None, ocr_options=None):
+    """Short digest of the table and OCR options that change extraction results, for cache keys
+
+    Pool sizes and page limits do not change the results and are left out.
+    """
+    tables = dict(DEFAULT_TABLE_OPTIONS, **(table_options or {}))
+    ocr = dict(DEFAULT_OCR_OPTIONS, **(ocr_options or {}))
+    options = {
+        'table_settings': asdict(TableSettings.resolve(tables['settings'])),
+        'crop': tables['crop'],
+        'ocr': {name: ocr[name] for name in ('resolutions', 'min_confidence', 'engine', 'regions')}
+    }
+    return hashlib.sha1(json.dumps(options, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:12]
+
+
+def over_memory_ceiling(ceiling):
+    """True if this process uses more than ceiling bytes (never with no ceiling)"""
+    return ceiling is not None and current_rss() > ceiling
+
+
+def low_memory_ocr_options(ocr_options):
+    """OCR options for the degraded mode: lowest resolution only, one page in memory"""
+    options = dict(DEFAULT_OCR_OPTIONS, **(ocr_options or {}))
+    options['resolutions'] = (min(options['resolutions']),)
+    options['max_pages_in_memory'] = 1
+    return options
+
+
+def extract_text_from_pdf(pdf):
+    """Extract text from PDF (path or PdfDocument) using PyPDF2"""
+    with open_document(pdf) as document:
+        return document.text
+
+
+def extract_tables_from_pdf(pdf):
+    """Extract tables from PDF (path or PdfDocument) using pdfplumber"""
+    tables_data = []
+    try:
+        with open_document(pdf) as document:
+            tables_data = tables_to_frames(document.tables)
+    except Exception as e:
+        print(f"Error extracting tables: {e}")
+
+    return tables_data
+
+
+def tables_to_frames(tables):
+    """Convert raw (page, table_index, rows) tables to DataFrames for easier handling"""
+    return [{
+        'page': table['page'],
+        'table_index': table['table_index'],
+        'data': pd.DataFrame(table['rows'])
+    } for table in tables]
+
+
+def extract_text_with_ocr(pdf, ocr_options=None, page_indices=None):
+    """Extract text from scanned PDF (path or PdfDocument) using OCR
+
+    With page_indices, only those pages are OCRed and the others keep their text layer.
+    Tables rebuilt from the OCR word boxes replace the (usually empty) tables detected
+    on those pages. Pages whose OCR failed or read no text are listed in the
+    document's ocr_failed_pages.
+    """
+    options = dict(DEFAULT_OCR_OPTIONS, **(ocr_options or {}))
+    text = ""
+    try:
+        with open_document(pdf) as document:
+            ocr_pages = ocr_document(document, page_indices=page_indices, **options)
+            for page in document.pages:
+                if page.index in ocr_pages:
+                    text += f"\n--- Page {page.number} ---\n{ocr_pages[page.index].text}"
+                    page.use_ocr_tables(ocr_pages[page.index].tables)
+                elif page_indices is not None:
+                    text += page.text
+            document.ocr_failed_pages = [idx for idx, page in sorted(ocr_pages.items())
+                                         if page.error or not page.text.strip()]
+    except Exception as e:
+        print(f"OCR extraction error: {e}")
+        if isinstance(pdf, PdfDocument):
+            pdf.ocr_failed_pages = list(page_indices if page_indices is not None else range(len(pdf.pages)))
+
+    return text
+
+
+def pages_needing_ocr(document):
+    """Indices of pages whose text layer is missing, unreadable or an image with sparse text"""
+    indices = []
+    for page in document.pages:
+        reason = page.ocr_reason()
+        if reason:
+            print(f"Page {page.number}: {reason}, attempting OCR...")
+            indices.append(page.index)
+    return indices
+
+
+def parse_invoice_data(text, pdf=None):
+    """Parse common invoice fields from extracted text and tables (pdf is a path or PdfDocument)"""
+    # Extract table data to get all line items
+    tables = []
+    fallback_columns = None
+    if pdf:
+        try:
+            with open_document(pdf) as document:
+                # Tables are detected once per page and shared with extract_tables_from_pdf
+                tables = [table for page in document.pages for table in page.tables]
+                # A layout template's column map also applies to tables without a header row
+                if document.layout is not None:
+                    fallback_columns = document.layout['column_map']
+        except Exception as e:
+            print(f"Error extracting table data: {e}")
+
+    return invoice_extractor.parse(text, tables, fallback_columns)
+
+
+def process_pdf(file_path, original_filename, unique_id, output_folder, cache=None,
+                ocr_options=None, write_workbook=True, sha256=None, layouts=None, table_options=None,
+                memory_options=None):
+    """Process a single PDF file
+
+    Results are looked up in and stored to cache (an ExtractionCache) when given;
+    sha256 is the file's digest if already known (it is hashed otherwise). With
+    layouts (a LayoutIndex), digital documents of a known layout are read through
+    its template and unknown layouts are learned. table_options and memory_options
+    override DEFAULT_TABLE_OPTIONS and DEFAULT_MEMORY_OPTIONS.
+    The per-file workbook is written to output_folder unless write_workbook is False.
+    """
+    # Identical file contents are served from the extraction cache without touching the PDF
+    cached = None
+    if cache is not None:
+        with stage('cache_lookup'):
+            options_digest = extraction_options_digest(table_options, ocr_options)
+            cache_key = (cache.key(sha256, options_digest) if sha256
+                         else cache.key_for_file(file_path, options_digest))
+            cached = cache.get(cache_key)
+
+    memory = dict(DEFAULT_MEMORY_OPTIONS, **(memory_options or {}))
+    # Steps skipped or reduced because the memory ceiling was reached
+    degraded = []
+    ocr_failed_pages = []
+    layout_used = None
+    if cached is not None:
+        text = cached['text']
+        raw_tables = cached['tables']
+        parsed_data_list = cached['parsed_data']
+        page_count = cached['page_count']
+    else:
+        # Open and parse the PDF once; every stage below reads from the same document
+        table_options = dict(DEFAULT_TABLE_OPTIONS, **(table_options or {}))
+        with PdfDocument(file_path, table_options['settings'], table_options['crop'],
+                         memory['release_pages']) as document:
+            page_count = len(document.pages)
+            # Nothing could be read: report the file as failed rather than caching an empty result
+            if page_count == 0:
+                raise ValueError("Could not read the PDF: the file is corrupt or has no pages")
+            if document.plumber_pdf is None:
+                degraded.append('pdf_open')
+
+            # Extract text
+            text = extract_text_from_pdf(document)
+
+            # OCR only the pages whose text layer is not usable; digital pages never pay for OCR
+            with stage('text_quality'):
+                ocr_pages = pages_needing_ocr(document)
+            if ocr_pages:
+                if over_memory_ceiling(memory['ceiling']):
+                    ocr_options = low_memory_ocr_options(ocr_options)
+                    degraded.append('ocr_resolution')
+                with stage('ocr'):
+                    text = extract_text_with_ocr(document, ocr_options, page_indices=ocr_pages)
+                ocr_failed_pages = document.ocr_failed_pages
+
+            # Known vendor layouts skip table detection (scanned pages have their tables from OCR)
+            layout = template = None
+            if layouts is not None and not ocr_pages:
+                with stage('layout_lookup'):
+                    try:
+                        layout, template = layouts.apply(document)
+                    except Exception as e:
+                        print(f"Error looking up layout template: {e}")
+                        document.use_layout(None)
+
+            # Extract tables
+            raw_tables = document.tables
+
+            # Parse structured data
+            with stage('parse'):
+                parsed_data_list = parse_invoice_data(text, document)
+
+            if template is not None:
+                layout_used = 'template'
+            elif layout is not None:
+                with stage('layout_learn'):
+                    try:
+                        if layouts.learn(document, layout):
+                            layout_used = 'learned'
+                    except Exception as e:
+                        print(f"Error learning layout template: {e}")
+
+        # Results of a degraded pass (OCR at low resolution, or a text layer without pdfplumber's
+        # tables), or one where a page failed or read nothing (a Tesseract or pool error may be
+        # temporary), are not kept, so the file is read in full next time
+        if cache is not None and not degraded and not ocr_failed_pages:
+            with stage('cache_store'):
+                cache.put(cache_key, {
+                    'text': text,
+                    'tables': raw_tables,
+                    'parsed_data': parsed_data_list,
+                    'page_count': page_count
+                })
+
+    record = current_file()
+    if record is not None:
+        record.pages = page_count
+        record.tables = len(raw_tables)
+        record.cache_hit = cached is not None
+        record.layout = layout_used
+        record.degraded = degraded
+        record.ocr_failed_pages = len(ocr_failed_pages)
+
+    # Create individual Excel file
+    excel_filename = None
+    if write_workbook:
+        excel_filename = f"{unique_id}_extracted.xlsx"
+        raw_text = text
+        if over_memory_ceiling(memory['ceiling']):
+            raw_text = None
+            degraded.append('raw_text_sheet')
+        with stage('workbook'):
+            create_excel_file(parsed_data_list, raw_tables, raw_text, os.path.join(output_folder, excel_filename))
+
+    return {
+        'filename': original_filename,
+        'unique_id': unique_id,
+        'text': text[:1000] + "..." if len(text) > 1000 else text,
+        'tables_count': len(raw_tables),
+        'page_count': page_count,
+        'parsed_data': parsed_data_list,
+        'excel_path': excel_filename,
+        'cache_hit': cached is not None
+    }
+
+
+def create_excel_file(parsed_data, tables, raw_text, output_path):
+    """Create Excel file with extracted data (tables as PdfDocument.tables dicts)"""
+    return write_file_workbook(parsed_data, tables, raw_text, output_path)
+
+
+def create_consolidated_excel(all_data, output_path):
+    """Create consolidated Excel for multiple files with all invoice data"""
+    with ConsolidatedExcelWriter(output_path) as writer:
+        writer.write_rows(all_data)
+
+    return output_path
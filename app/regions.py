@@ -0,0 +1,185 @@
+"""Layout pre-pass for scanned pages: header and table zones, and table rows rebuilt from OCR word boxes
+
+find_zones works on a downsampled ink mask of the page image. Long horizontal
+and vertical dark runs are table rules; the ruled area is the table zone and
+the content above it the header zone, so OCR can skip margins, footers and
+everything else the invoice parser does not read. table_rows places OCR words
+into the cells between those rules, falling back to clustering word positions
+for borderless tables.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+
+import numpy as np
+
+# Resolution of the ink mask the layout is detected on
+LAYOUT_DPI = 75
+# Grey level (0-255) below which a pixel counts as ink
+INK_THRESHOLD = 160
+# A horizontal rule is a dark run over this share of the content width...
+RULE_MIN_WIDTH = 0.5
+# ...and a vertical rule one over this share of the page height
+RULE_MIN_HEIGHT = 0.04
+# Padding added around each zone, as a share of the page size
+ZONE_PADDING = 0.005
+
+# Zones as (x0, y0, x1, y1) page fractions (None if absent); rows and columns are the
+# y and x positions (page fractions) of the table's horizontal and vertical rules
+Zones = namedtuple('Zones', ['header', 'table', 'rows', 'columns'])
+
+
+def ink_mask(image, resolution):
+    """Boolean ink mask of a PIL image, downsampled to about LAYOUT_DPI
+
+    Each cell keeps the darkest pixel of its block, so thin rules survive the downsampling.
+    """
+    gray = np.asarray(image.convert('L'))
+    factor = max(1, int(resolution // LAYOUT_DPI))
+    height = gray.shape[0] // factor * factor
+    width = gray.shape[1] // factor * factor
+    blocks = gray[:height, :width].reshape(height // factor, factor, width // factor, factor)
+    return blocks.min(axis=(1, 3)) < INK_THRESHOLD
+
+
+def _longest_run(line):
+    """(start, end) of the longest run of True in a 1-D mask, end exclusive"""
+    edges = np.diff(np.concatenate(([0], line.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if not len(starts):
+        return 0, 0
+    longest = int(np.argmax(ends - starts))
+    return int(starts[longest]), int(ends[longest])
+
+
+def _rules(mask, min_length):
+    """Rules along the rows of mask: [(position, start, end)], adjacent rows merged into one"""
+    rules = []
+    candidates = np.flatnonzero(mask.sum(axis=1) >= min_length)
+    for index in candidates:
+        start, end = _longest_run(mask[index])
+        if end - start < min_length:
+            continue
+        if rules and index - rules[-1][3] == 1:
+            first, rule_start, rule_end, _ = rules[-1]
+            rules[-1] = (first, min(start, rule_start), max(end, rule_end), index)
+        else:
+            rules.append((index, start, end, index))
+    return [((first + last) / 2, start, end) for first, start, end, last in rules]
+
+
+def find_zones(image, resolution):
+    """Header and table zones of a rendered page, or None for a blank page"""
+    ink = ink_mask(image, resolution)
+    height, width = ink.shape
+    rows = np.flatnonzero(ink.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(ink.any(axis=0))
+    top, bottom = rows[0], rows[-1] + 1
+    left, right = cols[0], cols[-1] + 1
+
+    table = None
+    row_rules = []
+    column_rules = []
+    horizontal = _rules(ink, RULE_MIN_WIDTH * (right - left))
+    if len(horizontal) >= 2:
+        band_top = int(horizontal[0][0])
+        band_bottom = int(horizontal[-1][0]) + 1
+        # Vertical rules are looked for only between the first and last horizontal rule
+        vertical = [(x, start + band_top, end + band_top)
+                    for x, start, end in _rules(ink[band_top:band_bottom].T, RULE_MIN_HEIGHT * height)]
+        if vertical:
+            column_rules = [x for x, _, _ in vertical]
+            table = (min(column_rules), min(start for _, start, _ in vertical),
+                     max(column_rules) + 1, max(end for _, _, end in vertical))
+        else:
+            # Borderless table between a top and bottom rule
+            table = (min(start for _, start, _ in horizontal), horizontal[0][0],
+                     max(end for _, _, end in horizontal), horizontal[-1][0] + 1)
+        row_rules = [y for y, _, _ in horizontal if table[1] - 1 <= y <= table[3]]
+
+    if table is None:
+        # No table found: the whole content is one zone
+        header = (left, top, right, bottom)
+    elif ink[top:int(table[1]) - 1, left:right].any():
+        header = (left, top, right, table[1])
+    else:
+        header = None
+
+    def fraction(box):
+        if box is None:
+            return None
+        x0, y0, x1, y1 = box
+        return (max(0.0, float(x0) / width - ZONE_PADDING), max(0.0, float(y0) / height - ZONE_PADDING),
+                min(1.0, float(x1) / width + ZONE_PADDING), min(1.0, float(y1) / height + ZONE_PADDING))
+
+    return Zones(fraction(header), fraction(table),
+                 [float(y) / height for y in row_rules], [float(x) / width for x in column_rules])
+
+
+def crop_box(zone, size):
+    """Pixel box (left, top, right, bottom) of a zone on an image of size (width, height)"""
+    width, height = size
+    x0, y0, x1, y1 = zone
+    return int(x0 * width), int(y0 * height), int(round(x1 * width)), int(round(y1 * height))
+
+
+def _lines(words):
+    """Words grouped into lines by vertical position, each line sorted left to right"""
+    lines = []
+    for word in sorted(words, key=lambda w: w['top'] + w['height'] / 2):
+        center = word['top'] + word['height'] / 2
+        if lines and center - lines[-1][0] <= lines[-1][1]['height'] * 0.6:
+            lines[-1][2].append(word)
+        else:
+            lines.append([center, word, [word]])
+    return [sorted(line, key=lambda w: w['left']) for _, _, line in lines]
+
+
+def _gap_columns(words):
+    """Column boundaries where no word crosses, for tables without vertical rules"""
+    spans = sorted((w['left'], w['left'] + w['width']) for w in words)
+    columns = []
+    for start, end in spans:
+        if columns and start <= columns[-1][1]:
+            columns[-1][1] = max(columns[-1][1], end)
+        else:
+            columns.append([start, end])
+    return [start for start, _ in columns] + [columns[-1][1]]
+
+
+def table_rows(words, zones, size):
+    """Rows of cell text for the table zone from OCR words (page pixel boxes)
+
+    Cells are the spaces between the zone's rules; without vertical rules columns
+    are the gaps no word crosses, and without row rules rows are lines of words.
+    Lines within a cell are joined with newlines, like pdfplumber's cells.
+    """
+    if zones.table is None or not words:
+        return []
+    width, height = size
+    x_edges = [x * width for x in zones.columns]
+    if len(x_edges) < 2:
+        x_edges = _gap_columns(words)
+    y_edges = [y * height for y in zones.rows]
+
+    if len(y_edges) >= 2:
+        row_words = [[] for _ in range(len(y_edges) - 1)]
+        for word in words:
+            center = word['top'] + word['height'] / 2
+            row = min(max(bisect_right(y_edges, center) - 1, 0), len(row_words) - 1)
+            row_words[row].append(word)
+    else:
+        row_words = _lines(words)
+
+    rows = []
+    for line in row_words:
+        cells = [[] for _ in range(len(x_edges) - 1)]
+        for word in line:
+            center = word['left'] + word['width'] / 2
+            cells[min(max(bisect_right(x_edges, center) - 1, 0), len(cells) - 1)].append(word)
+        row = ["\n".join(" ".join(w['text'] for w in cell_line) for cell_line in _lines(cell)) for cell in cells]
+        if any(row):
+            rows.append(row)
+    return rows
@@ -0,0 +1,53 @@
+"""Cross-invoice rollups over a consolidated batch, computed on a typed DataFrame
+
+Consolidated rows carry the invoice fields (receiver GST, ...) only on each
+invoice's first row and end every invoice with a total row. batch_frame turns
+them into one typed row per line item, with amounts parsed to floats once and
+the invoice fields filled down, so rollups are plain group-bys.
+"""
+import pandas as pd
+
+from extractor import OUTPUT_FIELDS, INVOICE_FIELDS
+
+AMOUNT_COLUMNS = ['quantity', 'taxable_amount', 'cgst', 'sgst', 'invoice_value']
+# Rollup name -> grouping column
+ROLLUPS = {
+    'receiver_gst': 'receiver_gst',
+    'hsn': 'hsn',
+    'taxrate': 'taxrate',
+}
+
+
+def batch_frame(rows):
+    """Line-item DataFrame (one row per item, invoice index in 'invoice') from consolidated rows"""
+    frame = pd.DataFrame.from_records(rows, columns=OUTPUT_FIELDS).fillna('').astype(str)
+    if frame.empty:
+        return frame.assign(invoice=pd.Series(dtype='int64'))
+
+    # A total row (no serial number or HSN) closes each invoice
+    is_total = (frame['sno'] == '') & (frame['hsn'] == '')
+    frame['invoice'] = is_total.shift(fill_value=False).cumsum()
+    for field in INVOICE_FIELDS:
+        frame[field] = frame[field].where(frame[field] != '').groupby(frame['invoice']).transform('first')
+    for column in AMOUNT_COLUMNS:
+        frame[column] = pd.to_numeric(frame[column].str.replace(',', '', regex=False), errors='coerce').fillna(0.0)
+
+    items = frame[~is_total & (frame['hsn'] != '')]
+    return items.drop(columns=['total_invoice_value']).reset_index(drop=True)
+
+
+def rollup(frame, by):
+    """Totals per receiver GST, HSN or tax rate: invoices, line items and summed amounts"""
+    if by not in ROLLUPS:
+        raise ValueError(f"Unsupported rollup: {by}")
+    column = ROLLUPS[by]
+    grouped = frame.fillna({column: ''}).groupby(column, sort=True)
+    result = grouped[AMOUNT_COLUMNS].sum().round(2)
+    result.insert(0, 'invoices', grouped['invoice'].nunique())
+    result.insert(1, 'items', grouped.size())
+    return result.reset_index()
+
+
+def batch_rollups(rows, by):
+    """Rollup of consolidated rows as a list of dicts"""
+    return rollup(batch_frame(rows), by).to_dict(orient='records')
@@ -0,0 +1,124 @@
+"""Sharded file storage for uploads and outputs with age- and size-based retention
+
+Files are named "<uuid>_<name>" (or "<kind>_<uuid>.<ext>", such as consolidated_ or
+invoices_ outputs) and stored under a two-character shard directory taken from the
+UUID, so no directory holds more than a small fraction of the files. A background sweeper deletes files older than
+max_age and then the oldest files while a store is over max_bytes.
+"""
+import os
+import re
+import threading
+import time
+
+from metrics import log_event
+
+# Files younger than this are never swept for size, so running jobs keep their inputs
+DEFAULT_MIN_AGE = 60 * 60
+
+# Word prefix of "<kind>_<uuid>.<ext>" names, skipped to shard by the UUID (UUIDs and hex
+# digests have a digit or hyphen before their first underscore, so they never match)
+KIND_PREFIX_RE = re.compile(r'^[a-z]+_')
+
+
+class FileStore:
+    """Directory of generated or uploaded files, sharded by the UUID in the file name"""
+
+    def __init__(self, root, max_age=None, max_bytes=None, min_age=DEFAULT_MIN_AGE):
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.last_sweep = {'files': 0, 'bytes': 0, 'deleted_files': 0, 'deleted_bytes': 0}
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def shard(filename):
+        return KIND_PREFIX_RE.sub('', filename, count=1)[:2].lower()
+
+    def directory(self, filename):
+        """Shard directory for a file name, created if needed"""
+        directory = os.path.join(self.root, self.shard(filename))
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def path(self, filename):
+        """Path to store a file under (its shard directory is created)"""
+        return os.path.join(self.directory(filename), filename)
+
+    def find(self, filename):
+        """Path of an existing file, also checking the flat layout of older installs, or None"""
+        for path in (os.path.join(self.root, self.shard(filename), filename), os.path.join(self.root, filename)):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def sweep(self, now=None):
+        """Apply the retention limits; returns file and byte counts before and deleted"""
+        now = now or time.time()
+        entries = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.startswith('.'):
+                    continue  # Placeholders such as .gitkeep are not stored files
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        stats = {'files': len(entries), 'bytes': total, 'deleted_files': 0, 'deleted_bytes': 0}
+        entries.sort()
+        for mtime, size, path in entries:
+            age = now - mtime
+            expired = self.max_age is not None and age > self.max_age
+            over_size = self.max_bytes is not None and total > self.max_bytes and age > self.min_age
+            if not (expired or over_size):
+                break  # Oldest first, so no later file qualifies either
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error deleting {path}: {e}")
+                continue
+            total -= size
+            stats['deleted_files'] += 1
+            stats['deleted_bytes'] += size
+
+        self.last_sweep = stats
+        return stats
+
+
+class Sweeper:
+    """Daemon thread that sweeps a set of stores every interval seconds"""
+
+    def __init__(self, stores, interval=600):
+        self.stores = stores
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='storage-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def sweep_all(self):
+        for name, store in self.stores.items():
+            try:
+                stats = store.sweep()
+            except Exception as e:
+                print(f"Error sweeping {store.root}: {e}")
+                continue
+            if stats['deleted_files']:
+                log_event('storage_sweep', store=name, **stats)
+
+    def _run(self):
+        while True:
+            self.sweep_all()
+            if self._stop.wait(self.interval):
+                break
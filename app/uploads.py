@@ -0,0 +1,144 @@
+"""Streaming multipart upload: each file part is spooled to disk in chunks and hashed as it arrives
+
+The request body is read with werkzeug's sans-IO MultipartDecoder instead of
+request.files, so no part is buffered in memory or in a temporary file, and a
+file can be handed off for extraction as soon as its last chunk is written.
+"""
+import hashlib
+import os
+import time
+import uuid
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+
+from metrics import registry
+
+CHUNK_SIZE = 256 * 1024
+# Non-file form fields are small (the output format); anything bigger is refused
+MAX_FIELD_BYTES = 64 * 1024
+
+
+def format_limit(num_bytes):
+    """A size limit for messages: whole MB or KB when it is a multiple of one, else bytes"""
+    for unit, size in (('GB', 1024 ** 3), ('MB', 1024 ** 2), ('KB', 1024)):
+        if num_bytes >= size and num_bytes % size == 0:
+            return f"{num_bytes // size}{unit}"
+    return f"{num_bytes} bytes"
+
+
+class UploadError(Exception):
+    """The upload cannot be read as a multipart form"""
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+class SpooledFile:
+    """One file part being written to disk and hashed chunk by chunk"""
+
+    def __init__(self, store, filename, max_bytes):
+        self.filename = secure_filename(filename)
+        self.unique_id = str(uuid.uuid4())
+        self.path = store.path(f"{self.unique_id}_{self.filename}")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.started = time.perf_counter()
+        self.file = open(self.path, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise FileTooLarge(f"{self.filename} is larger than the {format_limit(self.max_bytes)} per-file limit")
+        self.digest.update(data)
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        registry.observe_stage('upload_save', time.perf_counter() - self.started)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def stream_upload(stream, content_type, upload_store, on_file, allowed_file,
+                  file_field='files', max_file_bytes=None, chunk_size=CHUNK_SIZE):
+    """Read a multipart/form-data body from stream, spooling file parts into upload_store (a FileStore)
+
+    on_file(fields, path, filename, unique_id, sha256, error) is called once for each
+    file part in the file_field as soon as it is complete, with the form fields
+    received before it; error is set (and path already deleted) for a file over
+    max_file_bytes. Parts whose filename fails allowed_file are skipped. Returns
+    the form fields. A body over the request's own size limit raises
+    RequestEntityTooLarge; partial files are removed on any error.
+    """
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise UploadError('Expected a multipart/form-data upload')
+
+    # The decoder's own memory limit applies to its whole input buffer (file data included),
+    # so form field sizes are checked below instead
+    decoder = MultipartDecoder(boundary.encode('ascii'))
+    fields = {}
+    field_name = None
+    field_value = bytearray()
+    current = None  # SpooledFile being written; data of ignored or rejected parts is dropped
+
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File):
+                    if event.name == file_field and event.filename and allowed_file(event.filename):
+                        current = SpooledFile(upload_store, event.filename, max_file_bytes)
+                elif isinstance(event, Field):
+                    field_name = event.name
+                    field_value = bytearray()
+                elif isinstance(event, Data):
+                    if current is not None:
+                        try:
+                            current.write(event.data)
+                        except FileTooLarge as e:
+                            current.discard()
+                            on_file(fields, current.path, current.filename, current.unique_id, None, str(e))
+                            current = None
+                        else:
+                            if not event.more_data:
+                                current.close()
+                                on_file(fields, current.path, current.filename, current.unique_id,
+                                        current.digest.hexdigest(), None)
+                                current = None
+                    elif field_name is not None:
+                        field_value.extend(event.data)
+                        if len(field_value) > MAX_FIELD_BYTES:
+                            raise RequestEntityTooLarge()
+                        if not event.more_data:
+                            fields[field_name] = field_value.decode('utf-8', 'replace')
+                            field_name = None
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not chunk:
+                break
+    except ValueError as e:
+        # Malformed or truncated multipart body
+        if current is not None:
+            current.discard()
+        raise UploadError(str(e))
+    except Exception:
+        if current is not None:
+            current.discard()
+        raise
+
+    if current is not None:
+        # The body ended in the middle of a file
+        current.discard()
+        raise UploadError('Upload ended before the file was complete')
+    return fields
@@ -0,0 +1,210 @@
+"""Micro-benchmark: line-item rows per second, legacy parse and aggregation loops vs InvoiceExtractor
+
+Usage:
+    python benchmarks/bench_extractor.py --rows 5000 --tables 4 --repeat 5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from extractor import InvoiceExtractor, parse_float  # noqa: E402
+
+
+def make_table(rows, seed=0):
+    """Synthetic GST line-item table with a CGST/SGST Rate/Amt sub-header"""
+    rng = random.Random(seed)
+    table = [
+        ['#', 'S.No', 'Description', 'HSN/SAC', 'Qty', 'Rate', 'Disc', '', '', '', 'CGST', '', 'SGST', '', 'Amount'],
+        ['', '', '', '', '', '', '', '', '', '', '%', 'Amt', '%', 'Amt', ''],
+    ]
+    for i in range(rows):
+        amount = rng.randint(100, 100000) / 100
+        tax = amount * 0.09
+        table.append(['', str(i + 1), f'Item {i}', str(rng.choice([8536, 8537, 8544, 9405])),
+                      f'{rng.randint(1, 50)} Nos', f'{amount:,.2f}', '0', None, None, None,
+                      '9%', f'{tax:,.2f}', '9%', f'{tax:,.2f}', f'{amount:,.2f}'])
+    return table
+
+
+def legacy_extract_items(tables):
+    """Line-item loop of parse_invoice_data as it was before InvoiceExtractor"""
+    import re
+    all_items = []
+    for table in tables:
+        if not table:
+            continue
+        header_row = None
+        header_row_idx = -1
+        for idx, row in enumerate(table[:10]):
+            row_str = str(row).lower()
+            if 'description' in row_str or 'qty' in row_str or ('hsn' in row_str and 'sac' in row_str):
+                header_row = row
+                header_row_idx = idx
+                break
+        if header_row is None:
+            header_row = table[0]
+            header_row_idx = 0
+
+        col_map = {}
+
+        def find_col_idx(headers, keywords):
+            for idx, h in enumerate(headers):
+                if h and any(k in str(h).lower() for k in keywords):
+                    return idx
+            return None
+
+        col_map['sno'] = find_col_idx(header_row, ['s.no', 'serial', 'sr.', 'no.'])
+        col_map['hsn'] = find_col_idx(header_row, ['hsn', 'sac', 'code'])
+        col_map['qty'] = find_col_idx(header_row, ['qty', 'quantity', 'unit'])
+        col_map['rate'] = find_col_idx(header_row, ['rate', 'taxable', 'price'])
+        col_map['discount'] = find_col_idx(header_row, ['disc', 'less'])
+        col_map['cgst'] = find_col_idx(header_row, ['cgst'])
+        col_map['sgst'] = find_col_idx(header_row, ['sgst'])
+        col_map['amount'] = find_col_idx(header_row, ['amount', 'total', 'value'])
+
+        if header_row_idx + 1 < len(table):
+            sub_header = table[header_row_idx + 1]
+            for tax in ('cgst', 'sgst'):
+                if col_map[tax] is not None:
+                    for offset in range(3):
+                        chk_idx = col_map[tax] + offset
+                        if chk_idx < len(sub_header):
+                            val = str(sub_header[chk_idx]).lower()
+                            if 'amt' in val or 'amount' in val:
+                                col_map[f'{tax}_amt_idx'] = chk_idx
+                                break
+
+        if col_map.get('hsn') is None:
+            col_map = {'sno': 1, 'hsn': 3, 'qty': 4, 'rate': 5,
+                       'discount': 6, 'cgst': 10, 'sgst': 12, 'amount': 13}
+
+        for row_idx, row in enumerate(table):
+            if row_idx <= header_row_idx:
+                continue
+            if row_idx == header_row_idx + 1 and any(x in str(row).lower() for x in ['amt', '%']):
+                continue
+
+            def get_val(idx):
+                if idx is not None and isinstance(idx, int) and 0 <= idx < len(row):
+                    return row[idx]
+                return ''
+
+            hsn_val = get_val(col_map.get('hsn'))
+            qty_val = get_val(col_map.get('qty'))
+            rate_val = get_val(col_map.get('rate'))
+            discount_val = get_val(col_map.get('discount'))
+            cgst_val = get_val(col_map.get('cgst_amt_idx', col_map.get('cgst')))
+            sgst_val = get_val(col_map.get('sgst_amt_idx', col_map.get('sgst')))
+            if not col_map.get('cgst_amt_idx') and cgst_val and re.match(r'^\d+(\.\d+)?\s*%?$', str(cgst_val).strip()):
+                base_idx = col_map.get('cgst')
+                if base_idx is not None:
+                    for offset in [1, 2]:
+                        next_val = get_val(base_idx + offset)
+                        if next_val and re.match(r'[\d,]+\.\d{2}', str(next_val).strip()):
+                            cgst_val = next_val
+                            break
+            if not col_map.get('sgst_amt_idx') and sgst_val and re.match(r'^\d+(\.\d+)?\s*%?$', str(sgst_val).strip()):
+                base_idx = col_map.get('sgst')
+                if base_idx is not None:
+                    for offset in [1, 2]:
+                        next_val = get_val(base_idx + offset)
+                        if next_val and re.match(r'[\d,]+\.\d{2}', str(next_val).strip()):
+                            sgst_val = next_val
+                            break
+            invoice_val = get_val(col_map.get('amount'))
+            sno_val = get_val(col_map.get('sno'))
+            hsn_clean = str(hsn_val).strip().replace('\n', '').replace(' ', '')
+            if hsn_clean and re.search(r'\d{2,8}', hsn_clean):
+                item_data = {
+                    'sno': str(sno_val).strip() if sno_val else str(len(all_items) + 1),
+                    'hsn': str(hsn_val).strip(), 'quantity': '', 'taxable_amount': '',
+                    'discount': '', 'taxrate': '18%', 'cgst': '', 'sgst': '', 'invoice_value': ''
+                }
+                for field, val in (('quantity', qty_val), ('taxable_amount', rate_val), ('cgst', cgst_val),
+                                   ('sgst', sgst_val), ('invoice_value', invoice_val)):
+                    if val:
+                        match = re.search(r'([\d,]+\.?\d*)', str(val).strip())
+                        if match:
+                            item_data[field] = match.group(1)
+                if discount_val:
+                    item_data['discount'] = str(discount_val).strip()
+                all_items.append(item_data)
+    return all_items
+
+
+def legacy_aggregate(items):
+    """Per-HSN dict aggregation of parse_invoice_data as it was before LineItems"""
+    aggregated_items = {}
+    for item in items:
+        hsn = item['hsn']
+        if not hsn:
+            continue
+        agg = aggregated_items.setdefault(hsn, {'taxrate': item['taxrate'], 'quantity': 0.0,
+                                                'taxable_amount': 0.0, 'cgst': 0.0, 'sgst': 0.0})
+        agg['quantity'] += parse_float(item['quantity'])
+        agg['taxable_amount'] += parse_float(item['invoice_value'])
+        agg['cgst'] += parse_float(item['cgst'])
+        agg['sgst'] += parse_float(item['sgst'])
+
+    new_items = []
+    total = 0.0
+    for idx, (hsn, agg) in enumerate(aggregated_items.items(), 1):
+        value = agg['taxable_amount'] + agg['cgst'] + agg['sgst']
+        total += value
+        new_items.append({'sno': str(idx), 'hsn': hsn, 'quantity': f"{agg['quantity']:.2f}",
+                          'taxable_amount': f"{agg['taxable_amount']:.2f}", 'taxrate': agg['taxrate'],
+                          'cgst': f"{agg['cgst']:.2f}", 'sgst': f"{agg['sgst']:.2f}",
+                          'invoice_value': f"{value:.2f}"})
+    return new_items, f"{total:.2f}"
+
+
+def legacy_parse(tables):
+    return legacy_aggregate(legacy_extract_items(tables))
+
+
+def extractor_parse(extractor, tables):
+    common_data = {}
+    items = extractor.aggregate_items(extractor.extract_items(tables), common_data)
+    return items, common_data['calculated_total_invoice_value']
+
+
+def best_rate(func, tables, total_rows, repeat):
+    """Best rows/second over repeat runs, and the result of the last run"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(tables)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return total_rows / best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000, help='line items per table')
+    parser.add_argument('--tables', type=int, default=4, help='tables per run')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per implementation (best is reported)')
+    args = parser.parse_args()
+
+    tables = [make_table(args.rows, seed) for seed in range(args.tables)]
+    total_rows = args.rows * args.tables
+    extractor = InvoiceExtractor()
+
+    before, legacy_items = best_rate(legacy_parse, tables, total_rows, args.repeat)
+    after, items = best_rate(lambda t: extractor_parse(extractor, t), tables, total_rows, args.repeat)
+
+    if legacy_items != items:
+        print("WARNING: extractor output differs from the legacy implementation")
+    print(f"{total_rows} rows in {args.tables} table(s)")
+    print(f"before (legacy loops):     {before:12,.0f} rows/s")
+    print(f"after (InvoiceExtractor):  {after:12,.0f} rows/s")
+    print(f"speed-up:                  {after / before:12.2f}x")
+
+
+if __name__ == '__main__':
+    main()
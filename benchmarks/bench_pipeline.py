@@ -0,0 +1,234 @@
+"""Pipeline benchmark: per-stage latency, throughput and peak RSS on a synthetic invoice corpus
+
+Times extract_text_from_pdf, extract_tables_from_pdf, extract_text_with_ocr
+(scanned files only), parse_invoice_data, process_pdf (uncached, no workbook)
+and create_consolidated_excel for every file of the corpus, and optionally
+compares the timings and parsed output against a saved baseline. With --layouts,
+process_pdf learns each file's layout on its first run and reads it through the
+template after that.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--corpus DIR] [--preset quick|full] [--repeat 3]
+                                        [--save-baseline FILE] [--baseline FILE] [--tolerance 0.2]
+                                        [--layouts]
+
+The corpus is generated into --corpus (default benchmarks/corpus_<preset>) on first
+use. OCR is skipped when the tesseract executable is not available. Exits with 1
+if a stage regressed beyond the tolerance or the parsed output changed.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'app'))
+
+import pytesseract  # noqa: E402
+
+import corpus  # noqa: E402
+import pipeline  # noqa: E402
+from layouts import LayoutIndex  # noqa: E402
+from metrics import current_rss  # noqa: E402
+
+STAGES = ('extract_text', 'extract_tables', 'ocr', 'parse', 'process_pdf', 'consolidated_excel')
+RSS_SAMPLE_INTERVAL = 0.005
+
+
+class PeakRss:
+    """Highest RSS seen while the block runs, sampled on a background thread"""
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def tesseract_available():
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def measure(func, repeat):
+    """Best wall time over repeat runs, the peak RSS across them and the last result"""
+    best = None
+    result = None
+    with PeakRss() as rss:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best, rss.peak, result
+
+
+def output_digest(rows):
+    return hashlib.sha256(json.dumps(rows, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def run(corpus_dir, manifest, repeat, ocr, layouts=None):
+    """Per-stage samples ({stage: [(seconds, pages, peak_rss), ...]}) and per-file output digests"""
+    samples = {stage: [] for stage in STAGES}
+    outputs = {}
+    all_rows = []
+    ocr_options = {'workers': 1}
+
+    for entry in manifest['files']:
+        path = os.path.join(corpus_dir, entry['file'])
+        pages = entry['pages']
+
+        seconds, peak, text = measure(lambda: pipeline.extract_text_from_pdf(path), repeat)
+        samples['extract_text'].append((seconds, pages, peak))
+
+        seconds, peak, _ = measure(lambda: pipeline.extract_tables_from_pdf(path), repeat)
+        samples['extract_tables'].append((seconds, pages, peak))
+
+        if entry['scanned'] and ocr:
+            seconds, peak, text = measure(lambda: pipeline.extract_text_with_ocr(path, ocr_options), repeat)
+            samples['ocr'].append((seconds, pages, peak))
+
+        seconds, peak, rows = measure(lambda: pipeline.parse_invoice_data(text, path), repeat)
+        samples['parse'].append((seconds, pages, peak))
+
+        with tempfile.TemporaryDirectory() as output_folder:
+            seconds, peak, result = measure(
+                lambda: pipeline.process_pdf(path, entry['file'], 'bench', output_folder,
+                                             ocr_options=ocr_options, write_workbook=False,
+                                             layouts=layouts), repeat)
+        samples['process_pdf'].append((seconds, pages, peak))
+
+        outputs[entry['file']] = output_digest(result['parsed_data'])
+        all_rows.extend(result['parsed_data'])
+        print(f"  {entry['file']:<32} {pages:>3} page(s)  {len(result['parsed_data']):>4} row(s)  "
+              f"{seconds * 1000:9.1f} ms end-to-end")
+
+    total_pages = sum(entry['pages'] for entry in manifest['files'])
+    with tempfile.TemporaryDirectory() as output_folder:
+        output_path = os.path.join(output_folder, 'consolidated.xlsx')
+        seconds, peak, _ = measure(lambda: pipeline.create_consolidated_excel(all_rows, output_path), repeat)
+    samples['consolidated_excel'].append((seconds, total_pages, peak))
+
+    return samples, outputs
+
+
+def summarize(samples):
+    """Per-stage summary: files, mean/p95 latency, pages per second and peak RSS"""
+    summary = {}
+    for stage, stage_samples in samples.items():
+        if not stage_samples:
+            continue
+        times = sorted(seconds for seconds, _, _ in stage_samples)
+        total = sum(times)
+        pages = sum(pages for _, pages, _ in stage_samples)
+        summary[stage] = {
+            'files': len(times),
+            'mean_ms': round(statistics.mean(times) * 1000, 3),
+            'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1000, 3),
+            'pages_per_s': round(pages / total, 2) if total else None,
+            'peak_rss_mb': round(max(peak for _, _, peak in stage_samples) / 1024 / 1024, 1),
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f"\n{'stage':<20} {'files':>5} {'mean ms':>10} {'p95 ms':>10} {'pages/s':>10} {'peak MB':>9}")
+    for stage, values in summary.items():
+        pages_per_s = f"{values['pages_per_s']:10.2f}" if values['pages_per_s'] is not None else f"{'-':>10}"
+        print(f"{stage:<20} {values['files']:>5} {values['mean_ms']:10.1f} {values['p95_ms']:10.1f} "
+              f"{pages_per_s} {values['peak_rss_mb']:9.1f}")
+
+
+def compare(report, baseline, tolerance):
+    """Print the change against a baseline report; returns False on a regression or changed output"""
+    ok = True
+    print(f"\nAgainst baseline (tolerance {tolerance:.0%}):")
+    for stage, values in report['stages'].items():
+        before = baseline['stages'].get(stage)
+        if not before or not before['mean_ms']:
+            print(f"  {stage:<20} no baseline")
+            continue
+        ratio = values['mean_ms'] / before['mean_ms']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            ok = False
+        print(f"  {stage:<20} {before['mean_ms']:10.1f} -> {values['mean_ms']:10.1f} ms  ({ratio:5.2f}x){flag}")
+
+    changed = [name for name, digest in report['outputs'].items()
+               if name in baseline['outputs'] and baseline['outputs'][name] != digest]
+    for name in changed:
+        print(f"  OUTPUT CHANGED: {name}")
+    return ok and not changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--preset', choices=sorted(corpus.PRESETS), default='quick',
+                        help='corpus generated when --corpus does not exist yet (default: quick)')
+    parser.add_argument('--corpus', help='corpus directory (default: benchmarks/corpus_<preset>)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage and file (best is reported)')
+    parser.add_argument('--no-ocr', action='store_true', help='skip the OCR stage')
+    parser.add_argument('--baseline', help='baseline report to compare against')
+    parser.add_argument('--save-baseline', help='write this run as a baseline report')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown of a stage mean before it counts as a regression (default: 0.2)')
+    parser.add_argument('--layouts', action='store_true',
+                        help='use vendor layout templates in process_pdf (from a fresh index)')
+    args = parser.parse_args()
+
+    corpus_dir = args.corpus or os.path.join(BENCH_DIR, f'corpus_{args.preset}')
+    manifest = corpus.load_or_generate(corpus_dir, args.preset)
+    ocr = not args.no_ocr and tesseract_available()
+    if not ocr and any(entry['scanned'] for entry in manifest['files']):
+        print("OCR stage skipped (tesseract not available or --no-ocr)")
+
+    print(f"{len(manifest['files'])} file(s) from {corpus_dir}, best of {args.repeat}")
+    with tempfile.TemporaryDirectory() as layout_dir:
+        layouts = LayoutIndex(os.path.join(layout_dir, 'layouts.db')) if args.layouts else None
+        samples, outputs = run(corpus_dir, manifest, args.repeat, ocr, layouts)
+    report = {
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'corpus': manifest,
+        'stages': summarize(samples),
+        'outputs': outputs,
+    }
+    print_summary(report['stages'])
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline['environment'] != report['environment']:
+            print("\nWARNING: baseline was recorded on a different environment")
+        if not compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
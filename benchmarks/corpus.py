@@ -0,0 +1,278 @@
+"""Synthetic GST invoice corpus for the benchmarks: digital, scanned and large-table PDFs
+
+Digital invoices are written with a minimal PDF writer (Helvetica text plus ruled
+table grids that pdfplumber detects), so no extra dependencies are needed.
+Scanned variants are the digital pages rasterized with pdfplumber and saved as
+image-only PDFs with Pillow. Generation is deterministic for a given seed.
+
+Usage:
+    python benchmarks/corpus.py OUTPUT_DIR [--preset quick|full]
+    python benchmarks/corpus.py OUTPUT_DIR --pages 3 --items 60 --layout rate_amt --scanned --count 5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import pdfplumber  # noqa: E402
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 20
+FONT_SIZE = 7
+ROW_HEIGHT = 14
+TABLE_TOP = PAGE_HEIGHT - 190  # Below the invoice header block
+TABLE_BOTTOM = 90  # Leaves room for the totals on the last page
+SCAN_RESOLUTION = 150
+MANIFEST_NAME = 'corpus.json'
+
+# Line-item table layouts: header rows and the relative column widths
+LAYOUTS = {
+    # CGST/SGST each split into Rate/Amt sub-columns under a second header row
+    'rate_amt': {
+        'header': [['S.No', 'Description', 'HSN/SAC', 'Qty', 'Rate', 'CGST', '', 'SGST', '', 'Amount'],
+                   ['', '', '', '', '', '%', 'Amt', '%', 'Amt', '']],
+        'widths': [30, 150, 55, 40, 60, 30, 55, 30, 55, 65],
+    },
+    # One amount column per tax and a single header row
+    'single': {
+        'header': [['S.No', 'Description', 'HSN/SAC', 'Qty', 'Taxable Value', 'CGST Amt', 'SGST Amt', 'Amount']],
+        'widths': [30, 165, 55, 40, 75, 65, 65, 75],
+    },
+    # The original 15-column format that FALLBACK_COLUMNS describes
+    'legacy': {
+        'header': [['#', 'S.No', 'Description', 'HSN/SAC', 'Qty', 'Rate', 'Disc', 'X', 'Y', 'Z',
+                    'CGST', '', 'SGST', '', 'Amount'],
+                   ['', '', '', '', '', '', '', '', '', '', '%', 'Amt', '%', 'Amt', '']],
+        'widths': [15, 25, 95, 40, 25, 45, 25, 15, 15, 15, 25, 45, 25, 45, 55],
+    },
+}
+
+# Named corpora: (name, pages, items, layout, scanned)
+PRESETS = {
+    'quick': [
+        ('digital_rate_amt', 1, 12, 'rate_amt', False),
+        ('digital_single', 1, 12, 'single', False),
+        ('digital_legacy', 1, 12, 'legacy', False),
+        ('digital_multipage', 3, 90, 'rate_amt', False),
+        ('scanned_rate_amt', 1, 12, 'rate_amt', True),
+    ],
+    'full': [
+        ('digital_rate_amt', 1, 12, 'rate_amt', False),
+        ('digital_single', 1, 12, 'single', False),
+        ('digital_legacy', 1, 12, 'legacy', False),
+        ('digital_multipage', 3, 90, 'rate_amt', False),
+        ('large_table', 20, 700, 'rate_amt', False),
+        ('large_table_single', 20, 700, 'single', False),
+        ('scanned_rate_amt', 1, 12, 'rate_amt', True),
+        ('scanned_multipage', 3, 90, 'single', True),
+    ],
+}
+
+HSN_CODES = ('8536', '8537', '8544', '9405', '8504', '3917')
+TAX_RATES = (2.5, 6, 9, 14)
+
+
+def pdf_string(text):
+    """Text escaped for a PDF literal string"""
+    return '(' + str(text).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def write_pdf(path, pages):
+    """Write a PDF whose pages are lists of content stream operators (strings)"""
+    # Object numbers: 1 catalog, 2 page tree, 3 font, then a (page, content) pair per page
+    objects = {
+        1: '<< /Type /Catalog /Pages 2 0 R >>',
+        3: '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    }
+    kids = []
+    for i, operators in enumerate(pages):
+        page_num, content_num = 4 + 2 * i, 5 + 2 * i
+        stream = '\n'.join(operators).encode('latin-1')
+        objects[page_num] = (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+                             f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_num} 0 R >>')
+        objects[content_num] = stream
+        kids.append(f'{page_num} 0 R')
+    objects[2] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(pages)} >>'
+
+    with open(path, 'wb') as file:
+        file.write(b'%PDF-1.4\n')
+        offsets = {}
+        for number in sorted(objects):
+            offsets[number] = file.tell()
+            body = objects[number]
+            file.write(f'{number} 0 obj\n'.encode())
+            if isinstance(body, bytes):
+                file.write(f'<< /Length {len(body)} >>\nstream\n'.encode() + body + b'\nendstream')
+            else:
+                file.write(body.encode('latin-1'))
+            file.write(b'\nendobj\n')
+        xref = file.tell()
+        count = max(objects) + 1
+        file.write(f'xref\n0 {count}\n0000000000 65535 f \n'.encode())
+        for number in range(1, count):
+            file.write(f'{offsets[number]:010d} 00000 n \n'.encode())
+        file.write(f'trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode())
+
+
+def text_op(x, y, text, size=FONT_SIZE):
+    return f'BT /F1 {size} Tf {x:.1f} {y:.1f} Td {pdf_string(text)} Tj ET'
+
+
+def table_ops(rows, widths, top):
+    """Content operators for a fully ruled table whose top edge is at y=top"""
+    scale = (PAGE_WIDTH - 2 * MARGIN) / sum(widths)
+    xs = [MARGIN]
+    for width in widths:
+        xs.append(xs[-1] + width * scale)
+    bottom = top - ROW_HEIGHT * len(rows)
+
+    ops = ['0.5 w']
+    for i in range(len(rows) + 1):
+        y = top - i * ROW_HEIGHT
+        ops.append(f'{xs[0]:.1f} {y:.1f} m {xs[-1]:.1f} {y:.1f} l S')
+    for x in xs:
+        ops.append(f'{x:.1f} {top:.1f} m {x:.1f} {bottom:.1f} l S')
+    for r, row in enumerate(rows):
+        y = top - (r + 1) * ROW_HEIGHT + 4
+        for c, cell in enumerate(row):
+            if cell:
+                ops.append(text_op(xs[c] + 2, y, cell))
+    return ops, bottom
+
+
+def make_items(count, rng):
+    items = []
+    for i in range(count):
+        quantity = rng.randint(1, 50)
+        taxable = rng.randint(1000, 2000000) / 100
+        rate = rng.choice(TAX_RATES)
+        tax = round(taxable * rate / 100, 2)
+        items.append({
+            'sno': i + 1, 'description': f'Item {i + 1} {rng.choice(("Cable", "Switch", "Panel", "Lamp"))}',
+            'hsn': rng.choice(HSN_CODES), 'quantity': quantity, 'taxable': taxable,
+            'rate': rate, 'tax': tax, 'amount': round(taxable + 2 * tax, 2),
+        })
+    return items
+
+
+def item_row(item, layout):
+    if layout == 'rate_amt':
+        return [str(item['sno']), item['description'], item['hsn'], str(item['quantity']),
+                f"{item['taxable']:,.2f}", f"{item['rate']:g}%", f"{item['tax']:,.2f}",
+                f"{item['rate']:g}%", f"{item['tax']:,.2f}", f"{item['amount']:,.2f}"]
+    if layout == 'single':
+        return [str(item['sno']), item['description'], item['hsn'], str(item['quantity']),
+                f"{item['taxable']:,.2f}", f"{item['tax']:,.2f}", f"{item['tax']:,.2f}", f"{item['amount']:,.2f}"]
+    return ['', str(item['sno']), item['description'], item['hsn'], str(item['quantity']),
+            f"{item['taxable']:,.2f}", '0', '', '', '', f"{item['rate']:g}%", f"{item['tax']:,.2f}",
+            f"{item['rate']:g}%", f"{item['tax']:,.2f}", f"{item['amount']:,.2f}"]
+
+
+def invoice_pages(pages, items, layout, seed):
+    """Content operators for each page of one synthetic invoice"""
+    rng = random.Random(seed)
+    spec = LAYOUTS[layout]
+    line_items = make_items(items, rng)
+    invoice_no = f'INV-{2024 + seed % 3}/{rng.randint(1, 9999):04d}'
+    date = f'{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024'
+    receiver = rng.choice(('Sharma Electricals', 'Gupta Traders', 'Verma & Sons', 'Mehta Industries'))
+    seller_gst = f'09{"".join(rng.choice("ABCDEFGHJK") for _ in range(5))}{rng.randint(1000, 9999)}A1Z5'
+    receiver_gst = f'07{"".join(rng.choice("ABCDEFGHJK") for _ in range(5))}{rng.randint(1000, 9999)}F1Z9'
+
+    # Spread the items evenly over the requested pages
+    per_page = -(-len(line_items) // pages) if line_items else 0
+    content = []
+    for page in range(pages):
+        ops = []
+        top = PAGE_HEIGHT - 40
+        if page == 0:
+            header = ['ACME TRADERS', f'GSTIN: {seller_gst}', f'Invoice #: {invoice_no}',
+                      f'Invoice Date: {date}', 'Bill To:', f'M/s {receiver}', f'GSTIN: {receiver_gst}']
+            for i, line in enumerate(header):
+                ops.append(text_op(MARGIN, top - i * 16, line, size=10))
+        else:
+            ops.append(text_op(MARGIN, top, f'Invoice #: {invoice_no} (continued)', size=10))
+
+        page_items = line_items[page * per_page:(page + 1) * per_page]
+        rows = spec['header'] + [item_row(item, layout) for item in page_items]
+        table, bottom = table_ops(rows, spec['widths'], TABLE_TOP)
+        if bottom < TABLE_BOTTOM:
+            raise ValueError(f"{len(page_items)} items do not fit on one page; use more pages")
+        ops += table
+
+        if page == pages - 1:
+            taxable = sum(item['taxable'] for item in line_items)
+            tax = sum(item['tax'] for item in line_items)
+            rate = line_items[0]['rate'] if line_items else 9
+            total = taxable + 2 * tax
+            totals = [f'CGST{rate:g} ({rate:g}%) {tax:,.2f}', f'SGST{rate:g} ({rate:g}%) {tax:,.2f}',
+                      f'Total: Rs. {total:,.2f}', f'Balance Due: Rs. {total:,.2f}']
+            for i, line in enumerate(totals):
+                ops.append(text_op(MARGIN, bottom - 16 - i * 12, line, size=9))
+        content.append(ops)
+    return content
+
+
+def rasterize(pdf_path, output_path, resolution=SCAN_RESOLUTION):
+    """Image-only copy of a PDF, as a scanner would produce"""
+    images = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            images.append(page.to_image(resolution=resolution).original.convert('L'))
+    images[0].save(output_path, 'PDF', resolution=resolution, save_all=True, append_images=images[1:])
+
+
+def generate(directory, specs, seed=0):
+    """Write the invoices in specs to directory and return the corpus manifest"""
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    for i, (name, pages, items, layout, scanned) in enumerate(specs):
+        path = os.path.join(directory, f'{name}.pdf')
+        write_pdf(path, invoice_pages(pages, items, layout, seed + i))
+        if scanned:
+            rasterize(path, path)
+        entries.append({'file': os.path.basename(path), 'pages': pages, 'items': items,
+                        'layout': layout, 'scanned': scanned})
+
+    manifest = {'seed': seed, 'files': entries}
+    with open(os.path.join(directory, MANIFEST_NAME), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def load_or_generate(directory, preset='quick', seed=0):
+    """Corpus manifest for directory, generating the preset if it does not exist yet"""
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    return generate(directory, PRESETS[preset], seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output', help='corpus directory')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick')
+    parser.add_argument('--pages', type=int, help='custom corpus: pages per invoice')
+    parser.add_argument('--items', type=int, default=20, help='custom corpus: line items per invoice')
+    parser.add_argument('--layout', choices=sorted(LAYOUTS), default='rate_amt')
+    parser.add_argument('--scanned', action='store_true', help='custom corpus: rasterize the invoices')
+    parser.add_argument('--count', type=int, default=1, help='custom corpus: number of invoices')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.pages:
+        kind = 'scanned' if args.scanned else 'digital'
+        specs = [(f'{kind}_{args.layout}_{args.pages}p_{args.items}i_{n}', args.pages, args.items,
+                  args.layout, args.scanned) for n in range(args.count)]
+    else:
+        specs = PRESETS[args.preset]
+    manifest = generate(args.output, specs, args.seed)
+    print(f"Wrote {len(manifest['files'])} invoice(s) to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Gunicorn settings for running the web app with several worker processes
+
+Run from the project root (this file is picked up automatically):
+
+    gunicorn
+
+The app module and its heavy imports (pandas, pdfplumber, PyPDF2, PIL, NumPy) are
+loaded once in the master and the workers are forked from it, so they share those
+pages. Unfinished jobs of the previous run are failed once in the master before
+any worker starts (on_starting). Each worker runs
+its own job threads and OCR pool, sized so that all workers together use about
+one OCR process per core.
+
+Environment variables: BILL_BIND (default 0.0.0.0:5000), BILL_WEB_WORKERS,
+BILL_WEB_THREADS and BILL_GRACEFUL_TIMEOUT (seconds a stopping worker waits for
+its jobs). App settings such as BILL_SECRET_KEY, BILL_JOB_WORKERS or
+BILL_OCR_WORKERS are read by the app itself (see app/app.py).
+"""
+import os
+
+cpus = os.cpu_count() or 1
+
+wsgi_app = 'app:app'
+pythonpath = 'app'
+bind = os.environ.get('BILL_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('BILL_WEB_WORKERS', min(4, cpus)))
+# Threads keep a worker responsive to status polls and downloads while uploads stream in
+worker_class = 'gthread'
+threads = int(os.environ.get('BILL_WEB_THREADS', 8))
+preload_app = True
+# Uploads of large batches can take a while to stream
+timeout = 300
+# A stopping worker lets its queued and running jobs finish for up to this long
+graceful_timeout = int(os.environ.get('BILL_GRACEFUL_TIMEOUT', 600))
+
+# Per-worker limits for CPU-bound extraction unless set explicitly
+os.environ.setdefault('BILL_OCR_WORKERS', str(max(1, cpus // workers)))
+os.environ.setdefault('BILL_JOB_WORKERS', '2')
+
+
+def on_starting(server):
+    """Fail the jobs a previous run left unfinished, before any worker takes new ones"""
+    import app
+    app.job_queue.fail_interrupted()
+
+
+def worker_exit(server, worker):
+    """Finish this worker's jobs before it exits"""
+    import app
+    server.log.info("Worker %s finishing its jobs", worker.pid)
+    app.shutdown(wait=True)
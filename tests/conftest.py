@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The app's modules import each other by their flat names; corpus.py writes the test invoices
+sys.path[:0] = [os.path.join(ROOT, 'app'), os.path.join(ROOT, 'benchmarks')]
+
+import corpus  # noqa: E402
+
+
+@pytest.fixture
+def make_invoice(tmp_path):
+    """Writes a one-page digital GST invoice from the benchmark corpus and returns its path"""
+    def make(name='invoice', items=8, layout='rate_amt', seed=0):
+        path = str(tmp_path / f'{name}.pdf')
+        corpus.write_pdf(path, corpus.invoice_pages(1, items, layout, seed))
+        return path
+    return make
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The Flask app module, configured to keep its data, uploads and outputs in a temp directory"""
+    root = tmp_path_factory.mktemp('app')
+    for name in ('DATA_FOLDER', 'UPLOAD_FOLDER', 'PROCESSED_FOLDER'):
+        os.environ[f'BILL_{name}'] = str(root / name.split('_')[0].lower())
+    import app
+    yield app
+    app.shutdown()
+
+
+def wait_for_job(job_queue, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while job_queue.status(job_id)['status'] not in ('done', 'error'):
+        assert time.time() < deadline, f"job {job_id} did not finish"
+        time.sleep(0.05)
+    return job_queue.status(job_id)
+
+
+def submit(job_queue, paths, **options):
+    """Queue one job for the files at paths and return its ID once it has finished"""
+    job_id = job_queue.submit([(path, os.path.basename(path), str(uuid.uuid4())) for path in paths], **options)
+    wait_for_job(job_queue, job_id)
+    return job_id
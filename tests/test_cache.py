@@ -0,0 +1,50 @@
+import pytest
+
+from cache import EXTRACTION_VERSION, ExtractionCache, file_sha256
+from pipeline import extraction_options_digest, process_pdf
+
+
+def test_key_includes_version_and_options_digest(tmp_path):
+    cache = ExtractionCache(str(tmp_path))
+    assert cache.key('ab' * 32) == f"{'ab' * 32}-v{EXTRACTION_VERSION}"
+    assert cache.key('ab' * 32, 'd1') == f"{'ab' * 32}-v{EXTRACTION_VERSION}-d1"
+    assert cache.key('ab' * 32, 'd1') != cache.key('ab' * 32, 'd2')
+
+
+def test_options_digest_follows_result_changing_options():
+    default = extraction_options_digest()
+    assert extraction_options_digest({}, {}) == default
+    # Settings equal to the resolved defaults give the same results
+    assert extraction_options_digest({'settings': None}) == default
+    assert extraction_options_digest({'crop': True}) != default
+    assert extraction_options_digest({'settings': {'snap_tolerance': 6}}) != default
+    assert extraction_options_digest(ocr_options={'resolutions': (150,)}) != default
+    assert extraction_options_digest(ocr_options={'engine': 'pytesseract'}) != default
+    # Pool sizes only change how fast the same results are read
+    assert extraction_options_digest(ocr_options={'workers': 4, 'max_pages_in_memory': 1}) == default
+
+
+def test_changed_options_miss_the_cache(tmp_path, make_invoice):
+    path = make_invoice()
+    cache = ExtractionCache(str(tmp_path / 'cache'))
+
+    def run(**options):
+        return process_pdf(path, 'invoice.pdf', 'u1', str(tmp_path), cache=cache, write_workbook=False, **options)
+
+    first = run()
+    assert not first['cache_hit']
+    again = run(ocr_options={'workers': 1})
+    assert again['cache_hit']
+    assert again['parsed_data'] == first['parsed_data']
+    assert not run(table_options={'crop': True})['cache_hit']
+    assert cache.stats()['entries'] == 2
+
+
+def test_unreadable_pdf_is_not_cached(tmp_path):
+    path = tmp_path / 'broken.pdf'
+    path.write_bytes(b'%PDF-1.4\nnot really a pdf')
+    cache = ExtractionCache(str(tmp_path / 'cache'))
+    with pytest.raises(ValueError):
+        process_pdf(str(path), 'broken.pdf', 'u1', str(tmp_path), cache=cache, write_workbook=False)
+    assert cache.stats()['entries'] == 0
+    assert cache.get(cache.key(file_sha256(str(path)), extraction_options_digest())) is None
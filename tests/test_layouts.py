@@ -0,0 +1,51 @@
+from document import PdfDocument
+from layouts import LayoutIndex, fingerprint
+
+
+def learned_index(tmp_path, path):
+    index = LayoutIndex(str(tmp_path / 'layouts.db'))
+    with PdfDocument(path) as document:
+        layout, template = index.apply(document)
+        assert layout is not None and template is None
+        assert index.learn(document, layout)
+    return index, layout
+
+
+def test_known_layout_uses_its_template(tmp_path, make_invoice):
+    path = make_invoice()
+    index, layout = learned_index(tmp_path, path)
+    with PdfDocument(path) as document:
+        found, template = index.apply(document)
+        assert found.key == layout.key
+        assert template is not None
+        assert document.layout is template
+    assert index.stats()['uses'] == 1
+
+
+def test_stale_template_is_dropped(tmp_path, make_invoice):
+    path = make_invoice()
+    index, layout = learned_index(tmp_path, path)
+    # The vendor moved a column under the same fingerprint
+    template = index.get(layout.key)
+    template['column_map']['qty'], template['column_map']['rate'] = 4, 3
+    index.put(layout, template)
+
+    with PdfDocument(path) as document:
+        found, template = index.apply(document)
+        assert found.key == layout.key
+        assert template is None
+        # Full table detection, and the layout is learned again from this document
+        assert document.layout is None
+        assert index.stats()['layouts'] == 0
+        assert index.learn(document, found)
+    assert index.stats()['layouts'] == 1
+
+
+def test_unlearnable_layout_is_not_retried(tmp_path, make_invoice):
+    path = make_invoice()
+    index = LayoutIndex(str(tmp_path / 'layouts.db'))
+    with PdfDocument(path) as document:
+        index.put_unlearnable(fingerprint(document))
+        assert index.apply(document) == (None, None)
+        assert document.layout is None
+    assert index.stats() == {'layouts': 0, 'uses': 0, 'unlearnable': 1}
@@ -0,0 +1,131 @@
+import csv
+import os
+import sqlite3
+import subprocess
+import sys
+import uuid
+from contextlib import closing
+
+import pytest
+
+from conftest import submit
+from invoices import InvoiceIndex
+from jobs import JobQueue
+
+LOCK_PROBE = """import fcntl, sys
+with open(sys.argv[1], 'a') as lock_file:
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        print('acquired')
+    except BlockingIOError:
+        print('blocked')
+"""
+
+
+class RowsWriter:
+    def write_rows(self, rows):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    """Job queue whose files each parse to three rows of one invoice, without reading a PDF"""
+    def process_file(file_path, filename, unique_id, sha256=None):
+        rows = [{'invoice_no': f'INV-{unique_id}' if idx == 0 else '', 'hsn': '8471', 'amount': idx}
+                for idx in range(3)]
+        return {'filename': filename, 'unique_id': unique_id, 'parsed_data': rows}
+
+    db_path = str(tmp_path / 'jobs.db')
+    queue = JobQueue(db_path, process_file, lambda job_id, **options: RowsWriter(), workers=1,
+                     invoice_index=InvoiceIndex(db_path))
+    yield queue
+    queue.shutdown()
+
+
+def commit_write(db_path):
+    """Commits a write on a new connection that does not wait for locks; raises if a read holds one"""
+    with closing(sqlite3.connect(db_path, timeout=0)) as conn:
+        conn.execute("UPDATE jobs SET error = error")
+        conn.commit()
+
+
+def test_set_rows_read_does_not_block_commits(tmp_path, job_queue):
+    for name in ('a', 'b'):
+        submit(job_queue, [str(tmp_path / f'{name}.pdf')], set_name='s1')
+    rows = job_queue.iter_set_rows('s1', page_size=1)
+    read = [next(rows)]
+    commit_write(job_queue.db_path)
+    read += list(rows)
+    assert len(read) == 6
+
+
+def test_invoice_rows_read_does_not_block_commits(tmp_path, job_queue):
+    submit(job_queue, [str(tmp_path / 'a.pdf'), str(tmp_path / 'b.pdf')])
+    rows = job_queue.invoice_index.iter_rows(page_size=1)
+    read = [next(rows)]
+    commit_write(job_queue.db_path)
+    read += list(rows)
+    assert len(read) == 6
+
+
+@pytest.fixture
+def invoice_set(app_module, make_invoice):
+    """Name of a consolidation set in the app's job queue holding one invoice"""
+    set_name = f'set-{uuid.uuid4().hex[:8]}'
+    submit(app_module.job_queue, [make_invoice('first', seed=1)], set_name=set_name, output_format='csv')
+    return set_name
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as file:
+        return list(csv.reader(file))
+
+
+def test_set_output_is_appended_to(app_module, invoice_set, make_invoice):
+    queue = app_module.job_queue
+    first = read_csv(app_module.build_set_output(invoice_set, 'csv'))
+    submit(queue, [make_invoice('second', seed=2)], set_name=invoice_set, output_format='csv')
+    path = app_module.build_set_output(invoice_set, 'csv')
+    appended = read_csv(path)
+    assert appended[:len(first)] == first and len(appended) > len(first)
+    assert queue.set_output(invoice_set, 'csv')[1] == queue.set_jobs(invoice_set)[-1]['set_seq']
+    # Rewritten from the stored rows, the file is the same
+    os.remove(path)
+    assert read_csv(app_module.build_set_output(invoice_set, 'csv')) == appended
+
+
+def test_failed_set_output_keeps_the_previous_file(app_module, invoice_set, make_invoice, monkeypatch):
+    queue = app_module.job_queue
+    path = app_module.build_set_output(invoice_set, 'csv')
+    before = read_csv(path)
+    saved = queue.set_output(invoice_set, 'csv')
+    submit(queue, [make_invoice('second', seed=2)], set_name=invoice_set, output_format='csv')
+
+    iter_set_rows = queue.iter_set_rows
+
+    def failing(*args, **kwargs):
+        yield from iter_set_rows(*args, **kwargs)
+        raise OSError('disk full')
+
+    monkeypatch.setattr(queue, 'iter_set_rows', failing)
+    assert app_module.build_set_output(invoice_set, 'csv') is None
+    assert read_csv(path) == before
+    assert queue.set_output(invoice_set, 'csv') == saved
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith('.tmp')]
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='flock is not available')
+def test_shared_output_lock_excludes_other_processes(app_module):
+    name = f'{uuid.uuid4()}_set.csv'
+    lock_path = os.path.join(app_module.LOCK_FOLDER, name + '.lock')
+
+    def probe():
+        return subprocess.run([sys.executable, '-c', LOCK_PROBE, lock_path],
+                              capture_output=True, text=True, check=True).stdout.strip()
+
+    with app_module.shared_output_lock(name):
+        assert probe() == 'blocked'
+    assert probe() == 'acquired'
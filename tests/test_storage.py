@@ -0,0 +1,72 @@
+import os
+import time
+
+from storage import FileStore
+
+UUID = '3f2c1a9e-8b7d-4c6e-9f0a-1b2c3d4e5f60'
+
+
+def store_file(store, name, size, age, now):
+    path = store.path(name)
+    with open(path, 'wb') as file:
+        file.write(b'x' * size)
+    os.utime(path, (now - age, now - age))
+    return path
+
+
+def test_shard_uses_the_uuid():
+    assert FileStore.shard(f'{UUID}_invoice.pdf') == '3f'
+    assert FileStore.shard(f'consolidated_{UUID}.xlsx') == '3f'
+    assert FileStore.shard(f'invoices_{UUID}.csv') == '3f'
+    assert FileStore.shard(f'{UUID}_extracted.xlsx') == '3f'
+    # Set outputs are named by a SHA-1 digest, which is not taken for a kind prefix
+    assert FileStore.shard('ab12cd34_set.csv') == 'ab'
+
+
+def test_find_checks_the_flat_layout(tmp_path):
+    store = FileStore(str(tmp_path))
+    flat = tmp_path / f'{UUID}_old.pdf'
+    flat.write_bytes(b'x')
+    assert store.find(flat.name) == str(flat)
+    assert store.find(f'{UUID}_missing.pdf') is None
+
+
+def test_sweep_deletes_expired_files(tmp_path):
+    now = time.time()
+    store = FileStore(str(tmp_path), max_age=3600)
+    old = store_file(store, f'{UUID}_old.pdf', 10, 7200, now)
+    new = store_file(store, f'{UUID}_new.pdf', 10, 60, now)
+    stats = store.sweep(now)
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+    assert stats == {'files': 2, 'bytes': 20, 'deleted_files': 1, 'deleted_bytes': 10}
+
+
+def test_sweep_deletes_oldest_files_over_the_size_limit(tmp_path):
+    now = time.time()
+    store = FileStore(str(tmp_path), max_bytes=25, min_age=600)
+    oldest = store_file(store, f'{UUID}_a.pdf', 10, 3000, now)
+    older = store_file(store, f'{UUID}_b.pdf', 10, 2000, now)
+    recent = store_file(store, f'{UUID}_c.pdf', 10, 1000, now)
+    store.sweep(now)
+    assert not os.path.exists(oldest)
+    assert os.path.exists(older) and os.path.exists(recent)
+
+
+def test_sweep_keeps_files_younger_than_min_age(tmp_path):
+    now = time.time()
+    store = FileStore(str(tmp_path), max_bytes=5, min_age=600)
+    young = store_file(store, f'{UUID}_a.pdf', 10, 60, now)
+    assert store.sweep(now)['deleted_files'] == 0
+    assert os.path.exists(young)
+
+
+def test_sweep_skips_dotfiles(tmp_path):
+    now = time.time()
+    store = FileStore(str(tmp_path), max_age=3600, max_bytes=0, min_age=0)
+    keep = tmp_path / '.gitkeep'
+    keep.write_bytes(b'')
+    os.utime(keep, (now - 7200, now - 7200))
+    stats = store.sweep(now)
+    assert keep.exists()
+    assert stats['files'] == 0